@@ -1,8 +1,6 @@
 from pathlib import Path
 import os
 from decouple import config
-import firebase_admin
-from firebase_admin import credentials
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -36,6 +34,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'reports.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -77,6 +76,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'mawonelo_backend.wsgi.application'
+ASGI_APPLICATION = 'mawonelo_backend.asgi.application'
 
 DATABASES = {
     'default': {
@@ -98,8 +98,58 @@ CACHES = {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'unique-snowflake',
         'TIMEOUT': 300,  # 5 minutos
-    }
+    },
+    # Cache de documentos de usuários do Firebase (reports.firebase)
+    'firebase_users': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'firebase-users',
+        'TIMEOUT': config('FIREBASE_USER_CACHE_TIMEOUT', default=60, cast=int),
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,  # LRU: descarta os menos usados quando enche
+        },
+    },
+}
+
+# Cache de respostas das views de ranking e clientes (reports.response_cache).
+# Em produção com vários processos aponte 'default' para Redis/Memcached.
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TTLS = {
+    'ranking_dashboard': 30,
+    'current_ranking': 30,
+    'ranking_stats': 60,
+    'previous_winners': 3600,  # só muda na virada do mês
+    'list_firebase_users': 30,
 }
+RESPONSE_CACHE_STALE_TTL = 60
+
+# Origem das leituras de usuários do Firebase: 'firestore' ou 'mirror'
+# (tabela local firebase_users, ver reports.mirror)
+FIREBASE_USERS_READ_SOURCE = config('FIREBASE_USERS_READ_SOURCE', default='firestore')
+
+# Ative depois de correr 'manage.py build_phone_index': a partir daí a
+# unicidade e a busca por telefone usam apenas phone_index/{telefone}
+FIREBASE_PHONE_INDEX_COMPLETE = config('FIREBASE_PHONE_INDEX_COMPLETE', default=False, cast=bool)
+
+# Top-K do ranking do mês mantido em memória (reports.leaderboard)
+RANKING_LEADERBOARD_SIZE = 1000
+# Cada worker mantém o seu top-K e recarrega-o quando a versão da tag 'ranking'
+# no cache muda (outro worker alterou pontos). Com o LocMemCache essa versão não
+# é partilhada e um worker pode servir até RANKING_LEADERBOARD_TTL segundos de
+# dados desatualizados; com Redis/Memcached o atraso fica limitado à escrita.
+RANKING_LEADERBOARD_TTL = 300  # segundos até recarregar do Firestore
+
+# Modo write-behind: add_ranking_points enfileira os pontos na tabela
+# ranking_points_queue e 'manage.py flush_ranking_queue --loop' grava em lote
+RANKING_WRITE_BEHIND = config('RANKING_WRITE_BEHIND', default=False, cast=bool)
+RANKING_QUEUE_FLUSH_DELAY = 2  # segundos que uma linha espera antes do flush
+
+# O snapshot mensal (POST ranking/snapshot/) corre numa thread em segundo plano
+RANKING_SNAPSHOT_ASYNC = True
+RANKING_SNAPSHOT_STALE_AFTER = 900  # segundos até um job parado poder ser reiniciado
+
+# Métricas por pedido (reports.metrics): cabeçalho Server-Timing e
+# histogramas por endpoint em /api/metrics/ (formato Prometheus)
+REQUEST_METRICS_ENABLED = config('REQUEST_METRICS_ENABLED', default=True, cast=bool)
 
 # Timeout global para views
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
@@ -107,12 +157,22 @@ FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 
 AUTH_USER_MODEL = 'users.CustomUser'
 
-# Firebase configuration
+# Atividades de usuários mais antigas do que isto são movidas para o arquivo
+# mensal (user_activity_archive) por 'manage.py archive_user_activities'
+USER_ACTIVITY_RETENTION_DAYS = config('USER_ACTIVITY_RETENTION_DAYS', default=180, cast=int)
+
+# users.activities.log_activity junta as atividades e grava-as em lote
+# (bulk_create) em segundo plano; False grava cada uma dentro do pedido
+USER_ACTIVITY_LOG_ASYNC = True
+USER_ACTIVITY_BUFFER_SIZE = 100
+USER_ACTIVITY_FLUSH_INTERVAL = 2  # segundos
+
+# Firebase configuration: a app é inicializada no primeiro uso (reports.backends)
 FIREBASE_CRED_PATH = os.path.join(BASE_DIR, 'serviceAccount.json')
 
-if not firebase_admin._apps:
-    cred = credentials.Certificate(FIREBASE_CRED_PATH)
-    firebase_admin.initialize_app(cred)
+# Backend do Firestore: 'firestore', 'memory' (em memória, para testes e
+# benchmarks offline) ou caminho pontuado para uma função que cria o cliente
+FIREBASE_BACKEND = config('FIREBASE_BACKEND', default='firestore')
 
 
 AUTH_PASSWORD_VALIDATORS = [
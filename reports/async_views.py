@@ -0,0 +1,163 @@
+"""
+Views assíncronas (ASGI) para os endpoints de leitura mais pesados.
+Respondem o mesmo que as views síncronas de reports.views, mas sobre
+reports.firebase_async: vários RPCs ao Firestore em curso por processo.
+"""
+import asyncio
+import functools
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import firebase_async
+from .pagination import decode_cursor, encode_cursor, parse_page_size
+from .snapshots import start_ranking_stats_job
+
+
+def _json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status)
+
+
+def _check_permissions(request):
+    """
+    Aplica a autenticação e as permissões padrão do DRF (Token + IsAdminUser).
+    Devolve uma resposta de erro ou None.
+    """
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        for permission_class in api_settings.DEFAULT_PERMISSION_CLASSES:
+            permission = permission_class()
+            if not permission.has_permission(drf_request, None):
+                if drf_request.successful_authenticator is None:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied(getattr(permission, 'message', None))
+    except exceptions.APIException as exc:
+        return _json_response({'detail': exc.detail}, status=exc.status_code)
+    return None
+
+
+def async_api_view(view):
+    """
+    Equivalente assíncrono de @api_view(['GET']): autentica e devolve JSON.
+    A view devolve os dados (ou dados, status).
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return _json_response({'detail': f'Método "{request.method}" não permitido.'}, status=405)
+
+        error = await sync_to_async(_check_permissions)(request)
+        if error is not None:
+            return error
+
+        result = await view(request, *args, **kwargs)
+        data, status = result if isinstance(result, tuple) else (result, 200)
+        return _json_response(data, status=status)
+
+    return wrapper
+
+
+@async_api_view
+async def list_firebase_users(request):
+    """
+    Versão assíncrona de /api/clients/ (paginação por cursor, sem stream).
+    """
+    try:
+        page_size = parse_page_size(request.GET.get('page_size'))
+        cursor = request.GET.get('cursor')
+        start_after = decode_cursor(cursor).get('id') if cursor else None
+    except ValueError as ve:
+        return {'error': str(ve)}, 400
+
+    users = await firebase_async.get_users_page(page_size, start_after)
+    next_cursor = encode_cursor({'id': users[-1]['id']}) if len(users) == page_size else None
+
+    return {
+        'results': users,
+        'next': next_cursor,
+        'page_size': page_size
+    }
+
+
+@async_api_view
+async def ranking_dashboard(request):
+    try:
+        # As quatro leituras são independentes: seguem em paralelo
+        total_ranking_users, total_users, current_ranking, previous_winners = await asyncio.gather(
+            firebase_async.count_ranking_users(),
+            firebase_async.count_users(),
+            firebase_async.get_current_ranking(limit=10),
+            firebase_async.get_previous_month_winners(),
+        )
+
+        return {
+            'total_ranking_users': total_ranking_users,
+            'total_users': total_users,
+            'current_ranking': current_ranking,
+            'previous_winners': previous_winners[:5],
+            'ranking_percentage': round((total_ranking_users / total_users * 100), 2) if total_users > 0 else 0,
+            'status': 'success',
+            'performance_optimized': True
+        }
+
+    except Exception as e:
+        return {
+            'total_ranking_users': 0,
+            'total_users': 0,
+            'current_ranking': [],
+            'previous_winners': [],
+            'ranking_percentage': 0,
+            'status': 'fallback',
+            'error': str(e)
+        }
+
+
+@async_api_view
+async def current_ranking(request):
+    try:
+        limit = request.GET.get('limit', 50)
+        offset = request.GET.get('offset', 0)
+        return await firebase_async.get_current_ranking(limit=int(limit), offset=int(offset))
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+
+@async_api_view
+async def ranking_stats(request):
+    try:
+        current_month = datetime.now().strftime('%Y-%m')
+        total_ranking_users, total_users, distribution = await asyncio.gather(
+            firebase_async.count_ranking_users(),
+            firebase_async.count_users(),
+            firebase_async.get_ranking_distribution(current_month),
+        )
+        if not distribution['rebuilt']:
+            await sync_to_async(start_ranking_stats_job)(current_month)
+
+        return {
+            'total_ranking_users': total_ranking_users,
+            'total_users': total_users,
+            'ranking_percentage': round((total_ranking_users / total_users * 100), 2) if total_users > 0 else 0,
+            'distribution_by_level': distribution.get('levels', {}),
+            'distribution_by_province': distribution.get('provinces', {}),
+            'distribution_stale': not distribution['rebuilt'],
+            'current_month': current_month
+        }
+
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+
+@async_api_view
+async def user_details(request, user_id):
+    try:
+        return await firebase_async.get_user_details(user_id)
+    except ValueError as ve:
+        return {'error': str(ve)}, 404
+    except Exception as e:
+        return {'error': str(e)}, 500
@@ -0,0 +1,116 @@
+"""
+Acesso preguiçoso ao Firebase: nada é inicializado ao importar os settings
+ou reports.firebase; a app e o cliente Firestore são criados no primeiro uso.
+
+settings.FIREBASE_BACKEND escolhe o backend do Firestore:
+- 'firestore': cliente real, com as credenciais de settings.FIREBASE_CRED_PATH;
+- 'memory': reports.memory_firestore.MemoryFirestore (testes, benchmarks, offline);
+- caminho pontuado para uma função sem argumentos que devolve o cliente.
+O Firebase Auth continua a precisar da app real (não há backend em memória).
+"""
+import functools
+import inspect
+from threading import Lock
+
+import firebase_admin
+from django.conf import settings
+from django.utils.module_loading import import_string
+from firebase_admin import auth, credentials, firestore
+
+BACKEND_FIRESTORE = 'firestore'
+BACKEND_MEMORY = 'memory'
+
+_lock = Lock()
+_clients = {}
+
+
+def backend_name():
+    return getattr(settings, 'FIREBASE_BACKEND', BACKEND_FIRESTORE)
+
+
+def memory_backend():
+    return backend_name() == BACKEND_MEMORY
+
+
+def get_app():
+    """
+    App Firebase padrão, inicializada no primeiro uso.
+    """
+    with _lock:
+        if not firebase_admin._apps:
+            cred = credentials.Certificate(settings.FIREBASE_CRED_PATH)
+            firebase_admin.initialize_app(cred)
+        return firebase_admin.get_app()
+
+
+def _create_client(name):
+    if name == BACKEND_FIRESTORE:
+        return firestore.client(get_app())
+    if name == BACKEND_MEMORY:
+        from .memory_firestore import MemoryFirestore
+        return MemoryFirestore()
+    return import_string(name)()
+
+
+def get_firestore():
+    """
+    Cliente Firestore do backend configurado (um por processo e backend).
+    """
+    name = backend_name()
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+        if client is None:
+            client = _create_client(name)
+            with _lock:
+                client = _clients.setdefault(name, client)
+    return client
+
+
+def set_firestore(client, name=None):
+    """
+    Substitui o cliente de um backend (por padrão o configurado) — útil em
+    testes e benchmarks para começar com dados próprios.
+    """
+    with _lock:
+        _clients[name or backend_name()] = client
+
+
+def reset():
+    """
+    Descarta os clientes criados; o próximo acesso cria um novo.
+    """
+    with _lock:
+        _clients.clear()
+
+
+class LazyClient:
+    """
+    Encaminha todos os atributos para get_firestore(), de modo que
+    'db.collection(...)' só cria o cliente na primeira chamada.
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_firestore(), name)
+
+    def __repr__(self):
+        return f'<LazyClient backend={backend_name()!r}>'
+
+
+class LazyAuth:
+    """
+    firebase_admin.auth com a app inicializada na primeira chamada; as classes
+    (ImportUserRecord, PhoneIdentifier...) não precisam da app.
+    """
+
+    def __getattr__(self, name):
+        attr = getattr(auth, name)
+        if not inspect.isfunction(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            get_app()
+            return attr(*args, **kwargs)
+        return call
@@ -0,0 +1,254 @@
+"""
+Benchmarks offline da camada de acesso ao Firebase (reports.firebase).
+Corre sobre o MemoryFirestore com dados gerados, sem rede nem credenciais,
+e mede por operação: tempo, pico de memória, RPCs, documentos lidos e
+escritos e queries SQL. O relatório JSON serve para comparar commits
+(ver 'manage.py benchmark_firebase').
+"""
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from users.models import CustomUser
+
+from . import backends, firebase, views
+from .leaderboard import leaderboard
+from .memory_firestore import MemoryFirestore
+from .models import Transaction
+
+BENCHMARK_USERS = 1000
+BENCHMARK_RANKING_ROWS = 1000
+BENCHMARK_TRANSACTIONS = 1000
+BENCHMARK_REPEAT = 5
+
+PROVINCIAS = ('Maputo', 'Gaza', 'Inhambane', 'Sofala', 'Manica', 'Tete', 'Zambézia', 'Nampula', 'Niassa')
+PROVIDERS = ('mpesa', 'emola')
+
+
+def build_dataset(users, ranking_rows, month):
+    """
+    Coleções 'users' e monthly_ranking/<mês>/users com perfis completos.
+    """
+    data = {'users': {}, f'monthly_ranking/{month}/users': {}}
+    for i in range(users):
+        uid = f'user{i:06d}'
+        data['users'][uid] = {
+            'name': f'Usuário {i}',
+            'apelido': 'Benchmark',
+            'gender': 'M' if i % 2 else 'F',
+            'birthYear': str(1980 + i % 25),
+            'provincia': PROVINCIAS[i % len(PROVINCIAS)],
+            'telefone': f'84{i:07d}',
+            'email': f'user{i}@example.com',
+            'isPro': i % 5 == 0,
+            'acceptedRanking': True,
+            'password': 'hash',
+        }
+    for i in range(ranking_rows):
+        uid = f'user{i:06d}'
+        data[f'monthly_ranking/{month}/users'][uid] = {
+            'uid': uid,
+            'name': f'Usuário {i} Benchmark',
+            'points': (i * 7919) % 500,
+            'exams': 1 + i % 20,
+        }
+    return data
+
+
+def _seed_transactions(total, users):
+    Transaction.objects.bulk_create([
+        Transaction(
+            wallet_id=f'user{i % users:06d}',
+            provider=PROVIDERS[i % len(PROVIDERS)],
+            amount=Decimal('100.00'),
+            phone=f'84{i:07d}',
+            status='pago',
+        )
+        for i in range(total)
+    ], batch_size=1000)
+
+
+def _isolated_caches():
+    """
+    Caches locais novos para o benchmark: nada do cache real é lido ou descartado.
+    """
+    return {
+        alias: {**config, 'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': f'benchmark-{alias}'}
+        for alias, config in settings.CACHES.items()
+    }
+
+
+def _reset_state():
+    for cache in caches.all():
+        cache.clear()
+    leaderboard.reset()
+
+
+def _view_call(view, path, user):
+    factory = APIRequestFactory()
+
+    def call():
+        request = factory.get(path)
+        force_authenticate(request, user=user)
+        response = view(request)
+        response.render()
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} respondeu {response.status_code}: {response.content[:200]}')
+        return response
+    return call
+
+
+def _operations(users):
+    admin = CustomUser(username='benchmark', is_staff=True, is_superuser=True)
+    updates = iter(range(10 ** 9))
+
+    def update_points():
+        uid = f'user{next(updates) % users:06d}'
+        return firebase.update_user_ranking_points(uid, 10, {
+            'examId': 'benchmark', 'totalSuccess': 8, 'totalQuestions': 10,
+            'categoryName': 'B', 'passed': True,
+        })
+
+    return {
+        'get_all_users': firebase.get_all_users,
+        'count_users': firebase.count_users,
+        'get_current_ranking': firebase.get_current_ranking,
+        'ranking_stats': _view_call(views.ranking_stats, '/api/ranking/stats/', admin),
+        'unified_transactions': _view_call(views.unified_transactions, '/api/transactions/?page_size=100', admin),
+        'update_user_ranking_points': update_points,
+    }
+
+
+def _measure(operation, client, repeat):
+    wall_ms = []
+    for _ in range(repeat):
+        _reset_state()
+        inicio = time.perf_counter()
+        operation()
+        wall_ms.append((time.perf_counter() - inicio) * 1000)
+
+    # Uma execução extra, com tracemalloc, para a memória e os contadores
+    _reset_state()
+    client.reset_stats()
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'wall_ms': {
+            'min': round(min(wall_ms), 3),
+            'median': round(statistics.median(wall_ms), 3),
+            'max': round(max(wall_ms), 3),
+        },
+        'peak_memory_kb': round(peak / 1024, 1),
+        'rpcs': client.rpc_count,
+        'docs_read': client.docs_read,
+        'docs_written': client.docs_written,
+        'sql_queries': len(queries),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=5, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+@contextmanager
+def benchmark_environment(client):
+    """
+    Firestore em memória, caches isolados e leituras direto do Firestore
+    (sem espelho nem fila write-behind). Restaura o backend anterior no fim.
+    """
+    with override_settings(
+        FIREBASE_BACKEND=backends.BACKEND_MEMORY,
+        FIREBASE_USERS_READ_SOURCE='firestore',
+        RANKING_WRITE_BEHIND=False,
+        CACHES=_isolated_caches(),
+    ):
+        previous = backends._clients.get(backends.BACKEND_MEMORY)
+        backends.set_firestore(client, backends.BACKEND_MEMORY)
+        try:
+            yield
+        finally:
+            if previous is None:
+                backends._clients.pop(backends.BACKEND_MEMORY, None)
+            else:
+                backends.set_firestore(previous, backends.BACKEND_MEMORY)
+            leaderboard.reset()
+
+
+def run_benchmarks(users=BENCHMARK_USERS, ranking_rows=BENCHMARK_RANKING_ROWS,
+                   transactions=BENCHMARK_TRANSACTIONS, repeat=BENCHMARK_REPEAT, only=None):
+    """
+    Gera os dados, corre cada operação 'repeat' vezes (a frio: caches e top-K
+    vazios) e devolve o relatório. As transações SQL criadas para o benchmark
+    são revertidas no fim.
+    """
+    if ranking_rows > users:
+        raise ValueError('O ranking não pode ter mais linhas do que usuários.')
+
+    month = datetime.now().strftime('%Y-%m')
+    client = MemoryFirestore(build_dataset(users, ranking_rows, month))
+    results = {}
+
+    with benchmark_environment(client), transaction.atomic():
+        firebase.rebuild_ranking_stats(month)
+        _seed_transactions(transactions, users)
+
+        for name, operation in _operations(users).items():
+            if only and name not in only:
+                continue
+            results[name] = _measure(operation, client, repeat)
+
+        transaction.set_rollback(True)
+
+    return {
+        'generated_at': timezone.now().isoformat(),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'sizes': {'users': users, 'ranking_rows': ranking_rows, 'transactions': transactions},
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare_reports(baseline, current):
+    """
+    Diferenças entre dois relatórios: mediana do tempo (em %) e contadores.
+    """
+    changes = {}
+    for name, result in current['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if before is None:
+            continue
+        old_ms, new_ms = before['wall_ms']['median'], result['wall_ms']['median']
+        changes[name] = {
+            'wall_ms_median': round((new_ms - old_ms) / old_ms * 100, 1) if old_ms else None,
+            **{
+                key: result[key] - before.get(key, 0)
+                for key in ('rpcs', 'docs_read', 'docs_written', 'sql_queries')
+            },
+        }
+    return changes
@@ -0,0 +1,64 @@
+"""
+ETags fortes para os endpoints de listagem consultados periodicamente pelo
+painel. A ETag é calculada a partir de um marcador de versão barato, antes da
+view: se coincidir com If-None-Match a resposta é 304, sem serializar nem ler
+os dados no Firestore/MySQL.
+"""
+import hashlib
+import time
+
+from django.db.models import Count, Max
+from django.views.decorators.http import condition
+
+from .models import Transaction, Video
+from .response_cache import RESPONSE_CACHE_DEFAULT_TTL, RESPONSE_CACHE_TTLS, data_version
+
+
+def sql_version(queryset):
+    """
+    Marcador de uma tabela: maior updated_at + número de linhas
+    (apanha inserções, alterações e remoções).
+    """
+    marker = queryset.aggregate(ultimo=Max('updated_at'), total=Count('id'))
+    ultimo = marker['ultimo'].isoformat() if marker['ultimo'] else ''
+    return f"{ultimo}:{marker['total']}"
+
+
+def firestore_version(tag, name):
+    """
+    Marcador dos dados do Firestore: o contador da tag, mantido pelas escritas
+    feitas por esta API (invalidate_tags), mais a janela do TTL do endpoint,
+    para apanhar também escritas feitas fora da API (ex: a app móvel).
+    """
+    ttl = RESPONSE_CACHE_TTLS.get(name, RESPONSE_CACHE_DEFAULT_TTL)
+    return f"{data_version(tag)}:{int(time.time() // ttl)}"
+
+
+def _etag(request, *markers):
+    # A mesma versão dos dados dá páginas diferentes consoante os parâmetros
+    raw = '|'.join((request.path, request.GET.urlencode(), *markers))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _clients_etag(request, *args, **kwargs):
+    return _etag(request, firestore_version('users', 'list_firebase_users'))
+
+
+def _current_ranking_etag(request, *args, **kwargs):
+    return _etag(request, firestore_version('ranking', 'current_ranking'))
+
+
+def _videos_etag(request, *args, **kwargs):
+    return _etag(request, sql_version(Video.objects.all()))
+
+
+def _transactions_etag(request, *args, **kwargs):
+    # As transações levam os dados da carteira (usuário do Firebase)
+    return _etag(request, sql_version(Transaction.objects.all()), data_version('users'))
+
+
+# Decoradores a usar por baixo de @api_view (a autenticação corre primeiro)
+clients_etag = condition(etag_func=_clients_etag)
+current_ranking_etag = condition(etag_func=_current_ranking_etag)
+videos_etag = condition(etag_func=_videos_etag)
+transactions_etag = condition(etag_func=_transactions_etag)
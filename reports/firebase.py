@@ -1,18 +1,191 @@
-from firebase_admin import auth, firestore
+from firebase_admin import firestore
+from google.api_core.exceptions import Conflict
+from django.conf import settings
+from django.core.cache import caches
 from django.utils.timezone import now
 from datetime import datetime, timedelta
+from threading import Lock
+import hashlib
+import logging
+import os
 
-# Inicializa o cliente Firestore
-db = firestore.client()
+from . import mirror, ranking_queue
+from .backends import LazyAuth, LazyClient
+from .leaderboard import RANKING_TAG, leaderboard
+from .metrics import InstrumentedFirestore, metrics_enabled
+from .response_cache import bump_tag
+
+logger = logging.getLogger(__name__)
+
+# Cliente Firestore e Firebase Auth criados no primeiro uso (ver reports.backends);
+# o InstrumentedFirestore soma os RPCs e documentos às métricas do pedido
+db = InstrumentedFirestore(LazyClient()) if metrics_enabled() else LazyClient()
+auth = LazyAuth()
 FIRESTORE_PHONE_FIELD = "telefone"
 
 
+class UserNotFound(ValueError):
+    """
+    Usuário inexistente na coleção 'users'. Subclasse de ValueError para as
+    views continuarem a responder 404/400; a fila do ranking só descarta
+    pontos por causa deste erro.
+    """
+
+# Campos que todo usuário devolvido pela API deve ter
+USER_DEFAULTS = {
+    'name': '',
+    'apelido': '',
+    'gender': '',
+    'birthYear': '',
+    'provincia': '',
+    'telefone': '',
+    'email': '',
+    'isPro': False,
+    'acceptedRanking': False,
+    'createdAt': '',
+    'updatedAt': ''
+}
+
+# Máscara de campos usada nos joins do ranking (evita trazer o documento inteiro)
+USER_DETAIL_FIELDS = list(USER_DEFAULTS) + ['image', 'ranking_points', 'ranking_level', 'premiado']
+
+# Quantos documentos pedir por chamada a db.get_all
+USER_BATCH_SIZE = 100
+
+# Máximo de escritas num WriteBatch do Firestore
+FIRESTORE_BATCH_LIMIT = 500
+
+# Reserva de telefones: phone_index/{telefone} -> {'uids': [...]}
+PHONE_INDEX_COLLECTION = 'phone_index'
+# True depois de correr build_phone_index: um telefone fora do índice não existe
+PHONE_INDEX_COMPLETE = getattr(settings, 'FIREBASE_PHONE_INDEX_COMPLETE', False)
+
+
+# 🔥 CACHE DE DOCUMENTOS DE USUÁRIOS
+# Usa o backend configurado em settings.CACHES (TTL e LRU via MAX_ENTRIES).
+# Chaves: 'user:<uid>:full' (documento completo), 'user:<uid>:detail'
+# (projeção USER_DETAIL_FIELDS) e 'phone:<telefone>' (lista de uids).
+USER_CACHE_ALIAS = getattr(settings, 'FIREBASE_USER_CACHE_ALIAS', 'firebase_users')
+
+_cache_stats = {'hits': 0, 'misses': 0}
+_cache_stats_lock = Lock()
+
+
+def _user_cache():
+    return caches[USER_CACHE_ALIAS]
+
+
+def _user_cache_key(uid, projection='full'):
+    return f'user:{uid}:{projection}'
+
+
+def _phone_cache_key(telefone):
+    return f'phone:{telefone}'
+
+
+def _cache_projection(field_paths):
+    """
+    Só as leituras completas e as da máscara USER_DETAIL_FIELDS são guardadas em cache.
+    """
+    if field_paths is None:
+        return 'full'
+    if list(field_paths) == USER_DETAIL_FIELDS:
+        return 'detail'
+    return None
+
+
+def _count_cache(hits=0, misses=0):
+    with _cache_stats_lock:
+        _cache_stats['hits'] += hits
+        _cache_stats['misses'] += misses
+
+
+def get_user_cache_stats():
+    """
+    Contadores de acertos/falhas do cache de usuários (por processo).
+    """
+    with _cache_stats_lock:
+        hits, misses = _cache_stats['hits'], _cache_stats['misses']
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else 0,
+    }
+
+
+def cache_user(user_data):
+    """
+    Guarda (ou atualiza) um documento completo de usuário no cache.
+    """
+    _user_cache().set_many(_user_cache_entries(user_data))
+
+
+def _user_cache_entries(user_data):
+    """
+    Entradas de cache de um documento completo: o documento e a projeção 'detail'.
+    """
+    uid = user_data['id']
+    return {
+        _user_cache_key(uid): user_data,
+        _user_cache_key(uid, 'detail'): _detail_projection(user_data),
+    }
+
+
+def _detail_projection(user_data):
+    """
+    Só os campos de USER_DETAIL_FIELDS (e o id) de um documento completo.
+    """
+    detail = {campo: user_data[campo] for campo in USER_DETAIL_FIELDS if campo in user_data}
+    detail['id'] = user_data['id']
+    return detail
+
+
+def invalidate_user_cache(uid=None, telefones=()):
+    """
+    Remove do cache o usuário e/ou os mapeamentos telefone → uid indicados.
+    """
+    keys = [_phone_cache_key(telefone) for telefone in telefones if telefone]
+    if uid:
+        keys += [_user_cache_key(uid), _user_cache_key(uid, 'detail')]
+    if keys:
+        _user_cache().delete_many(keys)
+
+
 def get_all_users():
     """
     Lê todos os documentos da coleção 'users' no Firebase Firestore.
     """
+    return list(iter_users())
+
+
+def iter_users():
+    """
+    Percorre a coleção 'users' à medida que o Firestore devolve os documentos,
+    sem montar a lista completa em memória.
+    """
+    if mirror.mirror_enabled():
+        yield from mirror.iter_mirror_users()
+        return
+
     users_ref = db.collection('users')
-    docs = users_ref.stream()
+    for doc in users_ref.stream():
+        yield { 'id': doc.id, **doc.to_dict() }
+
+
+def get_users_page(page_size, start_after=None):
+    """
+    Lê uma página da coleção 'users' ordenada pelo ID do documento.
+    'start_after' é o ID do último documento da página anterior.
+    """
+    if mirror.mirror_enabled():
+        return mirror.get_mirror_users_page(page_size, start_after)
+
+    query = db.collection('users').order_by('__name__')
+    if start_after:
+        query = query.start_after({'__name__': start_after})
+
+    docs = query.limit(page_size).stream()
     return [{ 'id': doc.id, **doc.to_dict() } for doc in docs]
 
 
@@ -20,8 +193,35 @@ def count_users():
     """
     Conta quantos documentos existem na coleção 'users' do Firebase.
     """
-    users_ref = db.collection('users')
-    return len(list(users_ref.stream()))
+    return aggregate('users')
+
+
+AGGREGATIONS = ('count', 'sum', 'avg')
+
+
+def aggregate(collection, filters=None, op='count', field=None):
+    """
+    Executa uma agregação (count, sum ou avg) no próprio Firestore.
+    'collection' aceita caminhos aninhados (ex: 'monthly_ranking/2025-09/users')
+    e 'filters' é uma lista de tuplas (campo, operador, valor).
+    Custa um único RPC, sem descarregar os documentos.
+    """
+    if op not in AGGREGATIONS:
+        raise ValueError(f"Agregação inválida: {op}")
+    if op != 'count' and not field:
+        raise ValueError(f"A agregação '{op}' precisa de um campo.")
+
+    query = db.collection(collection)
+    for field_name, operator, value in filters or []:
+        query = query.where(field_name, operator, value)
+
+    if op == 'count':
+        aggregation_query = query.count(alias=op)
+    else:
+        aggregation_query = getattr(query, op)(field, alias=op)
+
+    results = aggregation_query.get()
+    return results[0][0].value
 
 # def update_user(user_id, data):
 #     """
@@ -31,75 +231,248 @@ def count_users():
 #     user_ref.set(data, merge=True)
 #     print(f"[DEBUG] Dados atualizados no usuário: {user_id}")
 
-def update_user(user_id, data):
+def update_user(user_id, data, fresh=False):
+    """
+    Atualiza (merge) os campos enviados no documento do usuário.
+    Por padrão faz um único RPC (o set com merge) e devolve o resultado calculado
+    localmente: o documento em cache + os campos enviados, com 'updateTime' da escrita.
+    Sem o documento em cache, devolve apenas os campos enviados.
+    Com fresh=True relê o documento no servidor depois da escrita.
+    As leituras antes/depois para depuração só acontecem com o logger em DEBUG.
+    """
     user_ref = db.collection('users').document(user_id)
+    debug = logger.isEnabledFor(logging.DEBUG)
+    cached = _user_cache().get(_user_cache_key(user_id))
+
+    # Lê antes (depuração, ou para saber o telefone antigo a invalidar)
+    doc_before = None
+    if debug or (FIRESTORE_PHONE_FIELD in data and cached is None):
+        doc_before = user_ref.get().to_dict()
+        logger.debug("Estado ANTES do update de %s: %s", user_id, doc_before)
 
-    # Lê antes
-    doc_before = user_ref.get()
-    print(f"[DEBUG] Estado ANTES do update: {doc_before.to_dict()}")
+    # Faz o update (movendo a reserva em phone_index se o número mudou)
+    old_phone = (doc_before or cached or {}).get(FIRESTORE_PHONE_FIELD)
+    new_phone = data.get(FIRESTORE_PHONE_FIELD)
+    if new_phone and new_phone != old_phone:
+        _update_user_and_phone_index(user_ref, data, old_phone, new_phone)
+        # A transação não devolve os WriteResult: fica a hora local do commit
+        update_time = now()
+    else:
+        update_time = user_ref.set(data, merge=True).update_time
+    logger.debug("Dados atualizados no usuário: %s", user_id)
 
-    # Faz o update
-    user_ref.set(data, merge=True)
-    print(f"[DEBUG] Dados atualizados no usuário: {user_id}")
+    if fresh or debug:
+        # Lê depois
+        updated_data = user_ref.get().to_dict()
+        logger.debug("Estado DEPOIS do update de %s: %s", user_id, updated_data)
+        cache_user({ 'id': user_id, **updated_data })
+    elif cached is not None:
+        updated_data = _merge_fields(cached, data)
+        cache_user(dict(updated_data))
+    else:
+        updated_data = { 'id': user_id, **data }
+        invalidate_user_cache(user_id)
 
-    # Lê depois
-    doc_after = user_ref.get()
-    updated_data = doc_after.to_dict()
+    if FIRESTORE_PHONE_FIELD in data:
+        invalidate_user_cache(telefones=[old_phone, new_phone])
 
-    print(f"[DEBUG] Estado DEPOIS do update: {doc_after.to_dict()}")
+    if not fresh:
+        updated_data['updateTime'] = update_time
     return updated_data
 
 
+def _phone_index_ref(telefone):
+    return db.collection(PHONE_INDEX_COLLECTION).document(str(telefone))
+
+
+def _phone_index_entry(uids):
+    return {'uids': list(uids), 'updatedAt': now().isoformat()}
 
-def update_user_by_phone(telefone, data):
+
+def _phone_used_outside_index(telefone, exclude_uid=None):
+    """
+    Enquanto o índice não cobre os usuários antigos (PHONE_INDEX_COMPLETE=False),
+    procura o número também na coleção 'users' (uma query com limite).
+    """
+    if PHONE_INDEX_COMPLETE:
+        return False
+    existing_users = db.collection("users").where(FIRESTORE_PHONE_FIELD, "==", telefone).limit(2).stream()
+    return any(doc.id != exclude_uid for doc in existing_users)
+
+
+def _update_user_and_phone_index(user_ref, data, old_phone, new_phone):
+    """
+    Grava o novo telefone do usuário e move a reserva em phone_index numa
+    transação. Lança ValueError se o novo número já estiver reservado (ou, sem
+    o índice completo, se outro usuário antigo já o usar).
+    """
+    if _phone_used_outside_index(new_phone, exclude_uid=user_ref.id):
+        raise ValueError("Este número já está em uso.")
+    
+    try:
+        _move_phone_reservation(db.transaction(), user_ref, data, old_phone, new_phone)
+    except Conflict:
+        raise ValueError("Este número já está em uso.")
+
+@firestore.transactional
+def _move_phone_reservation(transaction, user_ref, data, old_phone, new_phone):
+    """
+    As duas reservas são lidas na transação (um get_all): se outro pedido
+    acrescentar ou retirar um uid da reserva antiga antes do commit, a
+    transação é repetida com a lista nova em vez de a sobrescrever.
+    """
+    new_index_ref = _phone_index_ref(new_phone)
+    refs = [new_index_ref]
+    if old_phone:
+        old_index_ref = _phone_index_ref(old_phone)
+        refs.append(old_index_ref)
+    snapshots = {
+        snapshot.reference.path: snapshot
+        for snapshot in db.get_all(refs, transaction=transaction)
+    }
+    
+    if snapshots[new_index_ref.path].exists:
+        raise ValueError("Este número já está em uso.")
+    transaction.create(new_index_ref, _phone_index_entry([user_ref.id]))
+    
+    if old_phone:
+        old_index = snapshots[old_index_ref.path]
+        if old_index.exists:
+            remaining = [uid for uid in old_index.to_dict().get('uids', []) if uid != user_ref.id]
+            if remaining:
+                transaction.update(old_index_ref, _phone_index_entry(remaining))
+            else:
+                transaction.delete(old_index_ref)
+    
+    transaction.set(user_ref, data, merge=True)
+
+
+def _merge_fields(current, changes):
+    """
+    Aplica localmente um set(merge=True): mapas aninhados são combinados campo a campo.
+    """
+    merged = dict(current)
+    for campo, valor in changes.items():
+        if isinstance(valor, dict) and isinstance(merged.get(campo), dict):
+            merged[campo] = _merge_fields(merged[campo], valor)
+        else:
+            merged[campo] = valor
+    return merged
+
+
+def update_user_by_phone(telefone, data, fresh=False, dry_run=False):
     """
     Busca usuários por telefone e atualiza APENAS os campos enviados.
-    Retorna a lista dos documentos atualizados.
+    Todas as atualizações vão num único WriteBatch (atómico, até 500 documentos).
+    Retorna a lista dos documentos atualizados: calculados localmente por padrão,
+    ou relidos do servidor com um único get_all quando fresh=True.
+    Com dry_run=True não grava nada e devolve os documentos que seriam alterados.
     """
     users_ref = db.collection('users')
-    print(f"[DEBUG] Consultando usuários com telefone == {telefone}")
+    logger.debug("Consultando usuários com telefone == %s", telefone)
 
     query = users_ref.where('telefone', '==', telefone)
     docs = list(query.stream())
-    print(f"[DEBUG] Total de usuários encontrados: {len(docs)}")
+    logger.debug("Total de usuários encontrados: %s", len(docs))
 
     if not docs:
-        print(f"[DEBUG] Nenhum usuário encontrado com telefone: {telefone}")
         raise ValueError(f"Nenhum usuário encontrado com telefone {telefone}")
 
-    updated_users = []
+    if dry_run:
+        return [
+            {
+                'id': doc.id,
+                'changes': {
+                    campo: {'from': _get_field(doc.to_dict(), campo), 'to': valor}
+                    for campo, valor in data.items()
+                }
+            }
+            for doc in docs
+        ]
 
-    for doc in docs:
-        current_data = doc.to_dict()
-        print(f"[DEBUG] Usuario encontrado - ID: {doc.id}")
-        print(f"[DEBUG] Dados atuais do usuário antes do update: {current_data}")
+    # Faz update apenas dos campos enviados, em lote
+    for inicio in range(0, len(docs), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for doc in docs[inicio:inicio + FIRESTORE_BATCH_LIMIT]:
+            batch.update(doc.reference, data)
+        batch.commit()
 
-        # Faz update apenas dos campos enviados
-        doc.reference.update(data)
+    if fresh:
+        # Recupera os dados atualizados num único RPC
+        updated_docs = db.get_all([doc.reference for doc in docs])
+        updated_users = [{ **doc.to_dict(), 'id': doc.id } for doc in updated_docs]
+    else:
+        updated_users = [{ **_apply_update(doc.to_dict(), data), 'id': doc.id } for doc in docs]
 
-        # Recupera os dados atualizados
-        updated_doc = doc.reference.get()
-        updated_data = updated_doc.to_dict()
-        updated_data['id'] = updated_doc.id
+    for updated_data in updated_users:
+        logger.debug("Dados atualizados do usuário: %s", updated_data)
+        cache_user(dict(updated_data))
 
-        print(f"[DEBUG] Dados atualizados do usuário: {updated_data}")
+    invalidate_user_cache(telefones=[telefone, data.get(FIRESTORE_PHONE_FIELD)])
+    return updated_users
 
-        updated_users.append(updated_data)
 
-    return updated_users
+def _get_field(document, field_path):
+    """
+    Lê um campo, aceitando caminhos com pontos como no update() do Firestore.
+    """
+    valor = document
+    for parte in field_path.split('.'):
+        if not isinstance(valor, dict) or parte not in valor:
+            return None
+        valor = valor[parte]
+    return valor
+
+
+def _apply_update(document, changes):
+    """
+    Aplica localmente um update() do Firestore (chaves com pontos são caminhos).
+    """
+    updated = dict(document)
+    for field_path, valor in changes.items():
+        *parents, campo = field_path.split('.')
+        alvo = updated
+        for parte in parents:
+            filho = alvo.get(parte)
+            alvo[parte] = dict(filho) if isinstance(filho, dict) else {}
+            alvo = alvo[parte]
+        alvo[campo] = valor
+    return updated
 
 
 def get_users_by_telefone(telefone):
     """
     Busca usuários no Firestore filtrando por campo 'telefone'.
     """
-    users_ref = db.collection('users')
-    query = users_ref.where(FIRESTORE_PHONE_FIELD, '==', telefone)
+    if mirror.mirror_enabled():
+        return mirror.get_mirror_users_by_telefone(telefone)
 
-    print(f"[DEBUG] Buscando usuário com telefone: {telefone}")
+    cache = _user_cache()
+    uids = cache.get(_phone_cache_key(telefone))
+    if uids is not None:
+        _count_cache(hits=1)
+        users = get_users_by_ids(uids)
+        return [users[uid] for uid in uids if uid in users]
+    _count_cache(misses=1)
 
-    docs = query.stream()
-    return [{ 'id': doc.id, **doc.to_dict() } for doc in docs]
+    logger.debug("Buscando usuário com telefone: %s", telefone)
+
+    # Resolve telefone -> uid pelo índice (leitura direta por chave)
+    index = _phone_index_ref(telefone).get()
+    if index.exists or PHONE_INDEX_COMPLETE:
+        uids = index.to_dict().get('uids', []) if index.exists else []
+        found = get_users_by_ids(uids)
+        users = [found[uid] for uid in uids if uid in found]
+    else:
+        # Usuários antigos ainda fora do índice
+        users_ref = db.collection('users')
+        query = users_ref.where(FIRESTORE_PHONE_FIELD, '==', telefone)
+        users = [{ 'id': doc.id, **doc.to_dict() } for doc in query.stream()]
+        for user_data in users:
+            cache_user(user_data)
+
+    cache.set(_phone_cache_key(telefone), [u['id'] for u in users])
+    return users
 
 
 def create_user(data):
@@ -107,9 +480,9 @@ def create_user(data):
     if not telefone:
         raise ValueError("Campo 'telefone' é obrigatório.")
 
-    # Verifica duplicado
-    existing_users = db.collection("users").where(FIRESTORE_PHONE_FIELD, "==", telefone).stream()
-    if any(existing_users):
+    # Verifica duplicado (uma leitura por chave no índice de telefones)
+    index_ref = _phone_index_ref(telefone)
+    if index_ref.get().exists or _phone_used_outside_index(telefone):
         raise ValueError("Este número já está em uso.")
 
     # Se não enviou email, gera automático
@@ -124,8 +497,30 @@ def create_user(data):
     )
     uid = user_record.uid
 
-    # Salva dados adicionais no Firestore
-    new_user = {
+    # Salva dados adicionais no Firestore junto com a reserva do telefone.
+    # O create() só é aceite se phone_index/{telefone} não existir, por isso
+    # dois cadastros simultâneos com o mesmo número não passam os dois.
+    new_user = _new_user_profile(uid, telefone, email, data)
+
+    batch = db.batch()
+    batch.create(index_ref, _phone_index_entry([uid]))
+    batch.set(db.collection("users").document(uid), new_user)
+    try:
+        batch.commit()
+    except Conflict:
+        auth.delete_user(uid)
+        raise ValueError("Este número já está em uso.")
+
+    cache_user(dict(new_user))
+    invalidate_user_cache(telefones=[telefone])
+    return new_user
+
+
+def _new_user_profile(uid, telefone, email, data):
+    """
+    Documento do perfil em 'users' para um usuário recém-criado no Auth.
+    """
+    return {
         "id": uid,
         "name": data.get("name", ""),
         "apelido": data.get("apelido", ""),
@@ -140,8 +535,169 @@ def create_user(data):
         "updatedAt": now().isoformat(),
     }
 
-    db.collection("users").document(uid).set(new_user)
-    return new_user
+
+# 🔥 CADASTRO EM LOTE
+AUTH_IMPORT_BATCH_SIZE = 1000  # máximo aceite por auth.import_users
+AUTH_LOOKUP_BATCH_SIZE = 100   # máximo aceite por auth.get_users
+PASSWORD_HASH_ROUNDS = getattr(settings, 'FIREBASE_IMPORT_PBKDF2_ROUNDS', 10000)
+BULK_WRITE_MAX_ATTEMPTS = 3
+
+
+def _hash_password(password):
+    """
+    PBKDF2-SHA256 com salt aleatório, no formato aceite pelo auth.import_users.
+    """
+    salt = os.urandom(16)
+    password_hash = hashlib.pbkdf2_hmac('sha256', str(password).encode('utf-8'), salt, PASSWORD_HASH_ROUNDS)
+    return password_hash, salt
+
+
+def _existing_auth_identifiers(rows):
+    """
+    Telefones (+258...) e emails das linhas que já existem no Firebase Auth.
+    """
+    identifiers = []
+    for row in rows:
+        identifiers.append(auth.PhoneIdentifier(f"+258{row['telefone']}"))
+        identifiers.append(auth.EmailIdentifier(row['email']))
+
+    phones, emails = set(), set()
+    for inicio in range(0, len(identifiers), AUTH_LOOKUP_BATCH_SIZE):
+        result = auth.get_users(identifiers[inicio:inicio + AUTH_LOOKUP_BATCH_SIZE])
+        for user in result.users:
+            if user.phone_number:
+                phones.add(user.phone_number)
+            if user.email:
+                emails.add(user.email.lower())
+    return phones, emails
+
+
+def _indexed_phones(telefones):
+    """
+    Telefones já reservados em phone_index (um get_all por bloco).
+    """
+    refs = [_phone_index_ref(telefone) for telefone in telefones]
+    indexed = set()
+    for inicio in range(0, len(refs), USER_BATCH_SIZE):
+        for doc in db.get_all(refs[inicio:inicio + USER_BATCH_SIZE]):
+            if doc.exists and doc.to_dict().get('uids'):
+                indexed.add(doc.id)
+    return indexed
+
+
+def build_phone_index():
+    """
+    Cria phone_index/{telefone} para todos os usuários existentes.
+    Telefones partilhados por várias contas ficam com todos os uids.
+    Devolve (telefones_indexados, telefones_partilhados).
+    """
+    por_telefone = {}
+    for doc in db.collection('users').select([FIRESTORE_PHONE_FIELD]).stream():
+        telefone = (doc.to_dict() or {}).get(FIRESTORE_PHONE_FIELD)
+        if telefone:
+            por_telefone.setdefault(str(telefone), []).append(doc.id)
+
+    writer = db.bulk_writer()
+    for telefone, uids in por_telefone.items():
+        writer.set(_phone_index_ref(telefone), _phone_index_entry(uids))
+    writer.close()
+
+    partilhados = sum(1 for uids in por_telefone.values() if len(uids) > 1)
+    return len(por_telefone), partilhados
+
+
+def bulk_create_users(rows):
+    """
+    Cria muitos clientes de uma vez: contas no Auth com auth.import_users
+    (blocos de 1000) e perfis no Firestore com BulkWriter.
+    'rows' já vem validado e sem telefones/emails repetidos (ver reports.importers);
+    cada linha traz o número original em '_row'. Devolve um resultado por linha.
+    """
+    results = []
+    phones, emails = _existing_auth_identifiers(rows)
+    indexed_phones = _indexed_phones(row['telefone'] for row in rows)
+
+    pending = []
+    for row in rows:
+        if (
+            row['telefone'] in indexed_phones
+            or f"+258{row['telefone']}" in phones
+            or row['email'] in emails
+        ):
+            results.append({
+                'row': row['_row'],
+                'telefone': row['telefone'],
+                'status': 'duplicate',
+                'error': "Este número ou email já está em uso."
+            })
+        else:
+            pending.append(row)
+
+    # Contas no Firebase Auth
+    users_ref = db.collection('users')
+    hash_alg = auth.UserImportHash.pbkdf2_sha256(rounds=PASSWORD_HASH_ROUNDS)
+    created = []
+    for inicio in range(0, len(pending), AUTH_IMPORT_BATCH_SIZE):
+        chunk = pending[inicio:inicio + AUTH_IMPORT_BATCH_SIZE]
+        records = []
+        for row in chunk:
+            password_hash, password_salt = _hash_password(row['password']) if row.get('password') else (None, None)
+            records.append(auth.ImportUserRecord(
+                uid=users_ref.document().id,
+                email=row['email'],
+                display_name=f"{row.get('name', '')} {row.get('apelido', '')}",
+                phone_number=f"+258{row['telefone']}",
+                password_hash=password_hash,
+                password_salt=password_salt
+            ))
+
+        import_result = auth.import_users(records, hash_alg=hash_alg)
+        errors = {error.index: error.reason for error in import_result.errors}
+        for index, (row, record) in enumerate(zip(chunk, records)):
+            if index in errors:
+                results.append({
+                    'row': row['_row'],
+                    'telefone': row['telefone'],
+                    'status': 'error',
+                    'error': errors[index]
+                })
+            else:
+                created.append((row, record.uid))
+
+    # Perfis no Firestore
+    write_failures = {}
+
+    def on_write_error(failure, writer):
+        # ALREADY_EXISTS (6) no phone_index não adianta repetir
+        if failure.code == 6 or failure.attempts >= BULK_WRITE_MAX_ATTEMPTS:
+            write_failures[failure.operation.reference.path] = failure.message
+            return False
+        return True
+
+    writer = db.bulk_writer()
+    writer.on_write_error(on_write_error)
+    for row, uid in created:
+        writer.set(users_ref.document(uid), _new_user_profile(uid, row['telefone'], row['email'], row))
+        writer.create(_phone_index_ref(row['telefone']), _phone_index_entry([uid]))
+    writer.close()
+
+    for row, uid in created:
+        result = {'row': row['_row'], 'telefone': row['telefone'], 'uid': uid}
+        errors = []
+        profile_failure = write_failures.get(users_ref.document(uid).path)
+        if profile_failure:
+            errors.append(f"Conta criada, mas o perfil não foi gravado: {profile_failure}")
+        index_failure = write_failures.get(_phone_index_ref(row['telefone']).path)
+        if index_failure:
+            errors.append(f"Conta criada, mas o telefone não foi reservado em {PHONE_INDEX_COLLECTION}: {index_failure}")
+        if errors:
+            result.update(status='error', error=' '.join(errors))
+        else:
+            result['status'] = 'created'
+        results.append(result)
+
+    invalidate_user_cache(telefones=[row['telefone'] for row, _ in created])
+    return results
 
 # 🔥 FUNÇÕES DE RANKING CORRIGIDAS
 def get_ranking_users():
@@ -161,113 +717,253 @@ def get_ranking_users():
         for doc in docs:
             user_data = doc.to_dict()
             user_data['id'] = doc.id
-            
-            # Busca informações completas do usuário
-            try:
-                user_main_data = get_user_details(user_data.get('uid'))
-                user_data.update(user_main_data)
-            except:
-                # Se não encontrar usuário principal, usa apenas dados do ranking
-                pass
-            
             users.append(user_data)
         
+        # Busca informações completas dos usuários em lote
+        details = get_users_details(u.get('uid') for u in users)
+        for user_data in users:
+            # Se não encontrar usuário principal, usa apenas dados do ranking
+            user_data.update(details.get(user_data.get('uid'), {}))
+        
         return users
     except Exception as e:
         print(f"Erro ao buscar usuários do ranking: {e}")
         return []
 
-def get_current_ranking(limit=50):
+def _current_leaderboard(current_month):
+    """
+    Devolve o top-K em memória do mês, carregando-o do Firestore na primeira
+    leitura, na virada do mês ou quando o TTL expira.
+    """
+    if leaderboard.needs_reload(current_month):
+        with leaderboard.reload_lock:
+            if leaderboard.needs_reload(current_month):
+                version = leaderboard.shared_version()
+                users_ref = db.collection('monthly_ranking').document(current_month).collection('users')
+                query = users_ref.order_by('points', direction=firestore.Query.DESCENDING).limit(leaderboard.size)
+                leaderboard.load(current_month, [{**doc.to_dict(), 'id': doc.id} for doc in query.stream()], version)
+    return leaderboard
+
+def get_current_ranking(limit=50, offset=0):
     """
     Obtém o ranking atual ordenado por pontos - ESTRUTURA CORRIGIDA
+    Páginas dentro do top-K (RANKING_LEADERBOARD_SIZE) são servidas da memória.
     """
     from datetime import datetime
     
     current_month = datetime.now().strftime('%Y-%m')
     
     try:
-        # Acessa monthly_ranking/2025-09/users e ordena por pontos
-        users_ref = db.collection('monthly_ranking').document(current_month).collection('users')
-        query = users_ref.order_by('points', direction=firestore.Query.DESCENDING)
-        
-        if limit:
-            query = query.limit(limit)
-        
-        docs = query.stream()
+        # Pontos aceites mas ainda não gravados (modo write-behind)
+        pending = ranking_queue.pending_totals(current_month) if ranking_queue.write_behind_enabled() else {}
         
-        ranking = []
-        posicao = 1
-        
-        for doc in docs:
-            user_data = doc.to_dict()
-            user_data['id'] = doc.id
-            
-            # Busca informações completas do usuário
-            try:
-                user_main_data = get_user_details(user_data.get('uid'))
-                user_data.update(user_main_data)
-            except:
-                # Se não encontrar, usa dados básicos
-                user_data.setdefault('name', '')
-                user_data.setdefault('apelido', '')
-                user_data.setdefault('telefone', '')
-                user_data.setdefault('provincia', '')
-                user_data.setdefault('gender', '')
-                user_data.setdefault('birthYear', '')
+        if limit and offset + limit <= leaderboard.size:
+            if pending:
+                rows = _current_leaderboard(current_month).top(leaderboard.size)
+                rows = _merge_pending_points(rows, pending, include_new=True)[offset:offset + limit]
+            else:
+                rows = _current_leaderboard(current_month).top(limit, offset)
+        else:
+            # Acessa monthly_ranking/2025-09/users e ordena por pontos
+            users_ref = db.collection('monthly_ranking').document(current_month).collection('users')
+            query = users_ref.order_by('points', direction=firestore.Query.DESCENDING)
             
-            # Adiciona posição no ranking
-            user_data['ranking_position'] = posicao
-            user_data['ranking_points'] = user_data.get('points', 0)
-            user_data['ranking_exams_count'] = user_data.get('exams', 0)
+            if offset:
+                query = query.offset(offset)
+            if limit:
+                query = query.limit(limit)
             
-            posicao += 1
-            ranking.append(user_data)
+            rows = [{**doc.to_dict(), 'id': doc.id} for doc in query.stream()]
+            if pending:
+                rows = _merge_pending_points(rows, pending)
         
-        return ranking
+        # Busca informações completas dos usuários em lote
+        details = get_users_details(row.get('uid') for row in rows)
+        return _join_ranking_details(rows, details, offset)
     except Exception as e:
         print(f"Erro ao buscar ranking atual: {e}")
         return []
 
+def _join_ranking_details(rows, details, offset=0):
+    """
+    Junta às linhas do ranking os dados dos usuários e a posição de cada um.
+    """
+    ranking = []
+    posicao = offset + 1
+    
+    for user_data in rows:
+        user_main_data = details.get(user_data.get('uid'))
+        if user_main_data:
+            user_data.update(user_main_data)
+        else:
+            # Se não encontrar, usa dados básicos
+            user_data.setdefault('name', '')
+            user_data.setdefault('apelido', '')
+            user_data.setdefault('telefone', '')
+            user_data.setdefault('provincia', '')
+            user_data.setdefault('gender', '')
+            user_data.setdefault('birthYear', '')
+        
+        # Adiciona posição no ranking
+        user_data['ranking_position'] = posicao
+        user_data['ranking_points'] = user_data.get('points', 0)
+        user_data['ranking_exams_count'] = user_data.get('exams', 0)
+        
+        posicao += 1
+        ranking.append(user_data)
+    
+    return ranking
+
 def get_previous_month_winners():
     """
     Obtém os vencedores do mês anterior - ESTRUTURA CORRIGIDA
     """
-    # Calcula mês anterior
-    hoje = datetime.now()
-    primeiro_dia_mes_atual = datetime(hoje.year, hoje.month, 1)
-    ultimo_dia_mes_anterior = primeiro_dia_mes_atual - timedelta(days=1)
-    mes_anterior = ultimo_dia_mes_anterior.strftime('%Y-%m')
+    mes_anterior = _previous_month()
     
     try:
         # Busca no monthly_ranking do mês anterior
         users_ref = db.collection('monthly_ranking').document(mes_anterior).collection('users')
         query = users_ref.order_by('points', direction=firestore.Query.DESCENDING).limit(10)
         
-        docs = query.stream()
-        winners = []
-        posicao = 1
+        rows = [{**doc.to_dict(), 'id': doc.id} for doc in query.stream()]
         
-        for doc in docs:
-            user_data = doc.to_dict()
-            user_data['id'] = doc.id
-            
-            # Busca informações completas do usuário
-            try:
-                user_main_data = get_user_details(user_data.get('uid'))
-                user_data.update(user_main_data)
-            except:
-                pass
-            
-            user_data['position'] = posicao
-            user_data['ranking_points'] = user_data.get('points', 0)
-            posicao += 1
-            winners.append(user_data)
-        
-        return winners
+        # Busca informações completas dos usuários em lote
+        details = get_users_details(row.get('uid') for row in rows)
+        return _join_winner_details(rows, details)
     except Exception as e:
         print(f"Erro ao buscar vencedores do mês anterior: {e}")
         return []
 
+def _previous_month():
+    # Calcula mês anterior
+    hoje = datetime.now()
+    primeiro_dia_mes_atual = datetime(hoje.year, hoje.month, 1)
+    ultimo_dia_mes_anterior = primeiro_dia_mes_atual - timedelta(days=1)
+    return ultimo_dia_mes_anterior.strftime('%Y-%m')
+
+def _join_winner_details(rows, details):
+    winners = []
+    posicao = 1
+    
+    for user_data in rows:
+        user_data.update(details.get(user_data.get('uid'), {}))
+        
+        user_data['position'] = posicao
+        user_data['ranking_points'] = user_data.get('points', 0)
+        posicao += 1
+        winners.append(user_data)
+    
+    return winners
+
+# 🔥 CONTADORES DE DISTRIBUIÇÃO DO RANKING (ranking_stats/<mês>)
+RANKING_LEVELS = (
+    (100, 'Expert'),
+    (50, 'Avançado'),
+    (20, 'Intermediário'),
+    (0, 'Iniciante'),
+)
+PROVINCIA_NAO_INFORMADA = 'Não informada'
+
+
+def ranking_level_for(points):
+    """
+    Nível do ranking correspondente a uma pontuação.
+    """
+    for minimo, nivel in RANKING_LEVELS:
+        if points >= minimo:
+            return nivel
+    return RANKING_LEVELS[-1][1]
+
+def _ranking_stats_ref(month):
+    return db.collection('ranking_stats').document(month)
+
+def _ranking_stats_delta(old_points, new_points, provincia=None):
+    """
+    Incrementos a aplicar (set com merge) nos contadores do mês quando um
+    usuário passa de old_points para new_points. old_points=None indica um
+    usuário novo no ranking. Devolve None se nenhum contador muda.
+    """
+    new_level = ranking_level_for(new_points)
+    
+    if old_points is None:
+        return {
+            'total': firestore.Increment(1),
+            'levels': {new_level: firestore.Increment(1)},
+            'provinces': {provincia or PROVINCIA_NAO_INFORMADA: firestore.Increment(1)},
+            'updatedAt': now().isoformat()
+        }
+    
+    old_level = ranking_level_for(old_points)
+    if old_level == new_level:
+        return None
+    
+    return {
+        'levels': {
+            old_level: firestore.Increment(-1),
+            new_level: firestore.Increment(1)
+        },
+        'updatedAt': now().isoformat()
+    }
+
+def rebuild_ranking_stats(month=None):
+    """
+    Recalcula do zero os contadores de nível e província de um mês a partir
+    de monthly_ranking/<mês>/users e grava em ranking_stats/<mês>.
+    """
+    month = month or datetime.now().strftime('%Y-%m')
+    return _rebuild_ranking_stats(db.transaction(), month)
+
+@firestore.transactional
+def _rebuild_ranking_stats(transaction, month):
+    """
+    A leitura do ranking e a escrita dos contadores vão na mesma transação:
+    um incremento que mude uma linha lida aborta a reconstrução (que é
+    repetida), e um incremento que leu o documento ainda por reconstruir
+    aborta no commit e volta a ler os contadores já com rebuiltAt.
+    """
+    users_ref = db.collection('monthly_ranking').document(month).collection('users')
+    
+    rows = [doc.to_dict() for doc in users_ref.select(['uid', 'points']).stream(transaction=transaction)]
+    provincias = get_users_by_ids((row.get('uid') for row in rows), field_paths=['provincia'])
+    
+    niveis = {}
+    por_provincia = {}
+    for row in rows:
+        nivel = ranking_level_for(row.get('points', 0))
+        niveis[nivel] = niveis.get(nivel, 0) + 1
+        
+        provincia = provincias.get(row.get('uid'), {}).get('provincia') or PROVINCIA_NAO_INFORMADA
+        por_provincia[provincia] = por_provincia.get(provincia, 0) + 1
+    
+    stats = {
+        'total': len(rows),
+        'levels': niveis,
+        'provinces': por_provincia,
+        'updatedAt': now().isoformat(),
+        'rebuiltAt': now().isoformat()
+    }
+    transaction.set(_ranking_stats_ref(month), stats)
+    return stats
+
+def get_ranking_distribution(month=None):
+    """
+    Lê os contadores de distribuição do mês (uma leitura de documento).
+    Sem rebuiltAt os contadores ainda não foram reconstruídos e podem estar
+    incompletos: são devolvidos como estão, com rebuilt=False, e quem chama
+    agenda a reconstrução (snapshots.start_ranking_stats_job). A reconstrução
+    percorre o ranking inteiro numa transação e não deve correr num pedido.
+    """
+    month = month or datetime.now().strftime('%Y-%m')
+    doc = _ranking_stats_ref(month).get()
+    return _ranking_distribution(doc.to_dict() if doc.exists else {})
+
+def _ranking_distribution(stats):
+    stats['rebuilt'] = 'rebuiltAt' in stats
+    # Níveis que já esvaziaram não aparecem na resposta
+    stats['levels'] = {k: v for k, v in stats.get('levels', {}).items() if v > 0}
+    stats['provinces'] = {k: v for k, v in stats.get('provinces', {}).items() if v > 0}
+    return stats
+
 def count_ranking_users():
     """
     Conta usuários que estão no ranking (baseado na estrutura monthly_ranking)
@@ -277,11 +973,8 @@ def count_ranking_users():
     current_month = datetime.now().strftime('%Y-%m')
     
     try:
-        users_ref = db.collection('monthly_ranking').document(current_month).collection('users')
         # Conta documentos onde points > 0
-        query = users_ref.where('points', '>', 0)
-        docs = list(query.stream())
-        return len(docs)
+        return aggregate(f'monthly_ranking/{current_month}/users', [('points', '>', 0)])
     except Exception as e:
         print(f"Erro ao contar usuários do ranking: {e}")
         return 0
@@ -289,127 +982,379 @@ def count_ranking_users():
 def update_user_ranking_points(user_id, points_to_add, exam_data=None):
     """
     Atualiza pontos de ranking de um usuário - ESTRUTURA CORRIGIDA
+    Tudo numa única transação: uma leitura (ranking e contadores do mês) e um
+    commit com o incremento, os contadores e o histórico do exame.
     """
     from datetime import datetime
     
     current_month = datetime.now().strftime('%Y-%m')
     
     try:
-        # Referência para o usuário no monthly_ranking
-        user_ref = db.collection('monthly_ranking').document(current_month).collection('users').document(user_id)
-        
-        # Verifica se já existe
-        user_doc = user_ref.get()
+        history = [_exam_history_entry(user_id, points_to_add, exam_data, current_month)] if exam_data else []
+        updated_data = _apply_ranking_increment(
+            db.transaction(), current_month, user_id, points_to_add, 1, history
+        )
         
-        if user_doc.exists:
-            # Atualiza usuário existente
-            user_ref.update({
-                'points': firestore.Increment(points_to_add),
-                'exams': firestore.Increment(1),
-                'updatedAt': now().isoformat()
-            })
-        else:
-            # Cria novo usuário no ranking
-            # Primeiro busca dados principais do usuário
-            user_main_data = get_user_details(user_id)
-            
-            user_data = {
-                'uid': user_id,
-                'name': f"{user_main_data.get('name', '')} {user_main_data.get('apelido', '')}".strip(),
-                'photo': user_main_data.get('image', ''),
-                'points': points_to_add,
-                'exams': 1,
-                'month': current_month,
-                'updatedAt': now().isoformat(),
-                'createdAt': now().isoformat()
-            }
-            user_ref.set(user_data)
-        
-        # Registra no histórico do exame se fornecido
-        if exam_data:
-            exam_history_ref = db.collection('user_exam_history').document()
-            exam_history_ref.set({
-                'user_id': user_id,
-                'exam_id': exam_data.get('examId'),
-                'points_earned': points_to_add,
-                'total_correct': exam_data.get('totalSuccess', 0),
-                'total_questions': exam_data.get('totalQuestions', 0),
-                'category': exam_data.get('categoryName'),
-                'passed': exam_data.get('passed', False),
-                'completed_at': now().isoformat(),
-                'month': current_month
-            })
-        
-        # Retorna os dados atualizados
-        updated_doc = user_ref.get()
-        return updated_doc.to_dict()
+        # Atualiza o top-K em memória sem reler o ranking; a nova versão da tag
+        # faz os outros processos recarregarem o seu
+        leaderboard.apply(current_month, {**updated_data, 'id': user_id}, bump_tag(RANKING_TAG))
+        return updated_data
         
     except Exception as e:
         print(f"Erro ao atualizar pontos do ranking: {e}")
         raise e
 
+def _exam_history_entry(user_id, points_earned, exam_data, month):
+    """
+    Documento de user_exam_history para um exame concluído.
+    """
+    return {
+        'user_id': user_id,
+        'exam_id': exam_data.get('examId'),
+        'points_earned': points_earned,
+        'total_correct': exam_data.get('totalSuccess', 0),
+        'total_questions': exam_data.get('totalQuestions', 0),
+        'category': exam_data.get('categoryName'),
+        'passed': exam_data.get('passed', False),
+        'completed_at': now().isoformat(),
+        'month': month
+    }
+
+def _ranking_user_ref(month, user_id):
+    return db.collection('monthly_ranking').document(month).collection('users').document(user_id)
+
+def _read_ranking_entry(transaction, month, user_id):
+    """
+    Lê na transação, num só get_all, o documento do usuário no ranking e o
+    dos contadores do mês. Devolve (ranking_ref, snapshot, stats_ready):
+    os contadores só recebem incrementos depois de reconstruídos (rebuiltAt).
+    """
+    ranking_ref = _ranking_user_ref(month, user_id)
+    stats_ref = _ranking_stats_ref(month)
+    snapshots = {
+        snapshot.reference.path: snapshot
+        for snapshot in db.get_all([ranking_ref, stats_ref], transaction=transaction)
+    }
+    stats = snapshots[stats_ref.path]
+    stats_ready = stats.exists and 'rebuiltAt' in stats.to_dict()
+    return ranking_ref, snapshots[ranking_ref.path], stats_ready
+
+@firestore.transactional
+def _apply_ranking_increment(transaction, month, user_id, points_to_add, exams_to_add, history=()):
+    """
+    Soma pontos e exames ao usuário em monthly_ranking/<mês>/users/<uid>.
+    Devolve o documento resultante, calculado a partir do snapshot da transação.
+    """
+    ranking_ref, snapshot, stats_ready = _read_ranking_entry(transaction, month, user_id)
+    return _write_ranking_increment(
+        transaction, ranking_ref, snapshot, stats_ready, month, user_id, points_to_add, exams_to_add, history
+    )
+
+def _write_ranking_increment(transaction, ranking_ref, snapshot, stats_ready, month, user_id, points_to_add,
+                             exams_to_add, history=(), history_ids=None, extra_fields=None):
+    """
+    Escritas de um incremento do ranking dentro de uma transação já lida.
+    Os dados do perfil (nome, foto) só são copiados quando o documento é criado.
+    Sem stats_ready os contadores ficam para a reconstrução, que lê este incremento.
+    'history_ids' permite IDs fixos no histórico (escritas idempotentes).
+    """
+    timestamp = now().isoformat()
+    
+    if snapshot.exists:
+        current = snapshot.to_dict()
+        old_points = current.get('points', 0)
+        profile = {}
+        stats_delta = _ranking_stats_delta(old_points, old_points + points_to_add)
+    else:
+        # Primeira pontuação do mês: busca dados principais do usuário (cache)
+        current = {}
+        old_points = 0
+        user_main_data = get_user_details(user_id)
+        profile = {
+            'uid': user_id,
+            'name': f"{user_main_data.get('name', '')} {user_main_data.get('apelido', '')}".strip(),
+            'photo': user_main_data.get('image', ''),
+            'month': month,
+            'createdAt': timestamp
+        }
+        stats_delta = _ranking_stats_delta(None, points_to_add, user_main_data.get('provincia'))
+    
+    extra_fields = extra_fields or {}
+    transaction.set(ranking_ref, {
+        **profile,
+        **extra_fields,
+        'points': firestore.Increment(points_to_add),
+        'exams': firestore.Increment(exams_to_add),
+        'updatedAt': timestamp
+    }, merge=True)
+    
+    if stats_ready and stats_delta:
+        transaction.set(_ranking_stats_ref(month), stats_delta, merge=True)
+    
+    history_ref = db.collection('user_exam_history')
+    for index, entry in enumerate(history):
+        doc_id = history_ids[index] if history_ids else None
+        transaction.set(history_ref.document(doc_id), entry)
+    
+    return {
+        **current,
+        **profile,
+        **extra_fields,
+        'points': old_points + points_to_add,
+        'exams': current.get('exams', 0) + exams_to_add,
+        'updatedAt': timestamp
+    }
+
+# ---------------------------------------------------------------------------
+# Fila write-behind de pontos do ranking (RANKING_WRITE_BEHIND)
+# ---------------------------------------------------------------------------
+
+# Último ID da fila já aplicado ao documento do ranking (re-entregas são ignoradas)
+RANKING_QUEUE_SEQUENCE_FIELD = 'queueSequence'
+
+def flush_ranking_points_queue(batch_size=None):
+    """
+    Aplica ao Firestore os pontos pendentes na fila local.
+    Os incrementos de cada (mês, uid) são somados e gravados numa única transação.
+    Entrega pelo menos uma vez: as linhas só saem da fila depois do commit, e o
+    campo queueSequence do documento impede que uma re-entrega conte duas vezes.
+    Devolve {'users': ..., 'rows': ..., 'failed': ...}.
+    """
+    rows = ranking_queue.pending_batch(batch_size)
+    
+    groups = {}
+    for row in rows:
+        groups.setdefault((row.month, row.uid), []).append(row)
+    
+    result = {'users': 0, 'rows': 0, 'failed': 0}
+    for (month, uid), group in groups.items():
+        try:
+            updated_data = _flush_queued_points(db.transaction(), month, uid, group)
+        except UserNotFound as e:
+            # Usuário inexistente: não adianta repetir. Outros ValueError (ex: o
+            # @firestore.transactional esgotar as tentativas) voltam à fila
+            ranking_queue.mark_failed(group, str(e), permanent=True)
+            result['failed'] += len(group)
+            continue
+        except Exception as e:
+            logger.warning("Falha ao aplicar pontos de %s (%s): %s", uid, month, e)
+            ranking_queue.mark_failed(group, str(e))
+            result['failed'] += len(group)
+            continue
+        
+        ranking_queue.mark_flushed(group)
+        if updated_data is not None:
+            leaderboard.apply(month, {**updated_data, 'id': uid}, bump_tag(RANKING_TAG))
+        result['users'] += 1
+        result['rows'] += len(group)
+    
+    return result
+
+@firestore.transactional
+def _flush_queued_points(transaction, month, user_id, rows):
+    ranking_ref, snapshot, stats_ready = _read_ranking_entry(transaction, month, user_id)
+    
+    applied = snapshot.to_dict().get(RANKING_QUEUE_SEQUENCE_FIELD, 0) if snapshot.exists else 0
+    rows = [row for row in rows if row.id > applied]
+    if not rows:
+        return None
+    
+    history = []
+    history_ids = []
+    for row in rows:
+        if row.exam_data:
+            history.append(_exam_history_entry(user_id, row.points, row.exam_data, month))
+            history_ids.append(row.idempotency_key)
+    
+    return _write_ranking_increment(
+        transaction, ranking_ref, snapshot, stats_ready, month, user_id,
+        sum(row.points for row in rows), len(rows), history, history_ids,
+        {RANKING_QUEUE_SEQUENCE_FIELD: max(row.id for row in rows)}
+    )
+
+def _merge_pending_points(rows, pending, include_new=False):
+    """
+    Soma às linhas do ranking os pontos ainda na fila e reordena.
+    Com include_new, usuários que só existem na fila entram como linhas novas.
+    """
+    rows = [dict(row) for row in rows]
+    seen = set()
+    for row in rows:
+        delta = pending.get(row['id'])
+        if delta:
+            row['points'] = row.get('points', 0) + delta['points']
+            row['exams'] = row.get('exams', 0) + delta['exams']
+        seen.add(row['id'])
+    
+    if include_new:
+        rows.extend(
+            {'id': uid, 'uid': uid, 'points': delta['points'], 'exams': delta['exams']}
+            for uid, delta in pending.items() if uid not in seen
+        )
+    
+    rows.sort(key=lambda row: (-row.get('points', 0), row['id']))
+    return rows
+
+# Tamanho do snapshot mensal e número de vencedores premiados
+SNAPSHOT_SIZE = 100
+SNAPSHOT_WINNERS = 10
+
 def save_monthly_ranking_snapshot():
     """
     Salva um snapshot do ranking no final do mês - ESTRUTURA CORRIGIDA
+    Idempotente: ranking_history/<mês> e ranking_winners/<mês>_<posição> têm IDs
+    fixos, por isso repetir o snapshot substitui os documentos em vez de duplicar.
+    Cada usuário é gravado numa projeção compacta (sem senha nem documento completo)
+    e o histórico e os vencedores vão no mesmo batch.
+    Lê o top direto do Firestore (não o top-K em memória, que pode estar
+    atrasado) e deixa passar os erros, para o job falhar em vez de gravar
+    um snapshot vazio.
     """
     from datetime import datetime
     
     current_month = datetime.now().strftime('%Y-%m')
-    current_ranking = get_current_ranking(limit=100)
+    current_ranking = _snapshot_ranking(current_month)
+    captured_at = now().isoformat()
     
-    # Salva snapshot
-    ranking_snapshot_ref = db.collection('ranking_history').document()
     snapshot_data = {
         'month': current_month,
-        'captured_at': now().isoformat(),
-        'top_100': current_ranking
+        'captured_at': captured_at,
+        'top_100': [_snapshot_row(user) for user in current_ranking]
     }
-    ranking_snapshot_ref.set(snapshot_data)
+    
+    batch = db.batch()
+    batch.set(db.collection('ranking_history').document(current_month), snapshot_data)
     
     # Salva top 10 como vencedores
-    for i, user in enumerate(current_ranking[:10], 1):
-        winner_ref = db.collection('ranking_winners').document()
-        winner_ref.set({
-            'user_id': user.get('uid', user.get('id')),
-            'user_name': user.get('name', ''),
-            'user_photo': user.get('photo', ''),
-            'points': user.get('points', user.get('ranking_points', 0)),
-            'position': i,
+    for user in snapshot_data['top_100'][:SNAPSHOT_WINNERS]:
+        winner_ref = db.collection('ranking_winners').document(f"{current_month}_{user['position']}")
+        batch.set(winner_ref, {
+            'user_id': user['uid'],
+            'user_name': user['name'],
+            'user_photo': user['photo'],
+            'points': user['points'],
+            'position': user['position'],
             'month': current_month,
-            'awarded_at': now().isoformat()
+            'awarded_at': captured_at
         })
     
+    batch.commit()
     return snapshot_data
 
+def _snapshot_ranking(month):
+    """
+    Top SNAPSHOT_SIZE do mês numa query ordenada, com os pontos ainda na fila
+    (modo write-behind) somados. Levanta ValueError se o ranking vier vazio.
+    """
+    users_ref = db.collection('monthly_ranking').document(month).collection('users')
+    query = users_ref.order_by('points', direction=firestore.Query.DESCENDING).limit(SNAPSHOT_SIZE)
+    rows = [{**doc.to_dict(), 'id': doc.id} for doc in query.stream()]
+    
+    if ranking_queue.write_behind_enabled():
+        pending = ranking_queue.pending_totals(month)
+        if pending:
+            rows = _merge_pending_points(rows, pending)
+    
+    if not rows:
+        raise ValueError(f"Ranking de {month} vazio: snapshot não gravado")
+    
+    details = get_users_details(row.get('uid') for row in rows)
+    return _join_ranking_details(rows, details)
+
+def _snapshot_row(user):
+    """
+    Projeção de uma linha do ranking guardada no snapshot mensal.
+    """
+    return {
+        'position': user.get('ranking_position'),
+        'uid': user.get('uid', user.get('id')),
+        'name': user.get('name', ''),
+        'apelido': user.get('apelido', ''),
+        'photo': user.get('photo') or user.get('image', ''),
+        'provincia': user.get('provincia', ''),
+        'points': user.get('points', user.get('ranking_points', 0)),
+        'exams': user.get('exams', user.get('ranking_exams_count', 0))
+    }
+
 def get_user_details(user_id):
     """
     Obtém detalhes completos de um usuário específico
     """
+    cache = _user_cache()
+    user_data = cache.get(_user_cache_key(user_id))
+    if user_data is not None:
+        _count_cache(hits=1)
+        return _with_user_defaults(user_data)
+    _count_cache(misses=1)
+    
     user_ref = db.collection('users').document(user_id)
     doc = user_ref.get()
     
     if not doc.exists:
-        raise ValueError(f"Usuário com ID {user_id} não encontrado")
+        raise UserNotFound(f"Usuário com ID {user_id} não encontrado")
     
     user_data = doc.to_dict()
     user_data['id'] = doc.id
+    cache_user(dict(user_data))
     
-    # Garante que todos os campos existam
-    campos_obrigatorios = {
-        'name': '',
-        'apelido': '',
-        'gender': '',
-        'birthYear': '',
-        'provincia': '',
-        'telefone': '',
-        'email': '',
-        'isPro': False,
-        'acceptedRanking': False,
-        'createdAt': '',
-        'updatedAt': ''
-    }
+    return _with_user_defaults(user_data)
+
+def get_users_by_ids(user_ids, field_paths=None, chunk_size=USER_BATCH_SIZE):
+    """
+    Lê vários documentos da coleção 'users' com db.get_all, em blocos de
+    'chunk_size' (um RPC por bloco em vez de um por usuário).
+    Devolve um dict {uid: dados}; IDs inexistentes ficam de fora.
+    """
+    unique_ids = list(dict.fromkeys(uid for uid in user_ids if uid))
+    if mirror.mirror_enabled():
+        return mirror.get_mirror_users_by_ids(unique_ids, field_paths)
+
+    users_ref = db.collection('users')
+    
+    users = {}
+    projection = _cache_projection(field_paths)
+    if projection and unique_ids:
+        # Um documento completo em cache também serve para a projeção,
+        # reduzido aos mesmos campos (sem a senha e o resto do perfil)
+        keys = {_user_cache_key(uid, projection): uid for uid in unique_ids}
+        if projection != 'full':
+            keys.update({_user_cache_key(uid): uid for uid in unique_ids})
+        for key, user_data in _user_cache().get_many(list(keys)).items():
+            uid = keys[key]
+            if projection != 'full' and key == _user_cache_key(uid):
+                user_data = _detail_projection(user_data)
+            users[uid] = user_data
     
-    for campo, valor_padrao in campos_obrigatorios.items():
+    missing = [uid for uid in unique_ids if uid not in users]
+    if projection:
+        _count_cache(hits=len(users), misses=len(missing))
+    
+    fetched = {}
+    for inicio in range(0, len(missing), chunk_size):
+        refs = [users_ref.document(uid) for uid in missing[inicio:inicio + chunk_size]]
+        for doc in db.get_all(refs, field_paths=field_paths):
+            if doc.exists:
+                fetched[_user_cache_key(doc.id, projection)] = { 'id': doc.id, **doc.to_dict() }
+    
+    if projection and fetched:
+        _user_cache().set_many(fetched)
+    users.update((user_data['id'], user_data) for user_data in fetched.values())
+    
+    return users
+
+def get_users_details(user_ids):
+    """
+    Versão em lote de get_user_details para os joins do ranking: lê apenas
+    os campos de USER_DETAIL_FIELDS e preenche os mesmos valores padrão.
+    """
+    users = get_users_by_ids(user_ids, field_paths=USER_DETAIL_FIELDS)
+    return {uid: _with_user_defaults(user_data) for uid, user_data in users.items()}
+
+def _with_user_defaults(user_data):
+    """
+    Garante que todos os campos de USER_DEFAULTS existam no dict do usuário.
+    """
+    for campo, valor_padrao in USER_DEFAULTS.items():
         user_data.setdefault(campo, valor_padrao)
     
     return user_data
@@ -437,4 +1382,6 @@ def update_user_ranking(user_id, pontos=None, nivel=None, premiado=None):
     
     # Retorna os dados atualizados
     updated_doc = user_ref.get()
-    return updated_doc.to_dict()
\ No newline at end of file
+    updated_data = updated_doc.to_dict()
+    cache_user({ 'id': user_id, **updated_data })
+    return updated_data
\ No newline at end of file
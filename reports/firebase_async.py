@@ -0,0 +1,249 @@
+"""
+Leituras de reports.firebase sobre o firestore.AsyncClient, usadas pelas
+views assíncronas (reports.async_views) quando o projeto corre em ASGI.
+Partilham com a versão síncrona o cache de usuários, o top-K do ranking em
+memória e os valores padrão; as views WSGI continuam a usar reports.firebase.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from weakref import WeakKeyDictionary
+
+from asgiref.sync import sync_to_async
+from firebase_admin import firestore
+
+from . import backends, mirror, ranking_queue
+from .firebase import (
+    AGGREGATIONS,
+    USER_BATCH_SIZE,
+    USER_DETAIL_FIELDS,
+    UserNotFound,
+    _cache_projection,
+    _count_cache,
+    _detail_projection,
+    _join_ranking_details,
+    _join_winner_details,
+    _merge_pending_points,
+    _previous_month,
+    _ranking_distribution,
+    _user_cache,
+    _user_cache_entries,
+    _user_cache_key,
+    _with_user_defaults,
+)
+from .leaderboard import leaderboard
+from .memory_firestore import AsyncMemoryFirestore
+from .metrics import InstrumentedAsyncFirestore, metrics_enabled
+
+logger = logging.getLogger(__name__)
+
+# Os canais gRPC assíncronos ficam presos ao event loop onde foram criados:
+# um cliente por loop (em uvicorn há um só; em WSGI cada pedido tem o seu)
+_clients = WeakKeyDictionary()
+_reload_locks = WeakKeyDictionary()
+
+
+def async_db():
+    """
+    Cliente Firestore assíncrono do event loop atual, com as credenciais da app Firebase.
+    Fora do backend 'firestore', adapta o cliente síncrono de reports.backends.
+    Como o 'db' síncrono, conta RPCs e documentos nas métricas do pedido.
+    """
+    if backends.backend_name() != backends.BACKEND_FIRESTORE:
+        client = AsyncMemoryFirestore(backends.get_firestore())
+        return InstrumentedAsyncFirestore(client) if metrics_enabled() else client
+
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        app = backends.get_app()
+        client = firestore.AsyncClient(
+            project=app.project_id,
+            credentials=app.credential.get_credential(),
+        )
+        _clients[loop] = client
+    return InstrumentedAsyncFirestore(client) if metrics_enabled() else client
+
+
+async def get_users_page(page_size, start_after=None):
+    if mirror.mirror_enabled():
+        return await sync_to_async(mirror.get_mirror_users_page)(page_size, start_after)
+
+    query = async_db().collection('users').order_by('__name__')
+    if start_after:
+        query = query.start_after({'__name__': start_after})
+
+    return [{ 'id': doc.id, **doc.to_dict() } async for doc in query.limit(page_size).stream()]
+
+
+async def count_users():
+    return await aggregate('users')
+
+
+async def aggregate(collection, filters=None, op='count', field=None):
+    """
+    Igual a firebase.aggregate: um único RPC de agregação no Firestore.
+    """
+    if op not in AGGREGATIONS:
+        raise ValueError(f"Agregação inválida: {op}")
+    if op != 'count' and not field:
+        raise ValueError(f"A agregação '{op}' precisa de um campo.")
+
+    query = async_db().collection(collection)
+    for field_name, operator, value in filters or []:
+        query = query.where(field_name, operator, value)
+
+    if op == 'count':
+        aggregation_query = query.count(alias=op)
+    else:
+        aggregation_query = getattr(query, op)(field, alias=op)
+
+    results = await aggregation_query.get()
+    return results[0][0].value
+
+
+async def get_user_details(user_id):
+    # Os métodos a* do cache do Django correm fora do event loop
+    user_data = await _user_cache().aget(_user_cache_key(user_id))
+    if user_data is not None:
+        _count_cache(hits=1)
+        return _with_user_defaults(user_data)
+    _count_cache(misses=1)
+
+    doc = await async_db().collection('users').document(user_id).get()
+    if not doc.exists:
+        raise UserNotFound(f"Usuário com ID {user_id} não encontrado")
+
+    user_data = doc.to_dict()
+    user_data['id'] = doc.id
+    await _user_cache().aset_many(_user_cache_entries(dict(user_data)))
+
+    return _with_user_defaults(user_data)
+
+
+async def get_users_by_ids(user_ids, field_paths=None, chunk_size=USER_BATCH_SIZE):
+    """
+    Igual a firebase.get_users_by_ids, mas os blocos de get_all seguem em paralelo.
+    """
+    unique_ids = list(dict.fromkeys(uid for uid in user_ids if uid))
+    if mirror.mirror_enabled():
+        return await sync_to_async(mirror.get_mirror_users_by_ids)(unique_ids, field_paths)
+
+    users = {}
+    projection = _cache_projection(field_paths)
+    if projection and unique_ids:
+        keys = {_user_cache_key(uid, projection): uid for uid in unique_ids}
+        if projection != 'full':
+            keys.update({_user_cache_key(uid): uid for uid in unique_ids})
+        for key, user_data in (await _user_cache().aget_many(list(keys))).items():
+            uid = keys[key]
+            if projection != 'full' and key == _user_cache_key(uid):
+                user_data = _detail_projection(user_data)
+            users[uid] = user_data
+
+    missing = [uid for uid in unique_ids if uid not in users]
+    if projection:
+        _count_cache(hits=len(users), misses=len(missing))
+
+    client = async_db()
+    users_ref = client.collection('users')
+
+    async def fetch(chunk):
+        refs = [users_ref.document(uid) for uid in chunk]
+        return [doc async for doc in client.get_all(refs, field_paths=field_paths) if doc.exists]
+
+    chunks = await asyncio.gather(*(
+        fetch(missing[inicio:inicio + chunk_size]) for inicio in range(0, len(missing), chunk_size)
+    ))
+
+    fetched = {
+        _user_cache_key(doc.id, projection): { 'id': doc.id, **doc.to_dict() }
+        for docs in chunks for doc in docs
+    }
+    if projection and fetched:
+        await _user_cache().aset_many(fetched)
+    users.update((user_data['id'], user_data) for user_data in fetched.values())
+
+    return users
+
+
+async def get_users_details(user_ids):
+    users = await get_users_by_ids(user_ids, field_paths=USER_DETAIL_FIELDS)
+    return {uid: _with_user_defaults(user_data) for uid, user_data in users.items()}
+
+
+async def _current_leaderboard(current_month):
+    if leaderboard.needs_reload(current_month):
+        loop = asyncio.get_running_loop()
+        lock = _reload_locks.setdefault(loop, asyncio.Lock())
+        async with lock:
+            if leaderboard.needs_reload(current_month):
+                version = leaderboard.shared_version()
+                users_ref = async_db().collection('monthly_ranking').document(current_month).collection('users')
+                query = users_ref.order_by('points', direction=firestore.Query.DESCENDING).limit(leaderboard.size)
+                leaderboard.load(current_month, [{**doc.to_dict(), 'id': doc.id} async for doc in query.stream()], version)
+    return leaderboard
+
+
+async def get_current_ranking(limit=50, offset=0):
+    current_month = datetime.now().strftime('%Y-%m')
+
+    try:
+        pending = {}
+        if ranking_queue.write_behind_enabled():
+            pending = await sync_to_async(ranking_queue.pending_totals)(current_month)
+
+        if limit and offset + limit <= leaderboard.size:
+            board = await _current_leaderboard(current_month)
+            if pending:
+                rows = _merge_pending_points(board.top(board.size), pending, include_new=True)[offset:offset + limit]
+            else:
+                rows = board.top(limit, offset)
+        else:
+            users_ref = async_db().collection('monthly_ranking').document(current_month).collection('users')
+            query = users_ref.order_by('points', direction=firestore.Query.DESCENDING)
+            if offset:
+                query = query.offset(offset)
+            if limit:
+                query = query.limit(limit)
+
+            rows = [{**doc.to_dict(), 'id': doc.id} async for doc in query.stream()]
+            if pending:
+                rows = _merge_pending_points(rows, pending)
+
+        details = await get_users_details(row.get('uid') for row in rows)
+        return _join_ranking_details(rows, details, offset)
+    except Exception:
+        logger.exception("Erro ao buscar ranking atual")
+        return []
+
+
+async def get_previous_month_winners():
+    mes_anterior = _previous_month()
+
+    try:
+        users_ref = async_db().collection('monthly_ranking').document(mes_anterior).collection('users')
+        query = users_ref.order_by('points', direction=firestore.Query.DESCENDING).limit(10)
+
+        rows = [{**doc.to_dict(), 'id': doc.id} async for doc in query.stream()]
+        details = await get_users_details(row.get('uid') for row in rows)
+        return _join_winner_details(rows, details)
+    except Exception:
+        logger.exception("Erro ao buscar vencedores do mês anterior")
+        return []
+
+
+async def count_ranking_users():
+    current_month = datetime.now().strftime('%Y-%m')
+
+    try:
+        return await aggregate(f'monthly_ranking/{current_month}/users', [('points', '>', 0)])
+    except Exception:
+        logger.exception("Erro ao contar usuários do ranking")
+        return 0
+
+
+async def get_ranking_distribution(month=None):
+    month = month or datetime.now().strftime('%Y-%m')
+    doc = await async_db().collection('ranking_stats').document(month).get()
+    return _ranking_distribution(doc.to_dict() if doc.exists else {})
@@ -0,0 +1,115 @@
+import csv
+import io
+import json
+import re
+import time
+
+from .firebase import bulk_create_users
+
+# Campos aceites por linha (os mesmos de create_user)
+CLIENT_FIELDS = ('name', 'apelido', 'gender', 'birthYear', 'provincia', 'telefone', 'email', 'password', 'image')
+
+PHONE_RE = re.compile(r'^\d{9}$')
+MIN_PASSWORD_LENGTH = 6  # mínimo exigido pelo Firebase Auth
+
+
+def parse_client_rows(content, fmt):
+    """
+    Lê as linhas de um CSV (com cabeçalho) ou de um JSON (lista de objetos,
+    ou {"clients": [...]}) e devolve uma lista de dicts.
+    """
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+
+    if fmt == 'csv':
+        return [dict(row) for row in csv.DictReader(io.StringIO(content))]
+
+    if fmt == 'json':
+        data = json.loads(content)
+        if isinstance(data, dict):
+            data = data.get('clients', [])
+        if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+            raise ValueError('O JSON deve ser uma lista de clientes.')
+        return data
+
+    raise ValueError(f"Formato não suportado: {fmt}")
+
+
+def normalize_phone(value):
+    """
+    Remove espaços, sinais e o indicativo +258 de um número de telefone.
+    """
+    digits = re.sub(r'\D', '', str(value or ''))
+    if len(digits) == 12 and digits.startswith('258'):
+        digits = digits[3:]
+    return digits
+
+
+def validate_client_rows(rows):
+    """
+    Valida e remove duplicados localmente.
+    Devolve (linhas_validas, relatorio) onde o relatório já contém as linhas rejeitadas.
+    Cada linha válida leva o seu número original em '_row'.
+    """
+    valid = []
+    report = []
+    seen_phones = set()
+    seen_emails = set()
+
+    for numero, row in enumerate(rows, start=1):
+        client = {campo: row.get(campo) for campo in CLIENT_FIELDS if row.get(campo) not in (None, '')}
+        telefone = normalize_phone(client.get('telefone'))
+        email = (client.get('email') or f"{telefone}@gmail.com").strip().lower()
+        password = client.get('password')
+
+        error = None
+        status = 'invalid'
+        if not PHONE_RE.match(telefone):
+            error = "Telefone inválido (esperado 9 dígitos)."
+        elif password is not None and len(str(password)) < MIN_PASSWORD_LENGTH:
+            error = f"A senha deve ter pelo menos {MIN_PASSWORD_LENGTH} caracteres."
+        elif telefone in seen_phones:
+            status, error = 'duplicate', "Telefone repetido no ficheiro."
+        elif email in seen_emails:
+            status, error = 'duplicate', "Email repetido no ficheiro."
+
+        if error:
+            report.append({'row': numero, 'telefone': telefone, 'status': status, 'error': error})
+            continue
+
+        seen_phones.add(telefone)
+        seen_emails.add(email)
+        client.update({'telefone': telefone, 'email': email, '_row': numero})
+        valid.append(client)
+
+    return valid, report
+
+
+def import_clients(rows):
+    """
+    Valida, remove duplicados e cria os clientes em lote no Firebase.
+    Devolve {'results': [...por linha...], 'summary': {...}}.
+    """
+    inicio = time.monotonic()
+
+    valid, report = validate_client_rows(rows)
+    report.extend(bulk_create_users(valid))
+    report.sort(key=lambda result: result['row'])
+
+    elapsed = time.monotonic() - inicio
+    counts = {}
+    for result in report:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+
+    return {
+        'results': report,
+        'summary': {
+            'total': len(rows),
+            'created': counts.get('created', 0),
+            'duplicates': counts.get('duplicate', 0),
+            'invalid': counts.get('invalid', 0),
+            'errors': counts.get('error', 0),
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(len(rows) / elapsed, 1) if elapsed else None,
+        }
+    }
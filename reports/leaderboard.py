@@ -0,0 +1,124 @@
+import bisect
+import time
+from threading import Lock
+
+from django.conf import settings
+
+from .response_cache import tag_version
+
+LEADERBOARD_SIZE = getattr(settings, 'RANKING_LEADERBOARD_SIZE', 1000)
+LEADERBOARD_TTL = getattr(settings, 'RANKING_LEADERBOARD_TTL', 300)
+
+# Tag do response_cache incrementada a cada alteração de pontos do ranking
+RANKING_TAG = 'ranking'
+
+
+class MonthlyLeaderboard:
+    """
+    Top-K do ranking de um mês mantido em memória.
+    As linhas ficam ordenadas pela chave (-points, uid), a mesma ordem da query
+    order_by('points', DESCENDING) do Firestore (empates pelo ID do documento).
+    Cada processo tem a sua cópia: antes de servir compara a versão da tag
+    'ranking' no cache partilhado com a que viu e recarrega se outro processo
+    alterou pontos entretanto. Com o LocMemCache a versão também é por
+    processo e só o TTL limita o atraso entre workers.
+    """
+
+    def __init__(self, size=LEADERBOARD_SIZE, ttl=LEADERBOARD_TTL, tag=RANKING_TAG):
+        self.size = size
+        self.ttl = ttl
+        self.tag = tag
+        self.reload_lock = Lock()
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.month = None
+            self.loaded_at = None
+            self.version = None
+            self._keys = []
+            self._rows = {}
+
+    def shared_version(self):
+        """
+        Versão atual da tag do ranking no cache partilhado.
+        """
+        return tag_version(self.tag)
+
+    def needs_reload(self, month):
+        """
+        True se o top-K é de outro mês (virada de mês), passou do TTL ou outro
+        processo alterou pontos depois da última leitura.
+        """
+        if self.month != month or self.loaded_at is None:
+            return True
+        if time.monotonic() - self.loaded_at > self.ttl:
+            return True
+        return self.version != self.shared_version()
+
+    def load(self, month, rows, version=None):
+        """
+        Substitui o conteúdo pelas linhas lidas do Firestore (já ordenadas ou não).
+        'version' deve ser lida (shared_version) antes da query, para que uma
+        alteração feita durante a leitura ainda obrigue a recarregar.
+        """
+        if version is None:
+            version = self.shared_version()
+        rows = {row['id']: dict(row) for row in rows}
+        keys = sorted(self._key(row) for row in rows.values())[:self.size]
+        with self._lock:
+            self.month = month
+            self.loaded_at = time.monotonic()
+            self.version = version
+            self._keys = keys
+            self._rows = {uid: rows[uid] for _, uid in keys}
+
+    def apply(self, month, row, version=None):
+        """
+        Atualiza a posição de um usuário com a linha já incrementada
+        (pontos totais do mês). Linhas de outro mês são ignoradas.
+        'version' é a versão devolvida por bump_tag após esta alteração: se for
+        a seguinte à conhecida, a cópia continua atual; senão houve alterações
+        de outros processos e needs_reload passa a pedir uma nova leitura.
+        """
+        uid = row['id']
+        key = self._key(row)
+        with self._lock:
+            if month != self.month:
+                return
+
+            if version is not None and self.version is not None and version == self.version + 1:
+                self.version = version
+
+            old_row = self._rows.get(uid)
+            if old_row is not None:
+                del self._keys[bisect.bisect_left(self._keys, self._key(old_row))]
+            elif len(self._keys) >= self.size and key >= self._keys[-1]:
+                # Não entra no top-K
+                return
+
+            bisect.insort(self._keys, key)
+            self._rows[uid] = dict(row)
+
+            if len(self._keys) > self.size:
+                _, dropped_uid = self._keys.pop()
+                del self._rows[dropped_uid]
+
+    def top(self, limit, offset=0):
+        """
+        Devolve cópias das linhas nas posições [offset, offset + limit).
+        """
+        with self._lock:
+            return [dict(self._rows[uid]) for _, uid in self._keys[offset:offset + limit]]
+
+    def __len__(self):
+        return len(self._keys)
+
+    @staticmethod
+    def _key(row):
+        return (-row.get('points', 0), row['id'])
+
+
+# Instância única por processo
+leaderboard = MonthlyLeaderboard()
@@ -0,0 +1,83 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reports import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede as operações de reports.firebase sobre um Firestore em memória "
+        "(tempo, pico de memória, RPCs e documentos lidos) e emite um relatório JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=benchmarks.BENCHMARK_USERS,
+            help="Documentos na coleção 'users' (padrão: %(default)s)."
+        )
+        parser.add_argument(
+            '--ranking-rows',
+            type=int,
+            default=benchmarks.BENCHMARK_RANKING_ROWS,
+            help="Linhas no ranking do mês atual (padrão: %(default)s)."
+        )
+        parser.add_argument(
+            '--transactions',
+            type=int,
+            default=benchmarks.BENCHMARK_TRANSACTIONS,
+            help="Transações SQL criadas (e revertidas no fim) (padrão: %(default)s)."
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=benchmarks.BENCHMARK_REPEAT,
+            help="Execuções cronometradas por operação (padrão: %(default)s)."
+        )
+        parser.add_argument(
+            '--only',
+            nargs='+',
+            default=None,
+            help="Corre apenas as operações indicadas (ex: count_users get_current_ranking)."
+        )
+        parser.add_argument(
+            '--output',
+            default=None,
+            help="Grava o relatório JSON neste ficheiro em vez de o imprimir."
+        )
+        parser.add_argument(
+            '--baseline',
+            default=None,
+            help="Relatório JSON anterior para comparar (diferenças no fim do relatório)."
+        )
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError("--repeat deve ser pelo menos 1.")
+
+        try:
+            report = benchmarks.run_benchmarks(
+                users=options['users'],
+                ranking_rows=options['ranking_rows'],
+                transactions=options['transactions'],
+                repeat=options['repeat'],
+                only=options['only'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+            report['compared_to'] = baseline.get('commit')
+            report['changes'] = benchmarks.compare_reports(baseline, report)
+
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Relatório gravado em {options['output']}."))
+        else:
+            self.stdout.write(output)
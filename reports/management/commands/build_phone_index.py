@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from reports.firebase import build_phone_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Cria o índice phone_index/{telefone} a partir da coleção 'users'. "
+        "Depois de correr, ative FIREBASE_PHONE_INDEX_COMPLETE."
+    )
+
+    def handle(self, *args, **options):
+        total, partilhados = build_phone_index()
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} telefones indexados ({partilhados} partilhados por mais de uma conta)."
+        ))
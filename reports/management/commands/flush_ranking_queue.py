@@ -0,0 +1,62 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from reports import ranking_queue
+from reports.firebase import flush_ranking_points_queue
+
+
+class Command(BaseCommand):
+    help = (
+        "Aplica ao Firestore os pontos do ranking pendentes na fila local "
+        "(modo RANKING_WRITE_BEHIND). Use --loop para correr como worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=ranking_queue.RANKING_QUEUE_BATCH_SIZE,
+            help="Linhas da fila lidas por ciclo (padrão: %(default)s)."
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help="Continua a esvaziar a fila até ser interrompido."
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2.0,
+            help="Segundos de espera quando a fila está vazia (padrão: %(default)s)."
+        )
+        parser.add_argument(
+            '--purge-days',
+            type=int,
+            default=7,
+            help="Apaga linhas já aplicadas há mais de N dias (padrão: %(default)s)."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                result = flush_ranking_points_queue(options['batch_size'])
+                if result['rows'] or result['failed']:
+                    self.stdout.write(
+                        f"  {result['rows']} incrementos aplicados a {result['users']} usuários, "
+                        f"{result['failed']} com erro."
+                    )
+
+                if not options['loop']:
+                    break
+                # Fila com mais linhas do que um ciclo: continua sem esperar
+                if result['rows'] + result['failed'] < options['batch_size']:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        removed = ranking_queue.purge_flushed(timedelta(days=options['purge_days']))
+        self.stdout.write(self.style.SUCCESS(
+            f"Fila do ranking processada ({removed} linhas antigas removidas)."
+        ))
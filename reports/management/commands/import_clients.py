@@ -0,0 +1,50 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reports.importers import import_clients, parse_client_rows
+
+
+class Command(BaseCommand):
+    help = "Registra clientes em lote no Firebase a partir de um ficheiro CSV ou JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Caminho do ficheiro CSV (com cabeçalho) ou JSON.")
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'json'],
+            default=None,
+            help="Formato do ficheiro (padrão: pela extensão)."
+        )
+        parser.add_argument(
+            '--report',
+            default=None,
+            help="Grava o resultado por linha neste ficheiro JSON."
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f"Ficheiro não encontrado: {path}")
+
+        fmt = options['format'] or ('json' if path.suffix.lower() == '.json' else 'csv')
+        try:
+            rows = parse_client_rows(path.read_bytes(), fmt)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        report = import_clients(rows)
+
+        if options['report']:
+            Path(options['report']).write_text(
+                json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8'
+            )
+
+        summary = report['summary']
+        self.stdout.write(self.style.SUCCESS(
+            f"{summary['created']} criados, {summary['duplicates']} duplicados, "
+            f"{summary['invalid']} inválidos, {summary['errors']} com erro "
+            f"de {summary['total']} linhas em {summary['elapsed_seconds']}s "
+            f"({summary['rows_per_second']} linhas/s)."
+        ))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from reports import firebase, mirror
+
+
+class Command(BaseCommand):
+    help = (
+        "Mantém a tabela firebase_users sincronizada com a coleção 'users' "
+        "do Firestore através de um listener on_snapshot (processo contínuo)."
+    )
+
+    def handle(self, *args, **options):
+        def on_snapshot(col_snapshot, changes, read_time):
+            upserts = []
+            removed = []
+            for change in changes:
+                if change.type.name == 'REMOVED':
+                    removed.append(change.document.id)
+                else:
+                    upserts.append((change.document.id, change.document.to_dict()))
+
+            # O callback corre numa thread do listener
+            close_old_connections()
+            mirror.upsert_users(upserts)
+            mirror.delete_users(removed)
+            self.stdout.write(
+                f"[{read_time}] {len(upserts)} atualizados, {len(removed)} removidos"
+            )
+
+        watch = firebase.db.collection('users').on_snapshot(on_snapshot)
+        self.stdout.write(self.style.SUCCESS("Listener de usuários ativo. Ctrl+C para sair."))
+
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            watch.unsubscribe()
+            self.stdout.write("Listener encerrado.")
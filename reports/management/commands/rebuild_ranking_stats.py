@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from reports.firebase import rebuild_ranking_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula os contadores de nível e província do ranking "
+        "(ranking_stats/<mês>) a partir de monthly_ranking/<mês>/users."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--month',
+            default=None,
+            help="Mês no formato YYYY-MM (padrão: mês atual)."
+        )
+
+    def handle(self, *args, **options):
+        month = options['month'] or datetime.now().strftime('%Y-%m')
+        stats = rebuild_ranking_stats(month)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Contadores de {month} reconstruídos: {stats['total']} usuários no ranking."
+        ))
+        for nivel, total in stats['levels'].items():
+            self.stdout.write(f"  {nivel}: {total}")
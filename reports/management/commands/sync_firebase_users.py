@@ -0,0 +1,47 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from reports import firebase, mirror
+from reports.models import FirebaseUser
+
+
+class Command(BaseCommand):
+    help = "Copia a coleção 'users' do Firestore para a tabela local firebase_users."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=mirror.MIRROR_BATCH_SIZE,
+            help="Documentos gravados por bloco (padrão: %(default)s)."
+        )
+        parser.add_argument(
+            '--prune',
+            action='store_true',
+            help="Remove do espelho os usuários que já não existem no Firestore."
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        docs = firebase.db.collection('users').stream()
+
+        total = 0
+        seen = set()
+        while True:
+            chunk = [(doc.id, doc.to_dict()) for doc in islice(docs, batch_size)]
+            if not chunk:
+                break
+            total += mirror.upsert_users(chunk)
+            if options['prune']:
+                seen.update(uid for uid, _ in chunk)
+            self.stdout.write(f"  {total} usuários sincronizados...")
+
+        removed = 0
+        if options['prune']:
+            stale = FirebaseUser.objects.exclude(uid__in=seen).values_list('uid', flat=True)
+            removed = mirror.delete_users(list(stale))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Espelho atualizado: {total} usuários copiados, {removed} removidos."
+        ))
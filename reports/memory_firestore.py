@@ -0,0 +1,698 @@
+"""
+Firestore em memória (FIREBASE_BACKEND = 'memory') para testes, benchmarks e
+comandos offline. Implementa a parte da API do google-cloud-firestore usada em
+reports.firebase: coleções aninhadas, where/order_by/limit/offset/start_after/
+select, agregações (count, sum, avg), get_all, batches, transações
+(@firestore.transactional), BulkWriter e as transformações Increment,
+ArrayUnion, ArrayRemove, DELETE_FIELD e SERVER_TIMESTAMP.
+
+Os documentos ficam em .data = {caminho_da_coleção: {id: campos}} e os
+contadores .rpc_count, .docs_read e .docs_written seguem a faturação do
+Firestore (uma query conta pelo menos uma leitura).
+"""
+import copy
+import math
+import threading
+import uuid
+from datetime import date, datetime, timezone
+from functools import cmp_to_key
+
+from google.api_core.exceptions import Aborted, AlreadyExists, NotFound
+from google.cloud.firestore_v1 import (
+    DELETE_FIELD,
+    SERVER_TIMESTAMP,
+    ArrayRemove,
+    ArrayUnion,
+    Increment,
+    Query,
+)
+from google.cloud.firestore_v1.aggregation import AggregationResult
+from google.cloud.firestore_v1.bulk_writer import (
+    BulkWriteFailure,
+    BulkWriterCreateOperation,
+    BulkWriterDeleteOperation,
+    BulkWriterSetOperation,
+    BulkWriterUpdateOperation,
+)
+
+# Escritas enviadas por pedido pelo BulkWriter do SDK
+BULK_WRITER_BATCH_SIZE = 20
+
+# O Firestore cobra uma leitura por cada bloco de 1000 entradas de índice numa agregação
+AGGREGATION_READS_PER_ENTRY = 1000
+
+# Ordem entre tipos diferentes, como no Firestore
+_TYPE_ORDER = ((type(None), 0), (bool, 1), ((int, float), 2), ((datetime, date), 3), (str, 4), (bytes, 5))
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _type_rank(value):
+    for types, rank in _TYPE_ORDER:
+        if isinstance(value, types):
+            return rank
+    return 6
+
+
+def _compare_values(a, b):
+    rank_a, rank_b = _type_rank(a), _type_rank(b)
+    if rank_a != rank_b:
+        return -1 if rank_a < rank_b else 1
+    if rank_a == 6:
+        a, b = repr(a), repr(b)
+    if a == b:
+        return 0
+    return -1 if a < b else 1
+
+
+_MISSING = object()
+
+
+def _get_field(data, field_path, doc_id=None):
+    if field_path == '__name__':
+        return doc_id
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _project(data, field_paths):
+    if field_paths is None:
+        return data
+    projected = {}
+    for field_path in field_paths:
+        value = _get_field(data, field_path)
+        if value is not _MISSING:
+            _set_path(projected, field_path.split('.'), copy.deepcopy(value))
+    return projected
+
+
+def _set_path(target, parts, value):
+    for part in parts[:-1]:
+        if not isinstance(target.get(part), dict):
+            target[part] = {}
+        target = target[part]
+    target[parts[-1]] = value
+
+
+def _apply_value(target, key, value):
+    """
+    Grava um valor num dict, resolvendo as transformações do Firestore.
+    """
+    if value is DELETE_FIELD:
+        target.pop(key, None)
+    elif value is SERVER_TIMESTAMP:
+        target[key] = _now()
+    elif isinstance(value, Increment):
+        current = target.get(key)
+        target[key] = (current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0) + value.value
+    elif isinstance(value, ArrayUnion):
+        current = list(target.get(key) or []) if isinstance(target.get(key), list) else []
+        target[key] = current + [item for item in value.values if item not in current]
+    elif isinstance(value, ArrayRemove):
+        current = target.get(key) if isinstance(target.get(key), list) else []
+        target[key] = [item for item in current if item not in value.values]
+    else:
+        target[key] = _resolve(value)
+
+
+def _resolve(value):
+    """
+    Copia um valor, resolvendo transformações aninhadas num documento novo.
+    """
+    if isinstance(value, dict):
+        resolved = {}
+        for key, item in value.items():
+            _apply_value(resolved, key, item)
+        return resolved
+    if isinstance(value, list):
+        return [_resolve(item) for item in value]
+    return copy.deepcopy(value)
+
+
+def _merge(target, changes):
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            _apply_value(target, key, value)
+
+
+def apply_write(current, op, data=None, merge=False):
+    """
+    Resultado de uma escrita sobre o documento atual (None se não existe).
+    Devolve o novo documento, ou None quando a escrita o remove.
+    """
+    if op == 'delete':
+        return None
+    if op == 'update':
+        # Em update, as chaves são caminhos de campo ('a.b' altera o mapa 'a')
+        document = copy.deepcopy(current)
+        for field_path, value in data.items():
+            parts = field_path.split('.')
+            parent = document
+            for part in parts[:-1]:
+                if not isinstance(parent.get(part), dict):
+                    parent[part] = {}
+                parent = parent[part]
+            _apply_value(parent, parts[-1], value)
+        return document
+    if op == 'set' and merge:
+        document = copy.deepcopy(current) if current is not None else {}
+        _merge(document, data)
+        return document
+    return _resolve(data)
+
+
+class MemoryWriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class MemorySnapshot:
+    def __init__(self, reference, data, field_paths=None, read_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = _project(data, field_paths) if data is not None else None
+        self.read_time = read_time
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        value = _get_field(self._data or {}, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class MemoryDocument:
+    def __init__(self, client, collection_path, doc_id):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = doc_id
+        self.path = f'{collection_path}/{doc_id}'
+
+    def __eq__(self, other):
+        return isinstance(other, MemoryDocument) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    @property
+    def parent(self):
+        return MemoryCollection(self._client, self._collection_path)
+
+    def collection(self, name):
+        return MemoryCollection(self._client, f'{self.path}/{name}')
+
+    def get(self, field_paths=None, transaction=None):
+        client = self._client
+        with client._lock:
+            client.rpc_count += 1
+            client.docs_read += 1
+            if transaction is not None:
+                transaction._record_read(self)
+            return client._snapshot(self, field_paths)
+
+    def create(self, document_data):
+        return self._client._commit([('create', self, document_data, False)])[0]
+
+    def set(self, document_data, merge=False):
+        return self._client._commit([('set', self, document_data, merge)])[0]
+
+    def update(self, field_updates):
+        return self._client._commit([('update', self, field_updates, False)])[0]
+
+    def delete(self):
+        return self._client._commit([('delete', self, None, False)])[0].update_time
+
+
+class MemoryAggregationQuery:
+    def __init__(self, query, op, field_path, alias):
+        self._query = query
+        self._op = op
+        self._field_path = field_path
+        self._alias = alias or 'field_1'
+
+    def get(self, transaction=None, **kwargs):
+        client = self._query._client
+        with client._lock:
+            docs = self._query._results()
+            client.rpc_count += 1
+            client.docs_read += max(1, math.ceil(len(docs) / AGGREGATION_READS_PER_ENTRY))
+
+            if self._op == 'count':
+                value = len(docs)
+            else:
+                numbers = [
+                    value for value in (_get_field(data, self._field_path) for _, data in docs)
+                    if isinstance(value, (int, float)) and not isinstance(value, bool)
+                ]
+                if self._op == 'sum':
+                    value = sum(numbers)
+                else:
+                    value = sum(numbers) / len(numbers) if numbers else None
+        return [[AggregationResult(alias=self._alias, value=value, read_time=_now())]]
+
+
+class MemoryQuery:
+    def __init__(self, client, path, filters=(), orders=(), limit=None, offset=0,
+                 cursor=None, projection=None):
+        self._client = client
+        self._path = path
+        self._filters = filters
+        self._orders = orders
+        self._limit = limit
+        self._offset = offset
+        self._cursor = cursor
+        self._projection = projection
+
+    def _copy(self, **changes):
+        state = {
+            'filters': self._filters, 'orders': self._orders, 'limit': self._limit,
+            'offset': self._offset, 'cursor': self._cursor, 'projection': self._projection,
+        }
+        state.update(changes)
+        return MemoryQuery(self._client, self._path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=Query.ASCENDING):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def offset(self, num_to_skip):
+        return self._copy(offset=num_to_skip)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def select(self, field_paths):
+        return self._copy(projection=list(field_paths))
+
+    def count(self, alias=None):
+        return MemoryAggregationQuery(self, 'count', None, alias)
+
+    def sum(self, field_ref, alias=None):
+        return MemoryAggregationQuery(self, 'sum', field_ref, alias)
+
+    def avg(self, field_ref, alias=None):
+        return MemoryAggregationQuery(self, 'avg', field_ref, alias)
+
+    def stream(self, transaction=None, **kwargs):
+        client = self._client
+        with client._lock:
+            docs = self._results()
+            client.rpc_count += 1
+            client.docs_read += max(1, len(docs))
+            snapshots = [
+                MemorySnapshot(MemoryDocument(client, self._path, doc_id), data, self._projection)
+                for doc_id, data in docs
+            ]
+            if transaction is not None:
+                for snapshot in snapshots:
+                    transaction._record_read(snapshot.reference)
+        return iter(snapshots)
+
+    def get(self, transaction=None, **kwargs):
+        return list(self.stream(transaction=transaction))
+
+    # Execução
+
+    def _order_fields(self):
+        orders = list(self._orders)
+        if not any(field == '__name__' for field, _ in orders):
+            # Desempate implícito pelo ID, na direção da última ordenação
+            direction = orders[-1][1] if orders else Query.ASCENDING
+            orders.append(('__name__', direction))
+        return orders
+
+    def _matches(self, doc_id, data):
+        for field_path, op, expected in self._filters:
+            value = _get_field(data, field_path, doc_id)
+            if value is _MISSING:
+                return False
+            if not _FILTER_OPERATORS[op](value, expected):
+                return False
+        return True
+
+    def _results(self):
+        docs = [
+            (doc_id, data) for doc_id, data in self._client.data.get(self._path, {}).items()
+            if self._matches(doc_id, data)
+        ]
+        orders = self._order_fields()
+        # Documentos sem o campo ordenado ficam de fora, como no Firestore
+        docs = [
+            (doc_id, data) for doc_id, data in docs
+            if all(_get_field(data, field, doc_id) is not _MISSING for field, _ in orders)
+        ]
+
+        def compare(a, b):
+            for field, direction in orders:
+                result = _compare_values(_get_field(a[1], field, a[0]), _get_field(b[1], field, b[0]))
+                if result:
+                    return -result if direction == Query.DESCENDING else result
+            return 0
+
+        docs.sort(key=cmp_to_key(compare))
+
+        if self._cursor is not None:
+            cursor = self._cursor_row(orders)
+            docs = [doc for doc in docs if compare(doc, cursor) > 0]
+
+        docs = docs[self._offset:]
+        if self._limit is not None:
+            docs = docs[:self._limit]
+        return docs
+
+    def _cursor_row(self, orders):
+        cursor = self._cursor
+        if isinstance(cursor, MemorySnapshot):
+            return cursor.id, cursor.to_dict() or {}
+        # Dict com os valores dos campos ordenados ('__name__' é o ID)
+        doc_id = cursor.get('__name__')
+        if isinstance(doc_id, MemoryDocument):
+            doc_id = doc_id.id
+        data = {}
+        for field, _ in orders:
+            if field != '__name__' and field in cursor:
+                _set_path(data, field.split('.'), cursor[field])
+        return doc_id, data
+
+
+def _array_contains_any(value, expected):
+    return isinstance(value, list) and any(item in value for item in expected)
+
+
+_FILTER_OPERATORS = {
+    '==': lambda value, expected: _compare_values(value, expected) == 0,
+    '!=': lambda value, expected: _compare_values(value, expected) != 0,
+    '<': lambda value, expected: _type_rank(value) == _type_rank(expected) and _compare_values(value, expected) < 0,
+    '<=': lambda value, expected: _type_rank(value) == _type_rank(expected) and _compare_values(value, expected) <= 0,
+    '>': lambda value, expected: _type_rank(value) == _type_rank(expected) and _compare_values(value, expected) > 0,
+    '>=': lambda value, expected: _type_rank(value) == _type_rank(expected) and _compare_values(value, expected) >= 0,
+    'in': lambda value, expected: value in expected,
+    'not-in': lambda value, expected: value not in expected,
+    'array_contains': lambda value, expected: isinstance(value, list) and expected in value,
+    'array_contains_any': _array_contains_any,
+}
+
+
+class MemoryCollection(MemoryQuery):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def document(self, document_id=None):
+        return MemoryDocument(self._client, self.path, document_id or uuid.uuid4().hex[:20])
+
+    def add(self, document_data, document_id=None):
+        reference = self.document(document_id)
+        result = reference.create(document_data)
+        return result.update_time, reference
+
+    def list_documents(self):
+        return [self.document(doc_id) for doc_id in list(self._client.data.get(self.path, {}))]
+
+
+class MemoryWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def create(self, reference, document_data):
+        self._writes.append(('create', reference, document_data, False))
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set', reference, document_data, merge))
+
+    def update(self, reference, field_updates, option=None):
+        self._writes.append(('update', reference, field_updates, False))
+
+    def delete(self, reference, option=None):
+        self._writes.append(('delete', reference, None, False))
+
+    def commit(self, **kwargs):
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes)
+
+    def __len__(self):
+        return len(self._writes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+
+class MemoryTransaction(MemoryWriteBatch):
+    """
+    Transação otimista: no commit, se algum documento lido mudou entretanto,
+    levanta Aborted e o @firestore.transactional repete a função.
+    """
+
+    def __init__(self, client, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._reads = {}
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _record_read(self, reference):
+        self._reads.setdefault(reference.path, self._client._versions.get(reference.path, 0))
+
+    def _clean_up(self):
+        self._writes = []
+        self._reads = {}
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._client.rpc_count += 1
+        self._id = uuid.uuid4().bytes
+
+    def _commit(self):
+        writes, self._writes = self._writes, []
+        reads = self._reads
+        try:
+            return self._client._commit(writes, reads)
+        finally:
+            self._clean_up()
+
+    def _rollback(self):
+        if self._id is not None:
+            self._client.rpc_count += 1
+        self._clean_up()
+
+    def get(self, ref_or_query, **kwargs):
+        if isinstance(ref_or_query, MemoryDocument):
+            return iter([ref_or_query.get(transaction=self)])
+        return ref_or_query.stream(transaction=self)
+
+    def get_all(self, references, **kwargs):
+        return self._client.get_all(references, transaction=self, **kwargs)
+
+
+class MemoryBulkWriter:
+    """
+    BulkWriter: cada escrita é independente; falhas passam pelo on_write_error,
+    que decide se a escrita é repetida.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._operations = []
+        self._on_error = lambda failure, writer: failure.attempts < 10
+        self._on_result = None
+
+    def on_write_error(self, callback):
+        self._on_error = callback
+
+    def on_write_result(self, callback):
+        self._on_result = callback
+
+    def create(self, reference, document_data, attempts=0):
+        self._operations.append(BulkWriterCreateOperation(reference, document_data, attempts))
+
+    def set(self, reference, document_data, merge=False, attempts=0):
+        self._operations.append(BulkWriterSetOperation(reference, document_data, merge, attempts))
+
+    def update(self, reference, field_updates, option=None, attempts=0):
+        self._operations.append(BulkWriterUpdateOperation(reference, field_updates, option, attempts))
+
+    def delete(self, reference, option=None, attempts=0):
+        self._operations.append(BulkWriterDeleteOperation(reference, option, attempts))
+
+    def flush(self):
+        operations, self._operations = self._operations, []
+        self._client.rpc_count += math.ceil(len(operations) / BULK_WRITER_BATCH_SIZE)
+
+        for operation in operations:
+            while True:
+                try:
+                    result = self._client._commit([_bulk_write(operation)], count_rpc=False)[0]
+                except (AlreadyExists, NotFound) as e:
+                    operation.attempts += 1
+                    failure = BulkWriteFailure(operation, e.grpc_status_code.value[0], e.message)
+                    if self._on_error(failure, self):
+                        continue
+                    break
+                if self._on_result is not None:
+                    self._on_result(operation.reference, result, self)
+                break
+
+    def close(self):
+        self.flush()
+
+
+def _bulk_write(operation):
+    if isinstance(operation, BulkWriterCreateOperation):
+        return ('create', operation.reference, operation.document_data, False)
+    if isinstance(operation, BulkWriterSetOperation):
+        return ('set', operation.reference, operation.document_data, operation.merge)
+    if isinstance(operation, BulkWriterUpdateOperation):
+        return ('update', operation.reference, operation.field_updates, False)
+    return ('delete', operation.reference, None, False)
+
+
+class MemoryFirestore:
+    """
+    Cliente Firestore em memória com a mesma interface usada pelo código.
+    """
+
+    def __init__(self, data=None):
+        self.data = data if data is not None else {}
+        self._versions = {}
+        self._lock = threading.RLock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.rpc_count = 0
+        self.docs_read = 0
+        self.docs_written = 0
+        self.field_masks = []
+
+    def stats(self):
+        return {'rpcs': self.rpc_count, 'docs_read': self.docs_read, 'docs_written': self.docs_written}
+
+    def collection(self, *path):
+        return MemoryCollection(self, '/'.join(path))
+
+    def document(self, *path):
+        collection_path, doc_id = '/'.join(path).rsplit('/', 1)
+        return MemoryDocument(self, collection_path, doc_id)
+
+    def collections(self):
+        roots = {path.split('/', 1)[0] for path in self.data}
+        return [MemoryCollection(self, root) for root in sorted(roots)]
+
+    def batch(self):
+        return MemoryWriteBatch(self)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return MemoryTransaction(self, max_attempts=max_attempts, read_only=read_only)
+
+    def bulk_writer(self, options=None):
+        return MemoryBulkWriter(self)
+
+    def get_all(self, references, field_paths=None, transaction=None, **kwargs):
+        with self._lock:
+            references = list(references)
+            self.rpc_count += 1
+            self.docs_read += len(references)
+            self.field_masks.append(field_paths)
+            snapshots = []
+            for reference in references:
+                if transaction is not None:
+                    transaction._record_read(reference)
+                snapshots.append(self._snapshot(reference, field_paths))
+        return iter(snapshots)
+
+    def _snapshot(self, reference, field_paths=None):
+        data = self.data.get(reference._collection_path, {}).get(reference.id)
+        return MemorySnapshot(reference, data, field_paths, read_time=_now())
+
+    def _commit(self, writes, reads=None, count_rpc=True):
+        """
+        Aplica as escritas de forma atómica (todas ou nenhuma).
+        """
+        with self._lock:
+            if count_rpc:
+                self.rpc_count += 1
+
+            for path, version in (reads or {}).items():
+                if self._versions.get(path, 0) != version:
+                    raise Aborted('Documento alterado durante a transação.')
+
+            staged = {}
+            for op, reference, data, merge in writes:
+                key = (reference._collection_path, reference.id)
+                current = staged[key] if key in staged else self.data.get(key[0], {}).get(key[1])
+                if op == 'create' and current is not None:
+                    raise AlreadyExists(f'Document already exists: {reference.path}')
+                if op == 'update' and current is None:
+                    raise NotFound(f'No document to update: {reference.path}')
+                staged[key] = apply_write(current, op, data, merge)
+
+            update_time = _now()
+            for (collection_path, doc_id), document in staged.items():
+                docs = self.data.setdefault(collection_path, {})
+                if document is None:
+                    docs.pop(doc_id, None)
+                else:
+                    docs[doc_id] = document
+                path = f'{collection_path}/{doc_id}'
+                self._versions[path] = self._versions.get(path, 0) + 1
+
+            self.docs_written += len(writes)
+            return [MemoryWriteResult(update_time) for _ in writes]
+
+
+class AsyncMemoryFirestore:
+    """
+    Adapta o MemoryFirestore à interface do AsyncClient
+    (get, stream e get_all assíncronos) para reports.firebase_async.
+    """
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name in ('stream', 'get_all'):
+            async def iterate(*args, **kwargs):
+                for item in attr(*args, **kwargs):
+                    yield item
+            return iterate
+        if name == 'get':
+            async def get(*args, **kwargs):
+                return attr(*args, **kwargs)
+            return get
+        if callable(attr):
+            return lambda *args, **kwargs: _wrap(attr(*args, **kwargs))
+        return attr
+
+
+def _wrap(value):
+    if isinstance(value, (MemoryFirestore, MemoryQuery, MemoryDocument, MemoryAggregationQuery)):
+        return AsyncMemoryFirestore(value)
+    return value
@@ -0,0 +1,398 @@
+"""
+Métricas por pedido: RPCs ao Firestore, documentos lidos e escritos, queries
+SQL e tempo de serialização. O RequestMetricsMiddleware (reports.middleware)
+abre um RequestMetrics por pedido num ContextVar; o InstrumentedFirestore
+(o 'db' de reports.firebase) e o execute_wrapper das ligações SQL somam nele.
+Fora de um pedido (comandos, workers) nada é registado.
+
+Os histogramas por endpoint ficam em memória, por processo, e são expostos
+em formato Prometheus em /api/metrics/ (só administradores).
+"""
+import bisect
+import functools
+import math
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+# Escritas enviadas por RPC pelo BulkWriter do SDK
+BULK_WRITER_BATCH_SIZE = 20
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_current = ContextVar('request_metrics', default=None)
+
+
+def metrics_enabled():
+    return getattr(settings, 'REQUEST_METRICS_ENABLED', True)
+
+
+class RequestMetrics:
+    """
+    Contadores de um pedido. As secções do dashboard correm noutras threads
+    (com o contexto copiado), por isso as somas passam por um lock.
+    """
+
+    FIELDS = (
+        'firestore_rpcs', 'firestore_seconds', 'docs_read', 'docs_written',
+        'sql_queries', 'sql_seconds', 'serialization_seconds',
+    )
+
+    def __init__(self):
+        self._lock = Lock()
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def add(self, **values):
+        with self._lock:
+            for field, value in values.items():
+                setattr(self, field, getattr(self, field) + value)
+
+    def server_timing(self, total_seconds):
+        """
+        Valor do cabeçalho Server-Timing (durações em milissegundos).
+        """
+        return ', '.join((
+            f'firestore;dur={self.firestore_seconds * 1000:.1f};'
+            f'desc="{self.firestore_rpcs} rpcs, {self.docs_read} read, {self.docs_written} written"',
+            f'db;dur={self.sql_seconds * 1000:.1f};desc="{self.sql_queries} queries"',
+            f'serialize;dur={self.serialization_seconds * 1000:.1f}',
+            f'total;dur={total_seconds * 1000:.1f}',
+        ))
+
+
+def current():
+    return _current.get()
+
+
+def start_request():
+    """
+    Abre as métricas de um pedido; devolve (métricas, token para end_request).
+    """
+    request_metrics = RequestMetrics()
+    return request_metrics, _current.set(request_metrics)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def record(**values):
+    request_metrics = _current.get()
+    if request_metrics is not None:
+        request_metrics.add(**values)
+
+
+# 🔥 SQL: execute_wrapper em todas as ligações (incluindo as das threads)
+
+def _sql_wrapper(execute, sql, params, many, context):
+    request_metrics = _current.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    inicio = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.add(sql_queries=1, sql_seconds=perf_counter() - inicio)
+
+
+def _install_sql_wrapper(sender, connection, **kwargs):
+    if _sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_sql_wrapper)
+
+
+connection_created.connect(_install_sql_wrapper, dispatch_uid='reports.metrics.sql')
+
+
+# 🔥 FIRESTORE: proxy que conta RPCs e documentos
+
+# Métodos que devolvem outra referência, query ou escritor (sem RPC)
+_CHAIN_METHODS = frozenset((
+    'collection', 'document', 'where', 'order_by', 'limit', 'limit_to_last', 'offset',
+    'start_at', 'start_after', 'end_at', 'end_before', 'select', 'count', 'sum', 'avg',
+))
+_WRITERS = {'batch': 'batch', 'transaction': 'batch', 'bulk_writer': 'bulk'}
+_WRITE_METHODS = frozenset(('set', 'update', 'create', 'delete'))
+
+
+def _unwrap(value):
+    if isinstance(value, (InstrumentedFirestore, InstrumentedAsyncFirestore)):
+        return value._target
+    if isinstance(value, list):
+        return [_unwrap(item) for item in value]
+    return value
+
+
+def _call(method, args, kwargs):
+    return method(*[_unwrap(arg) for arg in args], **{key: _unwrap(value) for key, value in kwargs.items()})
+
+
+def _timed_call(method, args, kwargs, rpcs=1, read=None, written=0):
+    """
+    Chama um método que faz um RPC. 'read' calcula os documentos lidos a partir do resultado.
+    """
+    request_metrics = _current.get()
+    if request_metrics is None:
+        return _call(method, args, kwargs)
+    inicio = perf_counter()
+    try:
+        result = _call(method, args, kwargs)
+    finally:
+        elapsed = perf_counter() - inicio
+    docs_read = read(result) if read is not None else 0
+    request_metrics.add(
+        firestore_rpcs=rpcs, firestore_seconds=elapsed, docs_read=docs_read,
+        docs_written=written(result) if callable(written) else written,
+    )
+    return result
+
+
+def _timed_stream(iterator, minimum_reads):
+    """
+    Percorre o iterador de um stream/get_all somando o tempo de cada leitura.
+    Uma query vazia conta uma leitura (como na faturação do Firestore).
+    """
+    request_metrics = _current.get()
+    if request_metrics is None:
+        yield from iterator
+        return
+    elapsed = 0.0
+    total = 0
+    try:
+        while True:
+            inicio = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed += perf_counter() - inicio
+            total += 1
+            yield item
+    finally:
+        request_metrics.add(firestore_rpcs=1, firestore_seconds=elapsed, docs_read=max(minimum_reads, total))
+
+
+def _reads_of_get(result):
+    if isinstance(result, list):
+        return max(1, len(result))
+    return 1
+
+
+class InstrumentedFirestore:
+    """
+    Envolve o cliente Firestore (e as referências, queries e escritores que ele
+    cria) contando RPCs, tempo e documentos no RequestMetrics do pedido atual.
+    Os argumentos são desembrulhados antes de chegar à biblioteca.
+    """
+    __slots__ = ('_target', '_kind', '_queued')
+
+    def __init__(self, target, kind='ref'):
+        self._target = target
+        self._kind = kind
+        self._queued = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            if name == 'parent':
+                return InstrumentedFirestore(attr)
+            return attr
+
+        if name in _CHAIN_METHODS:
+            return lambda *args, **kwargs: InstrumentedFirestore(_call(attr, args, kwargs))
+        if name in _WRITERS:
+            return lambda *args, **kwargs: InstrumentedFirestore(_call(attr, args, kwargs), _WRITERS[name])
+
+        if self._kind == 'ref':
+            if name == 'stream':
+                return lambda *args, **kwargs: _timed_stream(iter(_call(attr, args, kwargs)), 1)
+            if name == 'get_all':
+                return lambda *args, **kwargs: _timed_stream(iter(_call(attr, args, kwargs)), 0)
+            if name == 'get':
+                return lambda *args, **kwargs: _timed_call(attr, args, kwargs, read=_reads_of_get)
+            if name in _WRITE_METHODS or name == 'add':
+                return lambda *args, **kwargs: _timed_call(attr, args, kwargs, written=1)
+            if name == 'list_documents':
+                return lambda *args, **kwargs: _timed_call(attr, args, kwargs, read=len)
+        elif self._kind == 'batch':
+            if name in ('commit', '_commit'):
+                return lambda *args, **kwargs: _timed_call(attr, args, kwargs, written=len)
+            if name in ('_begin', '_rollback'):
+                return lambda *args, **kwargs: _timed_call(attr, args, kwargs)
+        elif self._kind == 'bulk':
+            if name in _WRITE_METHODS:
+                return functools.partial(self._queue, attr)
+            if name in ('flush', 'close'):
+                return functools.partial(self._flush, attr)
+
+        return lambda *args, **kwargs: _call(attr, args, kwargs)
+
+    def _queue(self, method, *args, **kwargs):
+        self._queued += 1
+        return _call(method, args, kwargs)
+
+    def _flush(self, method, *args, **kwargs):
+        queued, self._queued = self._queued, 0
+        return _timed_call(
+            method, args, kwargs,
+            rpcs=math.ceil(queued / BULK_WRITER_BATCH_SIZE), written=queued,
+        )
+
+    def __repr__(self):
+        return f'<InstrumentedFirestore {self._target!r}>'
+
+
+# 🔥 FIRESTORE ASSÍNCRONO (reports.firebase_async)
+
+async def _timed_async_call(method, args, kwargs, rpcs=1, read=None, written=0):
+    request_metrics = _current.get()
+    if request_metrics is None:
+        return await _call(method, args, kwargs)
+    inicio = perf_counter()
+    try:
+        result = await _call(method, args, kwargs)
+    finally:
+        elapsed = perf_counter() - inicio
+    request_metrics.add(
+        firestore_rpcs=rpcs, firestore_seconds=elapsed,
+        docs_read=read(result) if read is not None else 0, docs_written=written,
+    )
+    return result
+
+
+async def _timed_async_stream(iterator, minimum_reads):
+    request_metrics = _current.get()
+    if request_metrics is None:
+        async for item in iterator:
+            yield item
+        return
+    elapsed = 0.0
+    total = 0
+    try:
+        while True:
+            inicio = perf_counter()
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                elapsed += perf_counter() - inicio
+            total += 1
+            yield item
+    finally:
+        request_metrics.add(firestore_rpcs=1, firestore_seconds=elapsed, docs_read=max(minimum_reads, total))
+
+
+class InstrumentedAsyncFirestore:
+    """
+    O mesmo que o InstrumentedFirestore para o firestore.AsyncClient (ou o
+    AsyncMemoryFirestore): get é uma corrotina, stream e get_all iteradores
+    assíncronos. As secções em asyncio.gather partilham o RequestMetrics.
+    """
+    __slots__ = ('_target',)
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            if name == 'parent':
+                return InstrumentedAsyncFirestore(attr)
+            return attr
+
+        if name in _CHAIN_METHODS:
+            return lambda *args, **kwargs: InstrumentedAsyncFirestore(_call(attr, args, kwargs))
+        if name == 'stream':
+            return lambda *args, **kwargs: _timed_async_stream(_call(attr, args, kwargs).__aiter__(), 1)
+        if name == 'get_all':
+            return lambda *args, **kwargs: _timed_async_stream(_call(attr, args, kwargs).__aiter__(), 0)
+        if name == 'get':
+            return lambda *args, **kwargs: _timed_async_call(attr, args, kwargs, read=_reads_of_get)
+        if name in _WRITE_METHODS or name == 'add':
+            return lambda *args, **kwargs: _timed_async_call(attr, args, kwargs, written=1)
+        return lambda *args, **kwargs: _call(attr, args, kwargs)
+
+    def __repr__(self):
+        return f'<InstrumentedAsyncFirestore {self._target!r}>'
+
+
+# 🔥 HISTOGRAMAS POR ENDPOINT (formato Prometheus)
+
+class Histogram:
+    def __init__(self, name, documentation, buckets, labels=('endpoint', 'method')):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labels = labels
+        self._series = {}
+        self._lock = Lock()
+
+    def observe(self, label_values, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: ([*counts], total, count) for key, (counts, total, count) in self._series.items()}
+        for label_values, (counts, total, count) in sorted(series.items()):
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total:g}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+HISTOGRAMS = {
+    'total': Histogram('http_request_duration_seconds', 'Duração total do pedido.', DURATION_BUCKETS),
+    'firestore_seconds': Histogram('firestore_request_seconds', 'Tempo em RPCs ao Firestore por pedido.', DURATION_BUCKETS),
+    'firestore_rpcs': Histogram('firestore_rpcs_per_request', 'RPCs ao Firestore por pedido.', COUNT_BUCKETS),
+    'docs_read': Histogram('firestore_docs_read_per_request', 'Documentos do Firestore lidos por pedido.', COUNT_BUCKETS),
+    'docs_written': Histogram('firestore_docs_written_per_request', 'Documentos do Firestore escritos por pedido.', COUNT_BUCKETS),
+    'sql_queries': Histogram('sql_queries_per_request', 'Queries SQL por pedido.', COUNT_BUCKETS),
+    'sql_seconds': Histogram('sql_request_seconds', 'Tempo em queries SQL por pedido.', DURATION_BUCKETS),
+    'serialization_seconds': Histogram('serialization_seconds', 'Tempo a serializar a resposta.', DURATION_BUCKETS),
+}
+
+
+def observe_request(endpoint, method, total_seconds, request_metrics):
+    label_values = (endpoint, method)
+    HISTOGRAMS['total'].observe(label_values, total_seconds)
+    for field, histogram in HISTOGRAMS.items():
+        if field != 'total':
+            histogram.observe(label_values, getattr(request_metrics, field))
+
+
+def reset_histograms():
+    for histogram in HISTOGRAMS.values():
+        histogram.reset()
+
+
+def render_prometheus():
+    lines = []
+    for histogram in HISTOGRAMS.values():
+        lines.extend(histogram.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,74 @@
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import metrics
+
+
+class RequestMetricsMiddleware:
+    """
+    Mede cada pedido (Firestore, SQL e serialização, ver reports.metrics),
+    devolve os valores no cabeçalho Server-Timing e soma-os nos histogramas
+    do endpoint. Desligado com REQUEST_METRICS_ENABLED = False.
+    Síncrono e assíncrono: em ASGI as views assíncronas (/api/async/) não
+    passam por threads por causa deste middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metrics.metrics_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        request_metrics, token = metrics.start_request()
+        inicio = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self._finish(request, response, request_metrics, perf_counter() - inicio)
+
+    async def __acall__(self, request):
+        request_metrics, token = metrics.start_request()
+        inicio = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self._finish(request, response, request_metrics, perf_counter() - inicio)
+
+    def _finish(self, request, response, request_metrics, total):
+        response['Server-Timing'] = request_metrics.server_timing(total)
+        metrics.observe_request(_endpoint(request), request.method, total, request_metrics)
+        return response
+
+    def process_template_response(self, request, response):
+        # As Response do DRF são renderizadas logo a seguir a este hook
+        request_metrics = metrics.current()
+        if request_metrics is not None:
+            inicio = perf_counter()
+
+            def rendered(response):
+                request_metrics.add(serialization_seconds=perf_counter() - inicio)
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+def _endpoint(request):
+    """
+    Rota do pedido (ex: 'api/users/<str:user_id>/details/'), para não criar
+    uma série por cada ID no URL.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.route or match.view_name
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0005_transaction_created_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FirebaseUser',
+            fields=[
+                ('uid', models.CharField(max_length=128, primary_key=True, serialize=False)),
+                ('name', models.CharField(blank=True, max_length=255)),
+                ('apelido', models.CharField(blank=True, max_length=255)),
+                ('telefone', models.CharField(blank=True, db_index=True, max_length=32)),
+                ('provincia', models.CharField(blank=True, db_index=True, max_length=100)),
+                ('gender', models.CharField(blank=True, max_length=20)),
+                ('email', models.CharField(blank=True, max_length=255)),
+                ('is_pro', models.BooleanField(default=False)),
+                ('accepted_ranking', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('data', models.JSONField(default=dict)),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'firebase_users',
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0006_firebaseuser'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankingPointsDelta',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('month', models.CharField(max_length=7)),
+                ('uid', models.CharField(max_length=128)),
+                ('points', models.IntegerField()),
+                ('exam_data', models.JSONField(blank=True, null=True)),
+                ('idempotency_key', models.CharField(max_length=64, unique=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('flushed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'ranking_points_queue',
+                'indexes': [models.Index(fields=['flushed_at', 'id'], name='ranking_queue_pending_idx'), models.Index(fields=['month', 'uid'], name='ranking_queue_month_uid_idx')],
+            },
+        ),
+    ]
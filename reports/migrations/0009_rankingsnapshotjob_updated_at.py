@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0008_rankingsnapshotjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rankingsnapshotjob',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
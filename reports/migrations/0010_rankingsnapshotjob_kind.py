@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0009_rankingsnapshotjob_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rankingsnapshotjob',
+            name='kind',
+            field=models.CharField(choices=[('snapshot', 'Snapshot mensal'), ('ranking_stats', 'Contadores do ranking')], default='snapshot', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='rankingsnapshotjob',
+            name='month',
+            field=models.CharField(max_length=7),
+        ),
+        migrations.AddConstraint(
+            model_name='rankingsnapshotjob',
+            constraint=models.UniqueConstraint(fields=('kind', 'month'), name='ranking_job_kind_month_unique'),
+        ),
+    ]
@@ -0,0 +1,129 @@
+from datetime import date, datetime
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import FirebaseUser
+
+# Campos do Firestore que nunca são copiados para o espelho
+MIRROR_EXCLUDED_FIELDS = ('password',)
+
+MIRROR_BATCH_SIZE = 500
+
+MIRROR_UPDATE_FIELDS = [
+    'name', 'apelido', 'telefone', 'provincia', 'gender', 'email',
+    'is_pro', 'accepted_ranking', 'created_at', 'updated_at', 'data', 'synced_at',
+]
+
+
+def mirror_enabled():
+    """
+    True quando as leituras de usuários devem usar a tabela local em vez do Firestore.
+    """
+    return getattr(settings, 'FIREBASE_USERS_READ_SOURCE', 'firestore') == 'mirror'
+
+
+def _json_safe(value):
+    """
+    Converte valores do Firestore (Timestamp, GeoPoint, referências...) em JSON.
+    """
+    if isinstance(value, dict):
+        return {str(k): _json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(v) for v in value]
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def _parse_timestamp(value):
+    if isinstance(value, datetime):
+        return value if timezone.is_aware(value) else timezone.make_aware(value)
+    if isinstance(value, str) and value:
+        parsed = parse_datetime(value)
+        if parsed and timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+    return None
+
+
+def build_mirror_row(uid, data):
+    """
+    Monta a linha FirebaseUser para um documento do Firestore.
+    """
+    data = {k: v for k, v in (data or {}).items() if k not in MIRROR_EXCLUDED_FIELDS}
+    return FirebaseUser(
+        uid=uid,
+        name=str(data.get('name') or '')[:255],
+        apelido=str(data.get('apelido') or '')[:255],
+        telefone=str(data.get('telefone') or '')[:32],
+        provincia=str(data.get('provincia') or '')[:100],
+        gender=str(data.get('gender') or '')[:20],
+        email=str(data.get('email') or '')[:255],
+        is_pro=bool(data.get('isPro', False)),
+        accepted_ranking=bool(data.get('acceptedRanking', False)),
+        created_at=_parse_timestamp(data.get('createdAt')),
+        updated_at=_parse_timestamp(data.get('updatedAt')),
+        data=_json_safe(data),
+        synced_at=timezone.now(),
+    )
+
+
+def upsert_users(documents):
+    """
+    Insere ou atualiza no espelho uma lista de (uid, dados) em blocos.
+    """
+    rows = [build_mirror_row(uid, data) for uid, data in documents]
+    unique_fields = ['uid'] if connection.features.supports_update_conflicts_with_target else None
+
+    for inicio in range(0, len(rows), MIRROR_BATCH_SIZE):
+        FirebaseUser.objects.bulk_create(
+            rows[inicio:inicio + MIRROR_BATCH_SIZE],
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=MIRROR_UPDATE_FIELDS,
+        )
+    return len(rows)
+
+
+def delete_users(uids):
+    uids = list(uids)
+    if not uids:
+        return 0
+    deleted, _ = FirebaseUser.objects.filter(uid__in=uids).delete()
+    return deleted
+
+
+def _to_user_dict(row):
+    return { 'id': row.uid, **row.data }
+
+
+def iter_mirror_users():
+    for row in FirebaseUser.objects.order_by('uid').iterator(chunk_size=MIRROR_BATCH_SIZE):
+        yield _to_user_dict(row)
+
+
+def get_mirror_users_page(page_size, start_after=None):
+    rows = FirebaseUser.objects.order_by('uid')
+    if start_after:
+        rows = rows.filter(uid__gt=start_after)
+    return [_to_user_dict(row) for row in rows[:page_size]]
+
+
+def get_mirror_users_by_telefone(telefone):
+    rows = FirebaseUser.objects.filter(telefone=telefone).order_by('uid')
+    return [_to_user_dict(row) for row in rows]
+
+
+def get_mirror_users_by_ids(user_ids, field_paths=None):
+    users = {}
+    for row in FirebaseUser.objects.filter(uid__in=list(user_ids)):
+        user_data = _to_user_dict(row)
+        if field_paths is not None:
+            user_data = {k: v for k, v in user_data.items() if k in field_paths or k == 'id'}
+        users[row.uid] = user_data
+    return users
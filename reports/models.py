@@ -26,6 +26,10 @@ class Transaction(models.Model):
 
     class Meta:
         db_table = 'transactions'  # garante o mesmo nome de tabela
+        indexes = [
+            # Paginação por cursor em (created_at, id)
+            models.Index(fields=['created_at', 'id'], name='transactions_created_id_idx'),
+        ]
 
     def __str__(self):
         return f"Transaction {self.id} - {self.status} - {self.amount}"
@@ -44,4 +48,112 @@ class Video(models.Model):
         return self.title
 
     class Meta:
-        db_table = 'videos'
\ No newline at end of file
+        db_table = 'videos'
+
+
+class FirebaseUser(models.Model):
+    """
+    Espelho local da coleção 'users' do Firestore.
+    Preenchido pelo comando sync_firebase_users e mantido atualizado pelo
+    listener listen_firebase_users (on_snapshot).
+    """
+    uid = models.CharField(max_length=128, primary_key=True)
+    name = models.CharField(max_length=255, blank=True)
+    apelido = models.CharField(max_length=255, blank=True)
+    telefone = models.CharField(max_length=32, blank=True, db_index=True)
+    provincia = models.CharField(max_length=100, blank=True, db_index=True)
+    gender = models.CharField(max_length=20, blank=True)
+    email = models.CharField(max_length=255, blank=True)
+    is_pro = models.BooleanField(default=False)
+    accepted_ranking = models.BooleanField(default=False)
+    created_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(null=True, blank=True)
+
+    # Documento completo (sem a senha), devolvido tal como viria do Firestore
+    data = models.JSONField(default=dict)
+
+    synced_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.uid} - {self.telefone}"
+
+    class Meta:
+        db_table = 'firebase_users'
+
+
+class RankingPointsDelta(models.Model):
+    """
+    Incremento de pontos do ranking aceite mas ainda não gravado no Firestore
+    (modo write-behind). O comando flush_ranking_queue soma as linhas de cada
+    (mês, uid) e aplica-as numa única transação.
+    """
+    id = models.BigAutoField(primary_key=True)
+    month = models.CharField(max_length=7)
+    uid = models.CharField(max_length=128)
+    points = models.IntegerField()
+    exam_data = models.JSONField(null=True, blank=True)
+
+    # Chave enviada pelo cliente (ou gerada) para ignorar pedidos repetidos
+    idempotency_key = models.CharField(max_length=64, unique=True)
+
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    flushed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.month} {self.uid} +{self.points}"
+
+    class Meta:
+        db_table = 'ranking_points_queue'
+        indexes = [
+            # Linhas pendentes em ordem de chegada
+            models.Index(fields=['flushed_at', 'id'], name='ranking_queue_pending_idx'),
+            models.Index(fields=['month', 'uid'], name='ranking_queue_month_uid_idx'),
+        ]
+
+
+class RankingSnapshotJob(models.Model):
+    """
+    Estado de um job do ranking executado em segundo plano (um por tipo e mês):
+    o snapshot mensal (POST ranking/snapshot/) e a reconstrução dos contadores
+    de ranking_stats/<mês> (agendada pela primeira leitura sem rebuiltAt).
+    """
+    KIND_SNAPSHOT = 'snapshot'
+    KIND_RANKING_STATS = 'ranking_stats'
+    KIND_CHOICES = [
+        (KIND_SNAPSHOT, 'Snapshot mensal'),
+        (KIND_RANKING_STATS, 'Contadores do ranking'),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pendente'),
+        (STATUS_RUNNING, 'Em execução'),
+        (STATUS_DONE, 'Concluído'),
+        (STATUS_FAILED, 'Falhou'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=KIND_SNAPSHOT)
+    month = models.CharField(max_length=7)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    total_users = models.PositiveIntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Última mudança de estado; um job pendente ou em execução sem mudanças
+    # há mais de RANKING_SNAPSHOT_STALE_AFTER é considerado abandonado
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.month} - {self.status}"
+
+    class Meta:
+        db_table = 'ranking_snapshot_jobs'
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'month'], name='ranking_job_kind_month_unique'),
+        ]
@@ -0,0 +1,43 @@
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(position):
+    """
+    Codifica a posição de um cursor (dict) num token opaco e seguro para URLs.
+    """
+    raw = json.dumps(position, separators=(',', ':'), sort_keys=True).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Decodifica um token gerado por encode_cursor. Lança ValueError se for inválido.
+    """
+    padding = '=' * (-len(token) % 4)
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token + padding))
+    except (ValueError, TypeError):
+        raise ValueError('Cursor inválido.')
+
+    if not isinstance(position, dict):
+        raise ValueError('Cursor inválido.')
+    return position
+
+
+def parse_page_size(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """
+    Converte o parâmetro 'page_size' da query string, limitado a [1, maximum].
+    """
+    if value in (None, ''):
+        return default
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('Parâmetro "page_size" deve ser um número inteiro.')
+    if page_size < 1:
+        raise ValueError('Parâmetro "page_size" deve ser maior que zero.')
+    return min(page_size, maximum)
@@ -0,0 +1,93 @@
+import uuid
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import RankingPointsDelta
+
+RANKING_QUEUE_BATCH_SIZE = 500
+
+# Linhas mais recentes do que isto esperam pelo próximo flush, o que junta
+# rajadas do mesmo usuário e evita saltar IDs de transações ainda por confirmar
+RANKING_QUEUE_FLUSH_DELAY = getattr(settings, 'RANKING_QUEUE_FLUSH_DELAY', 2)
+
+
+def write_behind_enabled():
+    """
+    True quando add_ranking_points deve enfileirar os pontos em vez de gravar no Firestore.
+    """
+    return getattr(settings, 'RANKING_WRITE_BEHIND', False)
+
+
+def enqueue_points(user_id, points, exam_data=None, idempotency_key=None, month=None):
+    """
+    Regista um incremento na fila local.
+    Devolve (linha, criada); um pedido repetido com a mesma chave devolve a linha original.
+    """
+    month = month or datetime.now().strftime('%Y-%m')
+    return RankingPointsDelta.objects.get_or_create(
+        idempotency_key=idempotency_key or uuid.uuid4().hex,
+        defaults={
+            'month': month,
+            'uid': user_id,
+            'points': points,
+            'exam_data': exam_data or None,
+        }
+    )
+
+
+def _pending():
+    return RankingPointsDelta.objects.filter(flushed_at__isnull=True)
+
+
+def pending_totals(month, uids=None):
+    """
+    Pontos e exames ainda por gravar, somados por usuário: {uid: {'points', 'exams'}}.
+    """
+    rows = _pending().filter(month=month)
+    if uids is not None:
+        rows = rows.filter(uid__in=list(uids))
+    totals = rows.values('uid').annotate(total_points=Sum('points'), total_exams=Count('id'))
+    return {
+        row['uid']: {'points': row['total_points'], 'exams': row['total_exams']}
+        for row in totals
+    }
+
+
+def pending_batch(batch_size=None):
+    """
+    Próximas linhas a aplicar, por ordem de chegada.
+    """
+    limite = timezone.now() - timedelta(seconds=RANKING_QUEUE_FLUSH_DELAY)
+    rows = _pending().filter(created_at__lte=limite).order_by('id')
+    return list(rows[:batch_size or RANKING_QUEUE_BATCH_SIZE])
+
+
+def mark_flushed(rows):
+    RankingPointsDelta.objects.filter(id__in=[row.id for row in rows]).update(flushed_at=timezone.now())
+
+
+def mark_failed(rows, error, permanent=False):
+    """
+    Regista a falha. Falhas temporárias ficam na fila para o próximo flush;
+    as permanentes saem da fila com o erro guardado.
+    """
+    for row in rows:
+        row.attempts += 1
+        row.last_error = error[:1000]
+        if permanent:
+            row.flushed_at = timezone.now()
+    RankingPointsDelta.objects.bulk_update(rows, ['attempts', 'last_error', 'flushed_at'])
+
+
+def purge_flushed(older_than):
+    """
+    Apaga linhas já aplicadas há mais de 'older_than' (timedelta).
+    As chaves de idempotência deixam de proteger contra repetições depois disso.
+    """
+    deleted, _ = RankingPointsDelta.objects.filter(
+        flushed_at__lt=timezone.now() - older_than
+    ).delete()
+    return deleted
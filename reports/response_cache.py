@@ -0,0 +1,167 @@
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+RESPONSE_CACHE_ALIAS = getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')
+
+# TTL (segundos) em que a resposta é servida como fresca, por endpoint
+RESPONSE_CACHE_TTLS = getattr(settings, 'RESPONSE_CACHE_TTLS', {})
+RESPONSE_CACHE_DEFAULT_TTL = 30
+
+# Depois do TTL a resposta ainda pode ser servida durante este tempo,
+# enquanto um único pedido a recalcula (stale-while-revalidate)
+RESPONSE_CACHE_STALE_TTL = getattr(settings, 'RESPONSE_CACHE_STALE_TTL', 60)
+
+# Quanto tempo um pedido sem resposta em cache espera pelo cálculo de outro
+RESPONSE_CACHE_WAIT = 5
+RESPONSE_CACHE_POLL_INTERVAL = 0.05
+
+
+def _cache():
+    return caches[RESPONSE_CACHE_ALIAS]
+
+
+def _tag_key(tag):
+    return f'resp-tag:{tag}'
+
+
+def _tag_versions(tags):
+    """
+    Versão atual de cada tag; invalidar uma tag muda as chaves das respostas.
+    """
+    if not tags:
+        return ''
+    cache = _cache()
+    keys = [_tag_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    missing = {key: 1 for key in keys if key not in versions}
+    if missing:
+        for key in missing:
+            cache.add(key, 1, timeout=None)
+        versions.update(cache.get_many(list(missing)))
+    return '.'.join(str(versions.get(key, 1)) for key in keys)
+
+
+def data_version(*tags):
+    """
+    Contador de versão dos dados de uma ou mais tags (muda a cada invalidate_tags).
+    """
+    return _tag_versions(tags)
+
+
+def tag_version(tag):
+    """
+    Versão atual (inteira) de uma única tag.
+    """
+    return int(_tag_versions([tag]))
+
+
+def bump_tag(tag):
+    """
+    Invalida uma tag e devolve a nova versão.
+    """
+    cache = _cache()
+    key = _tag_key(tag)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Tag ainda sem versão: nada em cache depende dela
+        cache.add(key, 2, timeout=None)
+        return int(cache.get(key, 2))
+
+
+def invalidate_tags(*tags):
+    """
+    Descarta todas as respostas em cache associadas às tags indicadas.
+    """
+    for tag in tags:
+        bump_tag(tag)
+
+
+def _response_key(name, request, tags, vary=None):
+    params = sorted((key, sorted(values)) for key, values in request.GET.lists())
+    digest = hashlib.md5(repr(params).encode()).hexdigest()
+    if vary is not None:
+        name = f'{name}:{vary(request)}'
+    return f'resp:{name}:{_tag_versions(tags)}:{digest}'
+
+
+def _store(key, response, ttl, stale_ttl, cacheable=None):
+    if not isinstance(response, Response) or response.status_code != 200:
+        return
+    if cacheable is not None and not cacheable(response):
+        return
+    _cache().set(key, {
+        'data': response.data,
+        'fresh_until': time.time() + ttl,
+    }, timeout=ttl + stale_ttl)
+
+
+def _from_entry(entry, state):
+    response = Response(entry['data'])
+    response['X-Cache'] = state
+    return response
+
+
+def cached_response(name, tags=(), skip_if=None, cacheable=None, vary=None):
+    """
+    Cache da resposta de uma view GET, por parâmetros da query string.
+    - TTL em settings.RESPONSE_CACHE_TTLS[name];
+    - single-flight: em concorrência só um pedido calcula, os outros esperam;
+    - stale-while-revalidate: depois do TTL, quem obtém o lock recalcula e os
+      restantes recebem a resposta anterior;
+    - invalidate_tags(tag) descarta as respostas das views com essa tag;
+    - 'vary(request)' entra na chave (ex: o mês das views do ranking mensal).
+    Só respostas 200 (e que passem em 'cacheable', se indicado) são guardadas.
+    Usar por baixo de @api_view, para a autenticação continuar a correr antes.
+    Com o LocMemCache o single-flight vale por processo; com um cache
+    partilhado (Redis, Memcached) vale entre processos.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if skip_if is not None and skip_if(request):
+                return view(request, *args, **kwargs)
+
+            cache = _cache()
+            ttl = RESPONSE_CACHE_TTLS.get(name, RESPONSE_CACHE_DEFAULT_TTL)
+            key = _response_key(name, request, tags, vary)
+            lock_key = f'{key}:lock'
+
+            entry = cache.get(key)
+            if entry is not None and entry['fresh_until'] > time.time():
+                return _from_entry(entry, 'HIT')
+
+            owns_lock = cache.add(lock_key, 1, timeout=RESPONSE_CACHE_WAIT)
+            if not owns_lock:
+                if entry is not None:
+                    # Outro pedido já está a recalcular
+                    return _from_entry(entry, 'STALE')
+
+                # Espera pelo pedido que está a calcular
+                limite = time.monotonic() + RESPONSE_CACHE_WAIT
+                while time.monotonic() < limite:
+                    time.sleep(RESPONSE_CACHE_POLL_INTERVAL)
+                    entry = cache.get(key)
+                    if entry is not None:
+                        return _from_entry(entry, 'HIT')
+                    if cache.get(lock_key) is None:
+                        break
+
+            try:
+                response = view(request, *args, **kwargs)
+                _store(key, response, ttl, RESPONSE_CACHE_STALE_TTL, cacheable)
+            finally:
+                if owns_lock:
+                    cache.delete(lock_key)
+
+            if isinstance(response, Response):
+                response['X-Cache'] = 'MISS'
+            return response
+
+        return wrapper
+    return decorator
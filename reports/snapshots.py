@@ -0,0 +1,141 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .firebase import rebuild_ranking_stats, save_monthly_ranking_snapshot
+from .models import RankingSnapshotJob
+
+logger = logging.getLogger(__name__)
+
+# Um job de cada vez por processo
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ranking-snapshot')
+
+
+# Um job pendente ou em execução parado há mais do que isto (ex: worker
+# reiniciado a meio) pode ser reiniciado por um novo pedido
+SNAPSHOT_STALE_AFTER = timedelta(seconds=getattr(settings, 'RANKING_SNAPSHOT_STALE_AFTER', 900))
+
+
+def snapshot_async_enabled():
+    """
+    False executa o snapshot dentro do pedido (útil nos testes).
+    """
+    return getattr(settings, 'RANKING_SNAPSHOT_ASYNC', True)
+
+
+def start_snapshot_job(force=False):
+    """
+    Cria (ou reaproveita) o job do mês atual e agenda a sua execução.
+    Um job pendente, em execução ou concluído não é repetido, a não ser que
+    force=True (concluído), que tenha falhado ou que esteja parado há mais de
+    SNAPSHOT_STALE_AFTER (pendente ou em execução).
+    Devolve (job, iniciado).
+    """
+    month = datetime.now().strftime('%Y-%m')
+    return _start_job(RankingSnapshotJob.KIND_SNAPSHOT, month, force)
+
+
+def start_ranking_stats_job(month):
+    """
+    Agenda a reconstrução de ranking_stats/<mês> (ver firebase.rebuild_ranking_stats),
+    com as mesmas regras de start_snapshot_job: leituras concorrentes dos
+    contadores por reconstruir agendam uma única reconstrução.
+    Devolve (job, iniciado).
+    """
+    return _start_job(RankingSnapshotJob.KIND_RANKING_STATS, month)
+
+
+def _start_job(kind, month, force=False):
+    job, created = RankingSnapshotJob.objects.get_or_create(kind=kind, month=month)
+
+    if not created:
+        reiniciar = [RankingSnapshotJob.STATUS_FAILED]
+        if force:
+            reiniciar.append(RankingSnapshotJob.STATUS_DONE)
+        abandonado = Q(
+            status__in=[RankingSnapshotJob.STATUS_PENDING, RankingSnapshotJob.STATUS_RUNNING],
+            updated_at__lt=timezone.now() - SNAPSHOT_STALE_AFTER,
+        )
+        # Update condicional: só um pedido concorrente consegue reiniciar o job
+        claimed = RankingSnapshotJob.objects.filter(Q(status__in=reiniciar) | abandonado, pk=job.pk).update(
+            status=RankingSnapshotJob.STATUS_PENDING,
+            error=None,
+            started_at=None,
+            finished_at=None,
+            updated_at=timezone.now(),
+        )
+        if not claimed:
+            return job, False
+
+    if snapshot_async_enabled():
+        _executor.submit(_run_in_background, job.pk)
+    else:
+        run_snapshot_job(job.pk)
+
+    job.refresh_from_db()
+    return job, True
+
+
+def _run_snapshot(job):
+    return len(save_monthly_ranking_snapshot()['top_100'])
+
+
+def _run_ranking_stats(job):
+    return rebuild_ranking_stats(job.month)['total']
+
+
+# Executa o job e devolve o número de usuários processados
+JOB_RUNNERS = {
+    RankingSnapshotJob.KIND_SNAPSHOT: _run_snapshot,
+    RankingSnapshotJob.KIND_RANKING_STATS: _run_ranking_stats,
+}
+
+
+def run_snapshot_job(job_id):
+    jobs = RankingSnapshotJob.objects.filter(pk=job_id)
+    jobs.update(status=RankingSnapshotJob.STATUS_RUNNING, started_at=timezone.now(), updated_at=timezone.now())
+    job = jobs.get()
+
+    try:
+        total_users = JOB_RUNNERS[job.kind](job)
+    except Exception as e:
+        logger.exception("Falha no job %s do ranking (%s)", job.kind, job_id)
+        jobs.update(
+            status=RankingSnapshotJob.STATUS_FAILED, error=str(e),
+            finished_at=timezone.now(), updated_at=timezone.now(),
+        )
+        return
+
+    jobs.update(
+        status=RankingSnapshotJob.STATUS_DONE,
+        total_users=total_users,
+        finished_at=timezone.now(),
+        updated_at=timezone.now(),
+    )
+
+
+def _run_in_background(job_id):
+    try:
+        run_snapshot_job(job_id)
+    finally:
+        # A thread do executor não passa pelo ciclo de pedidos do Django
+        connections.close_all()
+
+
+def job_status(job):
+    return {
+        'kind': job.kind,
+        'month': job.month,
+        'status': job.status,
+        'total_users': job.total_users,
+        'error': job.error,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+        'updated_at': job.updated_at,
+    }
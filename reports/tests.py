@@ -1,3 +1,1266 @@
-from django.test import TestCase
+import json
+import time
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from google.api_core.exceptions import Aborted, AlreadyExists, NotFound
+from google.cloud import firestore_v1
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from users.models import CustomUser
+
+from . import backends, firebase, firebase_async, metrics, mirror, ranking_queue, response_cache, snapshots, views
+from .importers import parse_client_rows, validate_client_rows
+from .models import FirebaseUser, RankingPointsDelta, RankingSnapshotJob, Transaction, Video
+from .leaderboard import MonthlyLeaderboard
+from .memory_firestore import AsyncMemoryFirestore, MemoryFirestore
+from .middleware import RequestMetricsMiddleware
+from .pagination import encode_cursor
+
+
+def build_ranking_data(month, total):
+    users = {
+        f'uid{i}': {'name': f'User {i}', 'provincia': 'Maputo', 'password': 'secret'}
+        for i in range(total)
+    }
+    ranking = {
+        f'uid{i}': {'uid': f'uid{i}', 'points': i, 'exams': 1}
+        for i in range(total)
+    }
+    return {'users': users, f'monthly_ranking/{month}/users': ranking}
+
+
+class MemoryFirestoreTests(SimpleTestCase):
+
+    def setUp(self):
+        self.db = MemoryFirestore({'users': {
+            'a': {'name': 'Ana', 'points': 5, 'tags': ['x']},
+            'b': {'name': 'Bia', 'points': 9},
+            'c': {'name': 'Carla', 'points': 5},
+            'd': {'name': 'Dina'},
+        }})
+
+    def test_query_filters_orders_and_pages(self):
+        query = self.db.collection('users').where('points', '>=', 5).order_by('points', direction='DESCENDING')
+
+        first_page = list(query.limit(2).stream())
+        next_page = list(query.start_after(first_page[-1]).stream())
+
+        self.assertEqual([doc.id for doc in first_page], ['b', 'c'])
+        self.assertEqual([doc.id for doc in next_page], ['a'])
+        self.assertEqual(self.db.collection('users').where('tags', 'array_contains', 'x').count().get()[0][0].value, 1)
+
+    def test_batch_applies_transforms_atomically(self):
+        batch = self.db.batch()
+        batch.set(self.db.collection('users').document('a'), {'points': firestore_v1.Increment(3)}, merge=True)
+        batch.update(self.db.collection('users').document('b'), {'stats.exams': firestore_v1.Increment(1)})
+        batch.create(self.db.collection('users').document('c'), {'name': 'Outra'})
+
+        with self.assertRaises(AlreadyExists):
+            batch.commit()
+        self.assertEqual(self.db.data['users']['a']['points'], 5)
+
+        batch = self.db.batch()
+        batch.set(self.db.collection('users').document('a'), {'points': firestore_v1.Increment(3)}, merge=True)
+        batch.update(self.db.collection('users').document('b'), {'stats.exams': firestore_v1.Increment(1)})
+        batch.commit()
+        self.assertEqual(self.db.data['users']['a']['points'], 8)
+        self.assertEqual(self.db.data['users']['b']['stats'], {'exams': 1})
+        self.assertEqual(self.db.stats()['docs_written'], 2)
+
+    def test_transaction_retries_after_a_concurrent_write(self):
+        ref = self.db.collection('users').document('a')
+        attempts = []
+
+        @firestore_v1.transactional
+        def add_point(transaction):
+            snapshot = ref.get(transaction=transaction)
+            if not attempts:
+                ref.update({'points': 100})
+            attempts.append(snapshot.get('points'))
+            transaction.update(ref, {'points': snapshot.get('points') + 1})
+
+        add_point(self.db.transaction())
+
+        self.assertEqual(attempts, [5, 100])
+        self.assertEqual(self.db.data['users']['a']['points'], 101)
+
+    @override_settings(FIREBASE_BACKEND='memory')
+    def test_memory_backend_is_created_lazily(self):
+        backends.reset()
+        self.addCleanup(backends.reset)
+
+        self.assertEqual(backends._clients, {})
+        firebase.db.collection('users').document('z').set({'name': 'Zé'})
+
+        self.assertIsInstance(backends.get_firestore(), MemoryFirestore)
+        self.assertEqual(backends.get_firestore().data['users']['z'], {'name': 'Zé'})
+
+
+class RankingBatchJoinTests(SimpleTestCase):
+
+    def setUp(self):
+        self.month = firebase.datetime.now().strftime('%Y-%m')
+        firebase._user_cache().clear()
+        firebase.leaderboard.reset()
+
+    def test_current_ranking_fetches_details_in_chunks(self):
+        fake = MemoryFirestore(build_ranking_data(self.month, 250))
+        with mock.patch.object(firebase, 'db', fake):
+            ranking = firebase.get_current_ranking(limit=250)
+
+        self.assertEqual(len(ranking), 250)
+        # 1 query do ranking + 3 get_all (blocos de 100) em vez de 1 + 250
+        self.assertEqual(fake.rpc_count, 4)
+        self.assertEqual(ranking[0]['uid'], 'uid249')
+        self.assertEqual(ranking[0]['ranking_position'], 1)
+
+    def test_join_uses_field_mask_and_fills_defaults(self):
+        fake = MemoryFirestore(build_ranking_data(self.month, 3))
+        with mock.patch.object(firebase, 'db', fake):
+            ranking = firebase.get_current_ranking(limit=10)
+
+        self.assertEqual(fake.field_masks, [firebase.USER_DETAIL_FIELDS])
+        self.assertNotIn('password', ranking[0])
+        self.assertEqual(ranking[0]['provincia'], 'Maputo')
+        self.assertEqual(ranking[0]['isPro'], False)
+
+    def test_missing_user_keeps_ranking_row_with_basic_defaults(self):
+        data = build_ranking_data(self.month, 2)
+        del data['users']['uid1']
+        fake = MemoryFirestore(data)
+        with mock.patch.object(firebase, 'db', fake):
+            ranking = firebase.get_current_ranking(limit=10)
+
+        self.assertEqual(ranking[0]['uid'], 'uid1')
+        self.assertEqual(ranking[0]['telefone'], '')
+        self.assertEqual(ranking[1]['name'], 'User 0')
+
+    def test_ranking_users_are_batched(self):
+        fake = MemoryFirestore(build_ranking_data(self.month, 150))
+        with mock.patch.object(firebase, 'db', fake):
+            users = firebase.get_ranking_users()
+
+        self.assertEqual(len(users), 150)
+        self.assertEqual(fake.rpc_count, 3)
+
+
+class UserCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.month = firebase.datetime.now().strftime('%Y-%m')
+        firebase._user_cache().clear()
+        firebase.leaderboard.reset()
+
+    def test_second_ranking_read_is_served_from_cache(self):
+        fake = MemoryFirestore(build_ranking_data(self.month, 50))
+        with mock.patch.object(firebase, 'db', fake):
+            firebase.get_current_ranking(limit=50)
+            before = firebase.get_user_cache_stats()
+            firebase.get_current_ranking(limit=50)
+            after = firebase.get_user_cache_stats()
+
+        # A segunda chamada sai toda da memória (top-K + cache)
+        self.assertEqual(fake.rpc_count, 2)
+        self.assertEqual(after['hits'] - before['hits'], 50)
+        self.assertEqual(after['misses'], before['misses'])
+
+    def test_full_document_in_cache_serves_details_and_invalidation_drops_it(self):
+        fake = MemoryFirestore(build_ranking_data(self.month, 1))
+        with mock.patch.object(firebase, 'db', fake):
+            firebase.get_user_details('uid0')
+            firebase.get_users_details(['uid0'])
+            self.assertEqual(fake.rpc_count, 1)
+
+            firebase.invalidate_user_cache('uid0')
+            firebase.get_user_details('uid0')
+            self.assertEqual(fake.rpc_count, 2)
+
+    def test_projection_served_from_a_cached_full_document_drops_other_fields(self):
+        full = {'id': 'uid0', 'name': 'User 0', 'password': 'secret', 'provincia': 'Maputo'}
+        firebase._user_cache().set(firebase._user_cache_key('uid0'), full)
+        fake = MemoryFirestore({})
+        with mock.patch.object(firebase, 'db', fake), \
+                mock.patch.object(firebase_async, 'async_db', return_value=AsyncMemoryFirestore(fake)):
+            sync_details = firebase.get_users_by_ids(['uid0'], field_paths=firebase.USER_DETAIL_FIELDS)
+            async_details = async_to_sync(firebase_async.get_users_by_ids)(
+                ['uid0'], field_paths=firebase.USER_DETAIL_FIELDS
+            )
+
+        self.assertEqual(fake.rpc_count, 0)
+        for details in (sync_details, async_details):
+            self.assertNotIn('password', details['uid0'])
+            self.assertEqual(details['uid0']['name'], 'User 0')
+
+
+class MonthlyLeaderboardTests(SimpleTestCase):
+
+    def setUp(self):
+        self.board = MonthlyLeaderboard(size=3, ttl=60)
+        self.board.load('2025-09', [
+            {'id': 'a', 'points': 10},
+            {'id': 'b', 'points': 30},
+            {'id': 'c', 'points': 20},
+        ])
+
+    def ids(self):
+        return [row['id'] for row in self.board.top(10)]
+
+    def test_load_orders_by_points_then_uid(self):
+        self.board.apply('2025-09', {'id': 'aa', 'points': 20})
+        self.assertEqual(self.ids(), ['b', 'aa', 'c'])
+
+    def test_apply_moves_existing_user_and_evicts_the_last(self):
+        self.board.apply('2025-09', {'id': 'a', 'points': 40})
+        self.assertEqual(self.ids(), ['a', 'b', 'c'])
+
+        self.board.apply('2025-09', {'id': 'd', 'points': 25})
+        self.assertEqual(self.ids(), ['a', 'b', 'd'])
+        self.assertEqual(len(self.board), 3)
+
+    def test_apply_ignores_rows_outside_top_k_or_from_other_month(self):
+        self.board.apply('2025-09', {'id': 'd', 'points': 5})
+        self.board.apply('2025-08', {'id': 'e', 'points': 500})
+        self.assertEqual(self.ids(), ['b', 'c', 'a'])
+
+    def test_month_rollover_requires_reload(self):
+        self.assertFalse(self.board.needs_reload('2025-09'))
+        self.assertTrue(self.board.needs_reload('2025-10'))
+
+    def test_change_from_another_process_requires_reload(self):
+        # Pontos alterados por este processo: a cópia continua atual
+        self.board.apply('2025-09', {'id': 'a', 'points': 40}, response_cache.bump_tag('ranking'))
+        self.assertFalse(self.board.needs_reload('2025-09'))
+
+        # Outro worker incrementou a versão partilhada
+        response_cache.bump_tag('ranking')
+        self.assertTrue(self.board.needs_reload('2025-09'))
+
+    def test_ranking_points_bump_the_shared_version(self):
+        month = firebase.datetime.now().strftime('%Y-%m')
+        firebase._user_cache().clear()
+        firebase.leaderboard.reset()
+        fake = MemoryFirestore(build_ranking_data(month, 3))
+        with mock.patch.object(firebase, 'db', fake):
+            firebase.get_current_ranking(limit=2)
+            firebase.update_user_ranking_points('uid0', 50)
+            self.assertFalse(firebase.leaderboard.needs_reload(month))
+
+            other_worker = MonthlyLeaderboard()
+            other_worker.load(month, [])
+            firebase.update_user_ranking_points('uid1', 50)
+
+        self.assertTrue(other_worker.needs_reload(month))
+
+    def test_current_ranking_pages_are_served_from_memory(self):
+        month = firebase.datetime.now().strftime('%Y-%m')
+        firebase._user_cache().clear()
+        firebase.leaderboard.reset()
+        fake = MemoryFirestore(build_ranking_data(month, 30))
+        with mock.patch.object(firebase, 'db', fake):
+            firebase.get_current_ranking(limit=10)
+            page = firebase.get_current_ranking(limit=10, offset=10)
+
+        # 1 query para carregar o top-K + 2 get_all de detalhes
+        self.assertEqual(fake.rpc_count, 3)
+        self.assertEqual(page[0]['uid'], 'uid19')
+        self.assertEqual(page[0]['ranking_position'], 11)
+
+
+class RankingStatsCountersTests(SimpleTestCase):
+
+    def test_levels_follow_point_thresholds(self):
+        self.assertEqual(firebase.ranking_level_for(0), 'Iniciante')
+        self.assertEqual(firebase.ranking_level_for(20), 'Intermediário')
+        self.assertEqual(firebase.ranking_level_for(99), 'Avançado')
+        self.assertEqual(firebase.ranking_level_for(100), 'Expert')
+
+    def test_delta_only_when_user_crosses_a_threshold(self):
+        self.assertIsNone(firebase._ranking_stats_delta(21, 40))
+
+        delta = firebase._ranking_stats_delta(45, 60)
+        self.assertEqual(delta['levels']['Intermediário'].value, -1)
+        self.assertEqual(delta['levels']['Avançado'].value, 1)
+        self.assertNotIn('provinces', delta)
+
+    def test_new_user_counts_level_province_and_total(self):
+        delta = firebase._ranking_stats_delta(None, 5, '')
+        self.assertEqual(delta['total'].value, 1)
+        self.assertEqual(delta['levels']['Iniciante'].value, 1)
+        self.assertEqual(delta['provinces'][firebase.PROVINCIA_NAO_INFORMADA].value, 1)
+
+    def test_counters_without_rebuilt_at_are_read_as_stale_without_rebuilding(self):
+        month = firebase.datetime.now().strftime('%Y-%m')
+        fake = MemoryFirestore(build_ranking_data(month, 3))
+        fake.data['ranking_stats'] = {month: {'levels': {'Iniciante': -1, 'Intermediário': 1}}}
+        with mock.patch.object(firebase, 'db', fake):
+            stats = firebase.get_ranking_distribution(month)
+
+        self.assertFalse(stats['rebuilt'])
+        self.assertEqual(stats['levels'], {'Intermediário': 1})
+        self.assertEqual(fake.rpc_count, 1)
+        self.assertNotIn('rebuiltAt', fake.data['ranking_stats'][month])
+
+    def test_increments_skip_counters_not_yet_rebuilt(self):
+        month = firebase.datetime.now().strftime('%Y-%m')
+        fake = MemoryFirestore(build_ranking_data(month, 2))
+        with mock.patch.object(firebase, 'db', fake):
+            firebase._user_cache().clear()
+            firebase.update_user_ranking_points('uid1', 30)
+            self.assertNotIn('ranking_stats', fake.data)
+
+            stats = firebase.rebuild_ranking_stats(month)
+
+        self.assertEqual(stats['levels'], {'Iniciante': 1, 'Intermediário': 1})
+
+    def test_increment_during_rebuild_is_counted_once(self):
+        month = firebase.datetime.now().strftime('%Y-%m')
+        fake = MemoryFirestore(build_ranking_data(month, 2))
+        get_users_by_ids = firebase.get_users_by_ids
+        calls = []
+
+        def concurrent_increment(*args, **kwargs):
+            # Outro pedido pontua entre a leitura do ranking e o commit da reconstrução
+            if not calls:
+                firebase.update_user_ranking_points('uid1', 30)
+            calls.append(1)
+            return get_users_by_ids(*args, **kwargs)
+
+        with mock.patch.object(firebase, 'db', fake), \
+                mock.patch.object(firebase, 'get_users_by_ids', side_effect=concurrent_increment):
+            firebase._user_cache().clear()
+            stats = firebase.rebuild_ranking_stats(month)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(stats['levels'], {'Iniciante': 1, 'Intermediário': 1})
+        self.assertEqual(fake.data['ranking_stats'][month]['levels'], {'Iniciante': 1, 'Intermediário': 1})
+
+
+
+class RankingPointsTransactionTests(SimpleTestCase):
+
+    def setUp(self):
+        self.month = firebase.datetime.now().strftime('%Y-%m')
+        firebase._user_cache().clear()
+        firebase.leaderboard.reset()
+
+    def exam(self):
+        return {'examId': 'e1', 'totalSuccess': 8, 'totalQuestions': 10, 'categoryName': 'B', 'passed': True}
+
+    def test_existing_user_is_one_read_and_one_commit(self):
+        fake = MemoryFirestore(build_ranking_data(self.month, 1))
+        fake.data[f'monthly_ranking/{self.month}/users']['uid0']['points'] = 15
+        fake.data['ranking_stats'] = {self.month: {'total': 1, 'levels': {'Iniciante': 1}, 'rebuiltAt': 'x'}}
+        with mock.patch.object(firebase, 'db', fake):
+            result = firebase.update_user_ranking_points('uid0', 10, self.exam())
+
+        # begin + leitura na transação + commit
+        self.assertEqual(fake.rpc_count, 3)
+        self.assertEqual(result['points'], 25)
+        self.assertEqual(result['exams'], 2)
+        stored = fake.data[f'monthly_ranking/{self.month}/users']['uid0']
+        self.assertEqual((stored['points'], stored['exams']), (25, 2))
+        self.assertEqual(fake.data['ranking_stats'][self.month]['levels'], {'Iniciante': 0, 'Intermediário': 1})
+        [history] = fake.data['user_exam_history'].values()
+        self.assertEqual((history['points_earned'], history['month']), (10, self.month))
+
+    def test_first_points_of_the_month_copy_the_profile(self):
+        fake = MemoryFirestore({
+            'users': {'uid9': {'name': 'Ana', 'apelido': 'Silva', 'provincia': 'Gaza'}},
+            'ranking_stats': {self.month: {'total': 0, 'levels': {}, 'provinces': {}, 'rebuiltAt': 'x'}},
+        })
+        with mock.patch.object(firebase, 'db', fake):
+            result = firebase.update_user_ranking_points('uid9', 5)
+
+        stored = fake.data[f'monthly_ranking/{self.month}/users']['uid9']
+        self.assertEqual(stored['name'], 'Ana Silva')
+        self.assertEqual((stored['points'], stored['exams']), (5, 1))
+        self.assertEqual(result['points'], 5)
+        self.assertEqual(fake.data['ranking_stats'][self.month]['provinces'], {'Gaza': 1})
+        self.assertNotIn('user_exam_history', fake.data)
+
+    def test_unknown_user_writes_nothing(self):
+        fake = MemoryFirestore({})
+        with mock.patch.object(firebase, 'db', fake):
+            with self.assertRaises(ValueError):
+                firebase.update_user_ranking_points('nobody', 5)
+
+        self.assertNotIn(f'monthly_ranking/{self.month}/users', fake.data)
+
+
+@override_settings(RANKING_WRITE_BEHIND=True)
+@mock.patch.object(ranking_queue, 'RANKING_QUEUE_FLUSH_DELAY', 0)
+class RankingWriteBehindTests(TestCase):
+
+    def setUp(self):
+        self.month = firebase.datetime.now().strftime('%Y-%m')
+        firebase._user_cache().clear()
+        firebase.leaderboard.reset()
+        self.fake = MemoryFirestore(build_ranking_data(self.month, 3))
+        patcher = mock.patch.object(firebase, 'db', self.fake)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stored(self, uid):
+        return self.fake.data[f'monthly_ranking/{self.month}/users'][uid]
+
+    def test_repeated_idempotency_key_is_queued_once(self):
+        _, created = ranking_queue.enqueue_points('uid0', 5, idempotency_key='k1')
+        row, created_again = ranking_queue.enqueue_points('uid0', 5, idempotency_key='k1')
+
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(RankingPointsDelta.objects.count(), 1)
+
+    def test_flush_coalesces_increments_per_user(self):
+        for key in ('a', 'b', 'c'):
+            ranking_queue.enqueue_points('uid1', 10, {'examId': key}, idempotency_key=key)
+        ranking_queue.enqueue_points('uid2', 1)
+
+        result = firebase.flush_ranking_points_queue()
+
+        self.assertEqual(result, {'users': 2, 'rows': 4, 'failed': 0})
+        # begin + leitura + commit por usuário
+        self.assertEqual(self.fake.rpc_count, 6)
+        self.assertEqual((self.stored('uid1')['points'], self.stored('uid1')['exams']), (31, 4))
+        self.assertEqual(set(self.fake.data['user_exam_history']), {'a', 'b', 'c'})
+        self.assertEqual(ranking_queue.pending_totals(self.month), {})
+
+    def test_redelivery_after_a_lost_acknowledgement_is_ignored(self):
+        ranking_queue.enqueue_points('uid1', 10)
+        firebase.flush_ranking_points_queue()
+        # Commit no Firestore feito, mas a marcação na fila perdeu-se
+        RankingPointsDelta.objects.update(flushed_at=None)
+        ranking_queue.enqueue_points('uid1', 4)
+
+        firebase.flush_ranking_points_queue()
+
+        self.assertEqual(self.stored('uid1')['points'], 15)
+
+    def test_unknown_user_leaves_the_queue_with_the_error(self):
+        ranking_queue.enqueue_points('ghost', 3)
+
+        result = firebase.flush_ranking_points_queue()
+
+        self.assertEqual(result['failed'], 1)
+        row = RankingPointsDelta.objects.get()
+        self.assertIsNotNone(row.flushed_at)
+        self.assertIn('ghost', row.last_error)
+
+    def test_contention_that_exhausts_the_retries_keeps_the_rows_pending(self):
+        ranking_queue.enqueue_points('uid1', 3)
+
+        with mock.patch.object(self.fake, '_commit', side_effect=Aborted('contenção')), \
+                self.assertLogs('reports.firebase', 'WARNING'):
+            result = firebase.flush_ranking_points_queue()
+
+        self.assertEqual(result['failed'], 1)
+        row = RankingPointsDelta.objects.get()
+        self.assertIsNone(row.flushed_at)
+        self.assertEqual(row.attempts, 1)
+        self.assertEqual(ranking_queue.pending_totals(self.month), {'uid1': {'points': 3, 'exams': 1}})
+
+    def test_current_ranking_includes_unflushed_points(self):
+        ranking_queue.enqueue_points('uid0', 50)
+
+        ranking = firebase.get_current_ranking(limit=3)
+
+        self.assertEqual(ranking[0]['uid'], 'uid0')
+        self.assertEqual(ranking[0]['ranking_points'], 50)
+        self.assertEqual(ranking[0]['ranking_exams_count'], 2)
+
+
+@override_settings(RANKING_SNAPSHOT_ASYNC=False)
+class RankingSnapshotJobTests(TestCase):
+
+    def setUp(self):
+        self.month = firebase.datetime.now().strftime('%Y-%m')
+        firebase._user_cache().clear()
+        firebase.leaderboard.reset()
+        self.fake = MemoryFirestore(build_ranking_data(self.month, 150))
+        patcher = mock.patch.object(firebase, 'db', self.fake)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_snapshot_is_compact_and_written_in_one_batch(self):
+        job, started = snapshots.start_snapshot_job()
+
+        self.assertTrue(started)
+        self.assertEqual((job.status, job.total_users), (RankingSnapshotJob.STATUS_DONE, 100))
+        history = self.fake.data['ranking_history'][self.month]
+        self.assertEqual(history['top_100'][0]['uid'], 'uid149')
+        self.assertNotIn('password', history['top_100'][0])
+        self.assertEqual(len(self.fake.data['ranking_winners']), 10)
+        # leitura do top-K + get_all dos detalhes + um único commit
+        self.assertEqual(self.fake.rpc_count, 3)
+
+    def test_snapshot_reads_firestore_not_the_cached_top_k(self):
+        # Top-K deste processo desatualizado: outro worker já deu pontos ao uid3
+        firebase.get_current_ranking(limit=10)
+        self.fake.data[f'monthly_ranking/{self.month}/users']['uid3']['points'] = 1000
+
+        snapshots.start_snapshot_job()
+
+        history = self.fake.data['ranking_history'][self.month]
+        self.assertEqual(history['top_100'][0]['uid'], 'uid3')
+        self.assertEqual(history['top_100'][0]['points'], 1000)
+
+    def test_stale_ranking_stats_schedule_a_single_rebuild(self):
+        response_cache._cache().clear()
+        client = APIClient()
+        client.force_authenticate(CustomUser.objects.create(username='admin', email='a@example.com', is_staff=True))
+        running = RankingSnapshotJob.objects.create(
+            kind=RankingSnapshotJob.KIND_RANKING_STATS, month=self.month, status=RankingSnapshotJob.STATUS_RUNNING,
+        )
+
+        # Já há uma reconstrução em curso: o pedido não começa outra
+        first = client.get('/api/ranking/stats/')
+        self.assertTrue(first.json()['distribution_stale'])
+        self.assertNotIn('ranking_stats', self.fake.data)
+
+        running.delete()
+        second = client.get('/api/ranking/stats/')
+        third = client.get('/api/ranking/stats/')
+
+        self.assertTrue(second.json()['distribution_stale'])
+        job = RankingSnapshotJob.objects.get(kind=RankingSnapshotJob.KIND_RANKING_STATS)
+        self.assertEqual((job.status, job.total_users), (RankingSnapshotJob.STATUS_DONE, 150))
+        self.assertEqual((third['X-Cache'], third.json()['distribution_stale']), ('MISS', False))
+        self.assertEqual(third.json()['distribution_by_level']['Expert'], 50)
+
+    def test_read_error_or_empty_ranking_fails_the_job_without_writing(self):
+        with mock.patch.object(self.fake, 'collection', side_effect=RuntimeError('sem rede')), \
+                self.assertLogs('reports.snapshots', 'ERROR'):
+            job, _ = snapshots.start_snapshot_job()
+        self.assertEqual((job.status, job.error), (RankingSnapshotJob.STATUS_FAILED, 'sem rede'))
+
+        self.fake.data[f'monthly_ranking/{self.month}/users'].clear()
+        with self.assertLogs('reports.snapshots', 'ERROR'):
+            job, started = snapshots.start_snapshot_job()
+
+        self.assertTrue(started)
+        self.assertEqual(job.status, RankingSnapshotJob.STATUS_FAILED)
+        self.assertNotIn('ranking_history', self.fake.data)
+
+    def test_second_request_for_the_month_does_not_rerun(self):
+        snapshots.start_snapshot_job()
+        rpc_count = self.fake.rpc_count
+
+        job, started = snapshots.start_snapshot_job()
+
+        self.assertFalse(started)
+        self.assertEqual(self.fake.rpc_count, rpc_count)
+        self.assertEqual(RankingSnapshotJob.objects.count(), 1)
+
+    def test_forced_rerun_overwrites_the_same_documents(self):
+        snapshots.start_snapshot_job()
+        job, started = snapshots.start_snapshot_job(force=True)
+
+        self.assertTrue(started)
+        self.assertEqual(list(self.fake.data['ranking_history']), [self.month])
+        self.assertEqual(len(self.fake.data['ranking_winners']), 10)
+
+    def test_abandoned_job_is_restarted_after_the_stale_timeout(self):
+        job = RankingSnapshotJob.objects.create(month=self.month, status=RankingSnapshotJob.STATUS_RUNNING)
+
+        _, started = snapshots.start_snapshot_job(force=True)
+        self.assertFalse(started)
+
+        RankingSnapshotJob.objects.filter(pk=job.pk).update(
+            updated_at=timezone.now() - snapshots.SNAPSHOT_STALE_AFTER - timedelta(seconds=1)
+        )
+        job, started = snapshots.start_snapshot_job()
+
+        self.assertTrue(started)
+        self.assertEqual(job.status, RankingSnapshotJob.STATUS_DONE)
+
+    def test_failed_job_records_the_error_and_can_be_retried(self):
+        with mock.patch.object(snapshots, 'save_monthly_ranking_snapshot', side_effect=RuntimeError('sem rede')), \
+                self.assertLogs('reports.snapshots', 'ERROR'):
+            job, _ = snapshots.start_snapshot_job()
+        self.assertEqual((job.status, job.error), (RankingSnapshotJob.STATUS_FAILED, 'sem rede'))
+
+        job, started = snapshots.start_snapshot_job()
+        self.assertTrue(started)
+        self.assertEqual(job.status, RankingSnapshotJob.STATUS_DONE)
+
+
+class AsyncFirebaseViewsTests(TestCase):
+
+    def setUp(self):
+        self.month = firebase.datetime.now().strftime('%Y-%m')
+        firebase._user_cache().clear()
+        firebase.leaderboard.reset()
+        self.fake = MemoryFirestore(build_ranking_data(self.month, 150))
+        patcher = mock.patch.object(firebase_async, 'async_db', return_value=AsyncMemoryFirestore(self.fake))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_async_ranking_matches_the_sync_version(self):
+        ranking = async_to_sync(firebase_async.get_current_ranking)(limit=120)
+
+        # 1 query do top-K + 2 get_all em paralelo (blocos de 100)
+        self.assertEqual(self.fake.rpc_count, 3)
+        firebase.leaderboard.reset()
+        firebase._user_cache().clear()
+        with mock.patch.object(firebase, 'db', MemoryFirestore(build_ranking_data(self.month, 150))):
+            self.assertEqual(ranking, firebase.get_current_ranking(limit=120))
+
+    def test_async_views_keep_the_admin_token_requirement(self):
+        self.assertEqual(self.client.get('/api/async/ranking/current/').status_code, 401)
+
+        admin = CustomUser.objects.create(username='admin', email='admin@example.com', is_staff=True)
+        token = Token.objects.create(user=admin)
+        response = self.client.get('/api/async/users/uid3/details/', HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], 'User 3')
+        missing = self.client.get('/api/async/users/nobody/details/', HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(missing.status_code, 404)
+
+    def test_cached_details_are_shared_with_the_sync_version(self):
+        async_to_sync(firebase_async.get_user_details)('uid3')
+        with mock.patch.object(firebase, 'db', MemoryFirestore({})):
+            self.assertEqual(firebase.get_users_details(['uid3'])['uid3']['name'], 'User 3')
+            self.assertEqual(firebase.get_user_details('uid3')['password'], 'secret')
+
+    def test_read_errors_are_logged_and_fall_back_to_empty(self):
+        with mock.patch.object(firebase_async, 'async_db', side_effect=RuntimeError('quota')), \
+                self.assertLogs('reports.firebase_async', 'ERROR') as logs:
+            self.assertEqual(async_to_sync(firebase_async.get_previous_month_winners)(), [])
+            self.assertEqual(async_to_sync(firebase_async.count_ranking_users)(), 0)
+
+        self.assertEqual(len(logs.records), 2)
+        self.assertIn('quota', logs.output[0])
+
+
+class RankingDashboardFanOutTests(TestCase):
+
+    def setUp(self):
+        response_cache._cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username='admin', email='a@example.com', is_staff=True))
+
+    def test_failed_and_slow_sections_do_not_hide_the_others(self):
+        def slow_winners():
+            time.sleep(0.3)
+            return [{'uid': 'late'}]
+
+        with mock.patch.multiple(
+            views,
+            count_ranking_users=mock.Mock(return_value=5),
+            count_users=mock.Mock(side_effect=RuntimeError('quota')),
+            get_current_ranking=mock.Mock(return_value=[{'uid': 'uid1'}]),
+            get_previous_month_winners=slow_winners,
+        ), mock.patch.dict(views.DASHBOARD_DEADLINES, {'previous_winners': 0.05}), \
+                self.assertLogs('reports.views', 'WARNING'):
+            data = self.client.get('/api/ranking/dashboard/').json()
+
+        self.assertEqual(data['status'], 'partial')
+        self.assertEqual(data['total_ranking_users'], 5)
+        self.assertEqual(data['current_ranking'], [{'uid': 'uid1'}])
+        self.assertEqual(data['total_users'], 0)
+        self.assertEqual(data['previous_winners'], [])
+        self.assertEqual(data['sections']['total_users']['status'], 'error')
+        self.assertEqual(data['sections']['previous_winners']['status'], 'timeout')
+        self.assertEqual(data['sections']['current_ranking']['status'], 'ok')
+        self.assertIn('elapsed_ms', data['sections']['total_ranking_users'])
+
+
+class FirebaseUsersEndpointTests(TestCase):
+
+    def setUp(self):
+        response_cache._cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username='admin', email='a@example.com', is_staff=True))
+        self.fake = MemoryFirestore({'users': {f'uid{i}': {'name': f'User {i}'} for i in range(5)}})
+        patcher = mock.patch.object(firebase, 'db', self.fake)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pages_chain_through_the_cursor_in_document_id_order(self):
+        ids = []
+        params = {'page_size': 2}
+        pages = 0
+        while True:
+            body = self.client.get('/api/clients/', params).json()
+            ids += [user['id'] for user in body['results']]
+            pages += 1
+            if not body['next']:
+                break
+            params = {'page_size': 2, 'cursor': body['next']}
+
+        self.assertEqual(ids, [f'uid{i}' for i in range(5)])
+        self.assertEqual(pages, 3)
+        # Uma query por página, sem reler a coleção inteira
+        self.assertEqual(self.fake.docs_read, 5)
+
+    def test_invalid_page_size_or_cursor_is_rejected(self):
+        self.assertEqual(self.client.get('/api/clients/', {'page_size': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/clients/', {'cursor': '%%%'}).status_code, 400)
+
+    def test_stream_returns_every_user_as_ndjson(self):
+        response = self.client.get('/api/clients/', {'stream': 'true'})
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [f'uid{i}' for i in range(5)])
+        self.assertNotIn('X-Cache', response)
+
+    def test_count_endpoint_is_one_aggregation_rpc(self):
+        response = self.client.get('/api/clients/count/')
+
+        self.assertEqual(response.json(), {'total_users': 5})
+        self.assertEqual(self.fake.rpc_count, 1)
+        self.assertEqual(self.fake.docs_read, 1)
+
+    def test_aggregate_applies_filters_and_numeric_ops(self):
+        month = firebase.datetime.now().strftime('%Y-%m')
+        self.fake.data.update(build_ranking_data(month, 4))
+        path = f'monthly_ranking/{month}/users'
+
+        self.assertEqual(firebase.aggregate(path, [('points', '>', 0)]), 3)
+        self.assertEqual(firebase.aggregate(path, op='sum', field='points'), 6)
+        self.assertEqual(firebase.aggregate(path, [('points', '>=', 2)], op='avg', field='points'), 2.5)
+        self.assertEqual(firebase.count_ranking_users(), 3)
+        with self.assertRaises(ValueError):
+            firebase.aggregate(path, op='sum')
+        with self.assertRaises(ValueError):
+            firebase.aggregate(path, op='max', field='points')
+
+
+class UnifiedTransactionsTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username='admin', email='a@example.com', is_staff=True))
+        patcher = mock.patch.object(views, 'get_users_by_ids', return_value={'w1': {'name': 'Ana'}})
+        self.users = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add(self, created_at, **fields):
+        fields = {'wallet_id': 'w1', 'provider': 'mpesa', 'amount': 10, 'phone': '840000000', **fields}
+        t = Transaction.objects.create(**fields)
+        Transaction.objects.filter(pk=t.pk).update(created_at=created_at)
+        return t
+
+    def test_keyset_pages_cover_ties_on_created_at_without_gaps(self):
+        same_time = timezone.now()
+        created = [self.add(same_time) for _ in range(3)]
+        created.append(self.add(same_time - timedelta(hours=1)))
+
+        first = self.client.get('/api/transactions/', {'page_size': 2}).json()
+        second = self.client.get('/api/transactions/', {'page_size': 2, 'cursor': first['next']}).json()
+        third = self.client.get('/api/transactions/', {'page_size': 2, 'cursor': second['next']}).json()
+
+        ids = [row['id'] for row in first['results'] + second['results'] + third['results']]
+        self.assertEqual(ids, [created[2].id, created[1].id, created[0].id, created[3].id])
+        self.assertEqual(first['results'][0]['user'], {'name': 'Ana'})
+        self.assertIsNone(third['next'])
+
+    def test_filters_by_field_and_date_range(self):
+        day = timezone.make_aware(firebase.datetime(2025, 9, 15, 12))
+        match = self.add(day, status='pago')
+        self.add(day, status='pendente')
+        self.add(day - timedelta(days=10), status='pago')
+
+        response = self.client.get('/api/transactions/', {
+            'status': 'pago', 'provider': 'mpesa', 'date_from': '2025-09-15', 'date_to': '2025-09-15',
+        })
+
+        self.assertEqual([row['id'] for row in response.json()['results']], [match.id])
+
+    def test_malformed_cursor_or_dates_are_rejected(self):
+        bad = [
+            {'cursor': 'não-é-base64'},
+            {'cursor': encode_cursor({'created_at': timezone.now().isoformat()})},
+            {'cursor': encode_cursor({'created_at': timezone.now().isoformat(), 'id': 'abc'})},
+            {'cursor': encode_cursor({'created_at': 'ontem', 'id': 1})},
+            {'date_from': '15/09/2025'},
+            {'page_size': 'muitos'},
+        ]
+        for params in bad:
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/transactions/', params).status_code, 400)
+
+
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        response_cache._cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username='admin', email='a@example.com', is_staff=True))
+        patcher = mock.patch.object(views, 'get_current_ranking', return_value=[{'uid': 'uid1'}])
+        self.ranking = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_repeated_query_is_served_from_cache(self):
+        first = self.client.get('/api/ranking/current/?limit=5')
+        second = self.client.get('/api/ranking/current/?limit=5')
+        self.client.get('/api/ranking/current/?limit=6')
+
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(second.json(), [{'uid': 'uid1'}])
+        self.assertEqual(self.ranking.call_count, 2)
+
+    def test_ranking_writes_invalidate_by_tag(self):
+        self.client.get('/api/ranking/current/')
+        # A própria gravação dos pontos incrementa a versão da tag 'ranking'
+        fake = MemoryFirestore(build_ranking_data(firebase.datetime.now().strftime('%Y-%m'), 2))
+        with mock.patch.object(firebase, 'db', fake):
+            firebase._user_cache().clear()
+            response = self.client.post('/api/users/uid1/add-ranking-points/', {'points': 3}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.client.get('/api/ranking/current/')['X-Cache'], 'MISS')
+        self.assertEqual(self.ranking.call_count, 2)
+
+    def test_previous_winners_are_cached_per_month(self):
+        with mock.patch.object(views, 'get_previous_month_winners', side_effect=[['setembro'], ['outubro']]), \
+                mock.patch.object(views, 'datetime') as clock:
+            clock.now.return_value = firebase.datetime(2025, 10, 31, 23, 59)
+            self.client.get('/api/ranking/previous-winners/')
+            same_month = self.client.get('/api/ranking/previous-winners/')
+            clock.now.return_value = firebase.datetime(2025, 11, 1, 0, 1)
+            next_month = self.client.get('/api/ranking/previous-winners/')
+
+        self.assertEqual((same_month['X-Cache'], same_month.json()), ('HIT', ['setembro']))
+        self.assertEqual((next_month['X-Cache'], next_month.json()), ('MISS', ['outubro']))
+
+    def test_expired_entry_is_served_stale_while_another_request_recomputes(self):
+        self.client.get('/api/ranking/current/')
+        cache = response_cache._cache()
+        key = response_cache._response_key(
+            'current_ranking', RequestFactory().get('/'), ('ranking',), views._ranking_month
+        )
+        cache.set(key, {**cache.get(key), 'fresh_until': 0})
+        cache.add(f'{key}:lock', 1)
+
+        response = self.client.get('/api/ranking/current/')
+
+        self.assertEqual(response['X-Cache'], 'STALE')
+        self.assertEqual(self.ranking.call_count, 1)
+
+
+class RequestMetricsTests(TestCase):
+
+    def setUp(self):
+        self.month = firebase.datetime.now().strftime('%Y-%m')
+        firebase._user_cache().clear()
+        firebase.leaderboard.reset()
+        response_cache._cache().clear()
+        metrics.reset_histograms()
+        self.fake = MemoryFirestore(build_ranking_data(self.month, 20))
+        patcher = mock.patch.object(firebase, 'db', metrics.InstrumentedFirestore(self.fake))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username='admin', email='a@example.com', is_staff=True))
+
+    def test_wrapper_counts_what_the_client_does(self):
+        request_metrics, token = metrics.start_request()
+        try:
+            firebase.update_user_ranking_points('uid3', 5)
+            firebase.get_current_ranking(limit=5)
+        finally:
+            metrics.end_request(token)
+
+        self.assertEqual(request_metrics.firestore_rpcs, self.fake.rpc_count)
+        self.assertEqual(request_metrics.docs_read, self.fake.docs_read)
+        self.assertEqual(request_metrics.docs_written, self.fake.docs_written)
+
+    def test_server_timing_header_and_prometheus_histograms(self):
+        response = self.client.get('/api/ranking/current/?limit=5')
+
+        self.assertIn('firestore;dur=', response['Server-Timing'])
+        self.assertIn(f'desc="{self.fake.rpc_count} rpcs, {self.fake.docs_read} read, 0 written"', response['Server-Timing'])
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+
+        body = self.client.get('/api/metrics/').content.decode()
+        self.assertIn('# TYPE firestore_rpcs_per_request histogram', body)
+        self.assertIn('firestore_rpcs_per_request_count{endpoint="api/ranking/current/",method="GET"} 1', body)
+
+    @override_settings(FIREBASE_BACKEND='memory')
+    async def test_async_views_count_firestore_rpcs_without_thread_hops(self):
+        admin = await CustomUser.objects.acreate(username='async', email='async@example.com', is_staff=True)
+        token = await Token.objects.acreate(user=admin)
+
+        with mock.patch.object(backends, 'get_firestore', return_value=self.fake):
+            response = await self.async_client.get(
+                '/api/async/ranking/current/', {'limit': 5}, headers={'authorization': f'Token {token.key}'}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(self.fake.rpc_count, 0)
+        self.assertIn(f'desc="{self.fake.rpc_count} rpcs, {self.fake.docs_read} read', response['Server-Timing'])
+        body = metrics.render_prometheus()
+        self.assertIn('firestore_rpcs_per_request_count{endpoint="api/async/ranking/current/",method="GET"} 1', body)
+
+        async def get_response(request):
+            return None
+        self.assertTrue(iscoroutinefunction(RequestMetricsMiddleware(get_response)))
+        self.assertFalse(iscoroutinefunction(RequestMetricsMiddleware(lambda request: None)))
+
+    def test_metrics_endpoint_is_admin_only(self):
+        self.client.force_authenticate(CustomUser.objects.create(username='user', email='u@example.com'))
+
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        response_cache._cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username='admin', email='a@example.com', is_staff=True))
+
+    def test_unchanged_videos_answer_304_with_a_single_query(self):
+        Video.objects.create(title='Aula 1', youtube_url='https://youtu.be/a')
+        etag = self.client.get('/api/videos/')['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/videos/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Video.objects.create(title='Aula 2', youtube_url='https://youtu.be/b')
+        self.assertEqual(self.client.get('/api/videos/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_firestore_lists_use_the_tag_version(self):
+        with mock.patch.object(views, 'get_users_page', return_value=[{'id': 'uid1'}]) as page:
+            etag = self.client.get('/api/clients/?page_size=10')['ETag']
+            not_modified = self.client.get('/api/clients/?page_size=10', HTTP_IF_NONE_MATCH=etag)
+            other_page = self.client.get('/api/clients/?page_size=20', HTTP_IF_NONE_MATCH=etag)
+            response_cache.invalidate_tags('users')
+            changed = self.client.get('/api/clients/?page_size=10', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(other_page.status_code, 200)
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(page.call_count, 3)
+
+@override_settings(FIREBASE_USERS_READ_SOURCE='mirror')
+class FirebaseUserMirrorTests(TestCase):
+
+    def setUp(self):
+        mirror.upsert_users([
+            ('u1', {'name': 'Ana', 'telefone': '841111111', 'provincia': 'Maputo',
+                    'isPro': True, 'password': 'x', 'createdAt': '2025-09-01T10:00:00+02:00'}),
+            ('u2', {'name': 'Rui', 'telefone': '842222222', 'provincia': 'Gaza'}),
+        ])
+
+    def test_upsert_updates_existing_rows_and_drops_password(self):
+        mirror.upsert_users([('u1', {'name': 'Ana Maria', 'telefone': '841111111'})])
+
+        row = FirebaseUser.objects.get(uid='u1')
+        self.assertEqual(row.name, 'Ana Maria')
+        self.assertNotIn('password', row.data)
+        self.assertEqual(FirebaseUser.objects.count(), 2)
+
+    def test_read_paths_use_the_local_table(self):
+        with mock.patch.object(firebase, 'db', None):
+            by_phone = firebase.get_users_by_telefone('842222222')
+            page = firebase.get_users_page(1, start_after='u1')
+            by_id = firebase.get_users_by_ids(['u1', 'missing'])
+
+        self.assertEqual(by_phone, [{'id': 'u2', 'name': 'Rui', 'telefone': '842222222', 'provincia': 'Gaza'}])
+        self.assertEqual([u['id'] for u in page], ['u2'])
+        self.assertEqual(list(by_id), ['u1'])
+
+
+class UpdateUserRpcBenchmark(SimpleTestCase):
+    """
+    Micro-benchmark: RPCs ao Firestore por PATCH /api/clients/<id>/.
+    """
+
+    def setUp(self):
+        firebase._user_cache().clear()
+        self.fake = MemoryFirestore({'users': {'u1': {'name': 'Ana', 'provincia': 'Maputo'}}})
+
+    def patch(self, **kwargs):
+        self.fake.rpc_count = 0
+        with mock.patch.object(firebase, 'db', self.fake):
+            result = firebase.update_user('u1', {'provincia': 'Gaza'}, **kwargs)
+        return result, self.fake.rpc_count
+
+    def test_default_patch_is_a_single_write(self):
+        result, rpcs = self.patch()
+        self.assertEqual(rpcs, 1)
+        self.assertEqual(result['provincia'], 'Gaza')
+        self.assertIn('updateTime', result)
+
+    def test_cached_document_is_merged_locally(self):
+        with mock.patch.object(firebase, 'db', self.fake):
+            firebase.get_user_details('u1')
+        result, rpcs = self.patch()
+        self.assertEqual(rpcs, 1)
+        self.assertEqual(result['name'], 'Ana')
+        self.assertEqual(firebase.get_user_details('u1')['provincia'], 'Gaza')
+
+    def test_fresh_and_debug_modes_read_from_server(self):
+        _, rpcs = self.patch(fresh=True)
+        self.assertEqual(rpcs, 2)
+
+        with self.assertLogs(firebase.logger, level='DEBUG'):
+            _, rpcs = self.patch()
+        # Comportamento antigo: get + set + get
+        self.assertEqual(rpcs, 3)
+
+
+class UpdateUserByPhoneTests(SimpleTestCase):
+
+    def setUp(self):
+        firebase._user_cache().clear()
+        self.fake = MemoryFirestore({'users': {
+            'u1': {'telefone': '841111111', 'isPro': False},
+            'u2': {'telefone': '841111111', 'isPro': False},
+            'u3': {'telefone': '841111111', 'isPro': False},
+            'u4': {'telefone': '842222222', 'isPro': False},
+        }})
+
+    def update(self, **kwargs):
+        with mock.patch.object(firebase, 'db', self.fake):
+            return firebase.update_user_by_phone('841111111', {'isPro': True}, **kwargs)
+
+    def test_all_matches_are_written_in_one_batch(self):
+        users = self.update()
+
+        # 1 query + 1 commit, em vez de 1 + 2 por documento
+        self.assertEqual(self.fake.rpc_count, 2)
+        self.assertEqual([u['id'] for u in users], ['u1', 'u2', 'u3'])
+        self.assertTrue(all(u['isPro'] for u in users))
+        self.assertFalse(self.fake.data['users']['u4']['isPro'])
+
+    def test_fresh_rereads_with_a_single_get_all(self):
+        users = self.update(fresh=True)
+        self.assertEqual(self.fake.rpc_count, 3)
+        self.assertTrue(users[0]['isPro'])
+
+    def test_dry_run_reports_changes_without_writing(self):
+        users = self.update(dry_run=True)
+
+        self.assertEqual(self.fake.rpc_count, 1)
+        self.assertEqual(users[0]['changes'], {'isPro': {'from': False, 'to': True}})
+        self.assertFalse(self.fake.data['users']['u1']['isPro'])
+
+
+class BulkClientValidationTests(SimpleTestCase):
+
+    def test_csv_rows_are_normalized_and_deduplicated_locally(self):
+        content = (
+            "name,telefone,password\n"
+            "Ana,+258 84 111 1111,segredo1\n"
+            "Rui,841111111,segredo2\n"
+            "Eva,12345,segredo3\n"
+            "Lia,842222222,123\n"
+            "Zé,843333333,\n"
+        )
+        valid, report = validate_client_rows(parse_client_rows(content.encode(), 'csv'))
+
+        self.assertEqual([c['telefone'] for c in valid], ['841111111', '843333333'])
+        self.assertEqual(valid[0]['email'], '841111111@gmail.com')
+        self.assertNotIn('password', valid[1])
+        self.assertEqual(
+            [(r['row'], r['status']) for r in report],
+            [(2, 'duplicate'), (3, 'invalid'), (4, 'invalid')]
+        )
+
+    def test_json_accepts_a_list_or_a_clients_key(self):
+        self.assertEqual(parse_client_rows('[{"telefone": "841111111"}]', 'json'), [{'telefone': '841111111'}])
+        self.assertEqual(parse_client_rows('{"clients": []}', 'json'), [])
+        with self.assertRaises(ValueError):
+            parse_client_rows('{"clients": "x"}', 'json')
+
+
+class BulkCreateUsersTests(TestCase):
+
+    def setUp(self):
+        firebase._user_cache().clear()
+        # Reserva vazia (de uma escrita antiga): não conta como duplicado, mas o create falha
+        self.fake = MemoryFirestore({'phone_index': {'842222222': {'uids': []}}})
+        self.import_users = mock.Mock(return_value=SimpleNamespace(errors=[]))
+        patchers = [
+            mock.patch.object(firebase, 'db', self.fake),
+            mock.patch.object(firebase.auth, 'get_users', return_value=SimpleNamespace(users=[])),
+            mock.patch.object(firebase.auth, 'import_users', self.import_users),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def rows(self):
+        valid, _ = validate_client_rows([
+            {'telefone': '841111111', 'name': 'Ana'},
+            {'telefone': '842222222', 'name': 'Rui'},
+            {'telefone': '843333333', 'name': 'Eva'},
+        ])
+        return valid
+
+    def test_partial_import_errors_and_index_conflicts_are_reported_per_row(self):
+        self.import_users.return_value = SimpleNamespace(errors=[SimpleNamespace(index=2, reason='PHONE_NUMBER_EXISTS')])
+
+        results = {r['row']: r for r in firebase.bulk_create_users(self.rows())}
+
+        self.assertEqual(results[1]['status'], 'created')
+        self.assertEqual((results[3]['status'], results[3]['error']), ('error', 'PHONE_NUMBER_EXISTS'))
+        self.assertNotIn('uid', results[3])
+        # Só a reserva do telefone falhou: o perfil foi gravado
+        self.assertEqual(results[2]['status'], 'error')
+        self.assertIn(firebase.PHONE_INDEX_COLLECTION, results[2]['error'])
+        self.assertNotIn('perfil', results[2]['error'])
+        self.assertIn(results[2]['uid'], self.fake.data['users'])
+        self.assertEqual(len(self.fake.data['users']), 2)
+
+    def test_profile_write_failures_are_retried_then_reported(self):
+        commit = self.fake._commit
+        attempts = []
+
+        def failing_profile_commit(writes, reads=None, count_rpc=True):
+            if writes[0][1]._collection_path == 'users':
+                attempts.append(writes[0][1].id)
+                raise NotFound('users indisponível')
+            return commit(writes, reads, count_rpc)
+
+        with mock.patch.object(self.fake, '_commit', side_effect=failing_profile_commit):
+            results = firebase.bulk_create_users(self.rows()[:1])
+
+        [result] = results
+        self.assertEqual(result['status'], 'error')
+        self.assertIn('o perfil não foi gravado', result['error'])
+        self.assertNotIn(firebase.PHONE_INDEX_COLLECTION, result['error'])
+        self.assertEqual(len(attempts), firebase.BULK_WRITE_MAX_ATTEMPTS)
+        self.assertEqual(self.fake.data['phone_index']['841111111']['uids'], [result['uid']])
+
+    def test_endpoint_rejects_non_object_items(self):
+        client = APIClient()
+        client.force_authenticate(CustomUser.objects.create(username='admin', email='a@example.com', is_staff=True))
+
+        for body in ([{'telefone': '841111111'}, 'x'], [1], {'clients': [None]}):
+            with self.subTest(body=body):
+                response = client.post('/api/client/register/bulk/', body, format='json')
+                self.assertEqual(response.status_code, 400)
+        self.import_users.assert_not_called()
+
+
+class PhoneIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        firebase._user_cache().clear()
+        self.fake = MemoryFirestore({
+            'users': {'u1': {'telefone': '841111111', 'name': 'Ana'}},
+            'phone_index': {'841111111': {'uids': ['u1']}},
+        })
+        patcher = mock.patch.multiple(firebase, db=self.fake, PHONE_INDEX_COMPLETE=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_create_user_reserves_phone_with_one_read_and_one_commit(self):
+        with mock.patch.object(firebase.auth, 'create_user', return_value=mock.Mock(uid='u2')):
+            user = firebase.create_user({'telefone': '842222222', 'name': 'Rui'})
+
+        self.assertEqual(user['id'], 'u2')
+        self.assertEqual(self.fake.rpc_count, 2)
+        self.assertEqual(self.fake.data['phone_index']['842222222']['uids'], ['u2'])
+
+    def test_create_user_rejects_indexed_phone_before_touching_auth(self):
+        with mock.patch.object(firebase.auth, 'create_user') as create_auth_user:
+            with self.assertRaises(ValueError):
+                firebase.create_user({'telefone': '841111111'})
+        create_auth_user.assert_not_called()
+
+    def test_concurrent_signup_loses_the_race_and_rolls_back_auth(self):
+        def other_signup_wins(**kwargs):
+            self.fake.data['phone_index']['842222222'] = {'uids': ['other']}
+            return mock.Mock(uid='u2')
+
+        with mock.patch.object(firebase.auth, 'create_user', side_effect=other_signup_wins), \
+                mock.patch.object(firebase.auth, 'delete_user') as delete_auth_user:
+            with self.assertRaises(ValueError):
+                firebase.create_user({'telefone': '842222222'})
+
+        delete_auth_user.assert_called_once_with('u2')
+        self.assertNotIn('u2', self.fake.data['users'])
+
+    def test_phone_change_checks_legacy_users_until_the_index_is_complete(self):
+        # Usuário antigo, ainda sem reserva em phone_index
+        self.fake.data['users']['u0'] = {'telefone': '843333333', 'name': 'Eva'}
+
+        with mock.patch.object(firebase, 'PHONE_INDEX_COMPLETE', False):
+            with self.assertRaises(ValueError):
+                firebase.update_user('u1', {'telefone': '843333333'})
+            self.assertEqual(self.fake.data['users']['u1']['telefone'], '841111111')
+            self.assertNotIn('843333333', self.fake.data['phone_index'])
+
+            firebase.update_user('u1', {'telefone': '844444444'})
+
+        self.assertEqual(self.fake.data['users']['u1']['telefone'], '844444444')
+        self.assertEqual(self.fake.data['phone_index']['844444444']['uids'], ['u1'])
+        self.assertNotIn('841111111', self.fake.data['phone_index'])
+
+    def test_phone_change_keeps_uids_added_to_the_old_entry_concurrently(self):
+        get_all = self.fake.get_all
+        reads = []
+
+        def concurrent_signup(references, **kwargs):
+            snapshots = list(get_all(references, **kwargs))
+            if not reads:
+                # Outro cadastro partilha o número antigo entre a leitura e o commit
+                self.fake.collection('phone_index').document('841111111').set({'uids': ['u1', 'u9']})
+            reads.append(1)
+            return iter(snapshots)
+
+        with mock.patch.object(self.fake, 'get_all', side_effect=concurrent_signup):
+            result = firebase.update_user('u1', {'telefone': '842222222'})
+
+        self.assertEqual(len(reads), 2)
+        self.assertIn('updateTime', result)
+        self.assertEqual(self.fake.data['phone_index']['841111111']['uids'], ['u9'])
+        self.assertEqual(self.fake.data['phone_index']['842222222']['uids'], ['u1'])
+
+    def test_phone_change_to_a_reserved_number_writes_nothing(self):
+        self.fake.data['phone_index']['842222222'] = {'uids': ['u2']}
+
+        with self.assertRaises(ValueError):
+            firebase.update_user('u1', {'telefone': '842222222'})
+
+        self.assertEqual(self.fake.data['users']['u1']['telefone'], '841111111')
+        self.assertEqual(self.fake.data['phone_index']['841111111']['uids'], ['u1'])
+
+    def test_phone_lookup_goes_through_the_index(self):
+        users = firebase.get_users_by_telefone('841111111')
+        missing = firebase.get_users_by_telefone('849999999')
+
+        self.assertEqual([u['id'] for u in users], ['u1'])
+        self.assertEqual(missing, [])
+        # 2 leituras por chave no índice + 1 get_all, sem queries na coleção
+        self.assertEqual(self.fake.rpc_count, 3)
+
+
+class FirebaseBenchmarkCommandTests(TestCase):
+
+    def test_report_has_counters_for_every_operation(self):
+        out = StringIO()
+        call_command('benchmark_firebase', users=40, ranking_rows=30, transactions=15, repeat=1, stdout=out)
+
+        report = json.loads(out.getvalue())
+        results = report['results']
+        self.assertEqual(set(results), {
+            'get_all_users', 'count_users', 'get_current_ranking',
+            'ranking_stats', 'unified_transactions', 'update_user_ranking_points',
+        })
+        self.assertEqual((results['get_all_users']['rpcs'], results['get_all_users']['docs_read']), (1, 40))
+        self.assertEqual(results['count_users']['rpcs'], 1)
+        self.assertEqual(results['update_user_ranking_points']['rpcs'], 3)
+        self.assertEqual(results['unified_transactions']['docs_read'], 15)
+        self.assertGreater(results['get_all_users']['peak_memory_kb'], 0)
+        # Os dados gerados não ficam na base nem no backend configurado
+        self.assertFalse(Transaction.objects.exists())
+        self.assertNotIn('memory', backends._clients)
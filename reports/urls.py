@@ -3,21 +3,27 @@ from .views import (
     unified_transactions,
     list_firebase_users,
     firebase_user_count,
+    firebase_user_cache_stats,
+    request_metrics,
     filter_users_by_phone,
     update_user_by_id,
     update_user_by_phone_view,
-    register_user
+    register_user,
+    register_users_bulk
 )
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path('transactions/', unified_transactions),
     path('clients/', list_firebase_users),
     path('clients/count/', firebase_user_count),
+    path('clients/cache-stats/', firebase_user_cache_stats),
+    path('metrics/', request_metrics, name='request-metrics'),
     path('clients/filter/', filter_users_by_phone),
-    path('clients/<str:user_id>/', update_user_by_id),
     path('clients/byPhone/', update_user_by_phone_view),
+    path('clients/<str:user_id>/', update_user_by_id),
     path('client/register/', register_user),   
+    path('client/register/bulk/', register_users_bulk),
 
 
  # 🔥 NOVAS URLs DE RANKING
@@ -26,6 +32,7 @@ urlpatterns = [
     path('ranking/previous-winners/', views.previous_winners, name='previous-winners'),
     path('ranking/stats/', views.ranking_stats, name='ranking-stats'),
     path('ranking/snapshot/', views.create_ranking_snapshot, name='create-ranking-snapshot'),
+    path('ranking/snapshot/<str:month>/', views.ranking_snapshot_status, name='ranking-snapshot-status'),
     path('ranking/users/', views.ranking_users_list, name='ranking-users-list'),
     
     # 🔥 URLs DE USUÁRIOS ESPECÍFICOS
@@ -33,6 +40,12 @@ urlpatterns = [
     path('users/<str:user_id>/update-ranking/', views.update_user_ranking_view, name='update-user-ranking'),
     path('users/<str:user_id>/add-ranking-points/', views.add_ranking_points, name='add-ranking-points'),
     
+    # 🔥 VERSÕES ASSÍNCRONAS (ASGI, firestore.AsyncClient)
+    path('async/clients/', async_views.list_firebase_users, name='async-clients'),
+    path('async/ranking/dashboard/', async_views.ranking_dashboard, name='async-ranking-dashboard'),
+    path('async/ranking/current/', async_views.current_ranking, name='async-current-ranking'),
+    path('async/ranking/stats/', async_views.ranking_stats, name='async-ranking-stats'),
+    path('async/users/<str:user_id>/details/', async_views.user_details, name='async-user-details'),
     
     # URLs para gerenciar vídeos
     path('videos/', views.list_videos, name='list_videos'),
@@ -1,7 +1,24 @@
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from .models import Transaction
-from datetime import datetime
+from rest_framework.utils.encoders import JSONEncoder
+from .models import RankingSnapshotJob, Transaction
+from .importers import import_clients, parse_client_rows
+from .pagination import decode_cursor, encode_cursor, parse_page_size
+from . import ranking_queue
+from .snapshots import job_status, start_ranking_stats_job, start_snapshot_job
+from .response_cache import cached_response, invalidate_tags
+from .etags import clients_etag, current_ranking_etag, transactions_etag, videos_etag
+from .metrics import render_prometheus
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from contextvars import copy_context
+from datetime import datetime, time, timedelta
+from time import monotonic
 import logging
 logger = logging.getLogger(__name__)
 
@@ -9,7 +26,10 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 
 from .firebase import (
-    get_all_users,
+    get_users_by_ids,
+    get_users_page,
+    get_user_cache_stats,
+    iter_users,
     count_users,
     get_users_by_telefone,
     update_user,
@@ -18,29 +38,85 @@ from .firebase import (
     
     # 🔥 NOVAS FUNÇÕES DE RANKING
     get_ranking_users,
+    get_ranking_distribution,
     get_current_ranking,
     get_previous_month_winners,
     count_ranking_users,
     get_user_details,
     update_user_ranking,
-    update_user_ranking_points,
-    save_monthly_ranking_snapshot
+    update_user_ranking_points
 )
 
 
 
+TRANSACTION_FILTERS = ('status', 'provider', 'category')
+
+
+def _parse_date_param(request, name):
+    """
+    Lê um parâmetro de data (YYYY-MM-DD) da query string.
+    """
+    value = request.GET.get(name)
+    if not value:
+        return None
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(f'Parâmetro "{name}" deve estar no formato YYYY-MM-DD.')
+    return parsed
+
+
 @api_view(['GET'])
+@transactions_etag
 def unified_transactions(request):
     """
     Endpoint que devolve transações (MySQL) + dados de usuários (Firebase).
+    Paginação por cursor sobre (created_at, id), da mais recente para a mais antiga.
+    Exemplo de uso:
+    /api/transactions/?page_size=50&status=pago&provider=mpesa&date_from=2025-09-01&date_to=2025-09-30
+    /api/transactions/?cursor=<next da página anterior>
     """
-    users = get_all_users()
-    user_dict = { u['id']: u for u in users }
-
-    transactions = Transaction.objects.all()
+    try:
+        page_size = parse_page_size(request.GET.get('page_size'))
+        date_from = _parse_date_param(request, 'date_from')
+        date_to = _parse_date_param(request, 'date_to')
+        cursor = request.GET.get('cursor')
+        position = decode_cursor(cursor) if cursor else None
+        cursor_created_at = parse_datetime(position['created_at']) if position else None
+        cursor_id = int(position['id']) if position else None
+        if position and cursor_created_at is None:
+            raise ValueError('Cursor inválido.')
+    except (ValueError, KeyError, TypeError):
+        return Response({'error': 'Parâmetros de paginação ou filtro inválidos.'}, status=400)
+
+    transactions = Transaction.objects.order_by('-created_at', '-id')
+
+    for field in TRANSACTION_FILTERS:
+        value = request.GET.get(field)
+        if value:
+            transactions = transactions.filter(**{field: value})
+
+    if date_from:
+        transactions = transactions.filter(
+            created_at__gte=timezone.make_aware(datetime.combine(date_from, time.min))
+        )
+    if date_to:
+        transactions = transactions.filter(
+            created_at__lt=timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min))
+        )
+
+    if position:
+        transactions = transactions.filter(
+            Q(created_at__lt=cursor_created_at) |
+            Q(created_at=cursor_created_at, id__lt=cursor_id)
+        )
+
+    page = list(transactions[:page_size])
+
+    # Busca apenas as carteiras desta página, num único get_all
+    user_dict = get_users_by_ids((str(t.wallet_id) for t in page), chunk_size=page_size)
 
     result = []
-    for t in transactions:
+    for t in page:
         user_info = user_dict.get(str(t.wallet_id), {})
         result.append({
             'id': t.id,
@@ -57,16 +133,62 @@ def unified_transactions(request):
             'user': user_info
         })
 
-    return Response(result)
+    next_cursor = None
+    if len(page) == page_size:
+        last = page[-1]
+        next_cursor = encode_cursor({'created_at': last.created_at.isoformat(), 'id': last.id})
+
+    return Response({
+        'results': result,
+        'next': next_cursor,
+        'page_size': page_size
+    })
+
+
+def _ndjson_stream(rows):
+    """
+    Serializa cada registo numa linha JSON à medida que o iterador os produz.
+    """
+    encoder = JSONEncoder(ensure_ascii=False)
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+def _is_stream_request(request):
+    return request.GET.get('stream') in ('1', 'true')
 
 
 @api_view(['GET'])
+@clients_etag
+@cached_response('list_firebase_users', tags=('users',), skip_if=_is_stream_request)
 def list_firebase_users(request):
     """
-    Endpoint que devolve todos os usuários do Firebase.
+    Endpoint que devolve os usuários do Firebase paginados por cursor.
+    Exemplo de uso:
+    /api/clients/?page_size=100&cursor=<next da página anterior>
+    /api/clients/?stream=true  (todos os usuários em NDJSON, memória constante)
     """
-    users = get_all_users()
-    return Response(users)
+    if _is_stream_request(request):
+        return StreamingHttpResponse(
+            _ndjson_stream(iter_users()),
+            content_type='application/x-ndjson'
+        )
+
+    try:
+        page_size = parse_page_size(request.GET.get('page_size'))
+        cursor = request.GET.get('cursor')
+        start_after = decode_cursor(cursor).get('id') if cursor else None
+    except ValueError as ve:
+        return Response({'error': str(ve)}, status=400)
+
+    users = get_users_page(page_size, start_after)
+    next_cursor = encode_cursor({'id': users[-1]['id']}) if len(users) == page_size else None
+
+    return Response({
+        'results': users,
+        'next': next_cursor,
+        'page_size': page_size
+    })
 
 
 @api_view(['GET'])
@@ -78,6 +200,24 @@ def firebase_user_count(request):
     return Response({ 'total_users': total })
 
 
+@api_view(['GET'])
+def firebase_user_cache_stats(request):
+    """
+    Endpoint que devolve os acertos/falhas do cache de usuários do Firebase.
+    """
+    return Response(get_user_cache_stats())
+
+
+@api_view(['GET'])
+def request_metrics(request):
+    """
+    Endpoint com os histogramas por endpoint (RPCs ao Firestore, documentos,
+    SQL, serialização) no formato de texto do Prometheus. Valores do processo
+    que responde: com vários workers, cada um tem os seus.
+    """
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @api_view(['GET'])
 def filter_users_by_phone(request):
     """
@@ -98,51 +238,102 @@ def update_user_by_id(request, user_id):
     """
     PATCH /api/users/<user_id>/
     Body: JSON com campos a atualizar
+    ?fresh=true relê o documento no Firebase depois da escrita.
     """
     data = request.data
-    print(f"[DEBUG] Dados recebidos no request: {data}")
+    logger.debug("Dados recebidos no request: %s", data)
 
     if not data:
         return Response({'error': 'Nenhum dado enviado.'}, status=400)
 
     try:
-        updated_user_data = update_user(user_id, data)
+        fresh = request.GET.get('fresh') in ('1', 'true')
+        updated_user_data = update_user(user_id, data, fresh=fresh)
+        invalidate_tags('users')
         return Response(updated_user_data)
+    except ValueError as ve:
+        return Response({'error': str(ve)}, status=400)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
     
 
 
-# @api_view(['PATCH'])
+@api_view(['PATCH'])
 def update_user_by_phone_view(request):
     """
     Atualiza atributos de usuários no Firebase pelo campo 'telefone'.
+    ?dry_run=true apenas lista os documentos (e campos) que seriam alterados.
+    ?fresh=true relê os documentos no Firebase depois da escrita.
     """
     telefone = request.data.get('telefone')
-    print(f"[DEBUG] Telefone recebido para atualização: {telefone}")
+    logger.debug("Telefone recebido para atualização: %s", telefone)
 
     if not telefone:
         return Response({'error': 'Campo "telefone" é obrigatório.'}, status=400)
 
     # Remove 'telefone' dos dados a atualizar
     update_data = {k: v for k, v in request.data.items() if k != 'telefone'}
-    print(f"[DEBUG] Dados para atualização: {update_data}")
+    logger.debug("Dados para atualização: %s", update_data)
 
     if not update_data:
         return Response({'error': 'Nenhum dado para atualizar.'}, status=400)
 
+    dry_run = request.GET.get('dry_run') in ('1', 'true')
+    fresh = request.GET.get('fresh') in ('1', 'true')
+
     try:
-        updated_users = update_user_by_phone(telefone, update_data)
+        updated_users = update_user_by_phone(telefone, update_data, fresh=fresh, dry_run=dry_run)
+        if dry_run:
+            return Response({
+                'message': 'Simulação: nenhum usuário foi alterado.',
+                'dry_run': True,
+                'users': updated_users
+            })
+        invalidate_tags('users')
         return Response({
             'message': 'Usuário(s) atualizado(s) com sucesso.',
             'users': updated_users
         })
 
     except ValueError as ve:
-        print(f"[DEBUG] Erro de valor: {str(ve)}")
         return Response({'error': str(ve)}, status=404)
     except Exception as e:
-        print(f"[DEBUG] Erro inesperado: {str(e)}")
+        logger.exception("Erro ao atualizar usuários por telefone")
+        return Response({'error': str(e)}, status=500)
+
+
+@api_view(['POST'])
+def register_users_bulk(request):
+    """
+    POST /api/client/register/bulk/
+    Registra clientes em lote. Aceita um ficheiro CSV ou JSON no campo 'file'
+    (multipart) ou um corpo JSON com a lista de clientes ({"clients": [...]}).
+    Devolve o resultado de cada linha e um resumo com o tempo e o débito.
+    """
+    try:
+        upload = request.FILES.get('file')
+        if upload:
+            fmt = 'json' if upload.name.lower().endswith('.json') else 'csv'
+            rows = parse_client_rows(upload.read(), fmt)
+        else:
+            data = request.data
+            rows = data if isinstance(data, list) else data.get('clients') if isinstance(data, dict) else None
+            if not isinstance(rows, list):
+                raise ValueError('Envie um ficheiro no campo "file" ou uma lista em "clients".')
+            if not all(isinstance(row, dict) for row in rows):
+                raise ValueError('Cada cliente da lista deve ser um objeto JSON.')
+    except ValueError as ve:
+        return Response({'error': str(ve)}, status=400)
+
+    if not rows:
+        return Response({'error': 'Nenhum cliente para registar.'}, status=400)
+
+    try:
+        report = import_clients(rows)
+        invalidate_tags('users')
+        return Response(report)
+    except Exception as e:
+        logger.exception("Erro no cadastro em lote")
         return Response({'error': str(e)}, status=500)
 
 
@@ -154,6 +345,7 @@ def register_user(request):
     """
     try:
         user = create_user(request.data)
+        invalidate_tags('users')
         return Response({"message": "Usuário registrado com sucesso!", "user": user}, status=201)
     except ValueError as ve:
         return Response({"error": str(ve)}, status=400)
@@ -194,57 +386,131 @@ def register_user(request):
 #         return Response({'error': str(e)}, status=500)
 
 @api_view(['GET'])
+@cached_response(
+    'ranking_dashboard',
+    tags=('ranking', 'users'),
+    # Respostas parciais não ficam em cache
+    cacheable=lambda response: response.data.get('status') == 'success'
+)
 def ranking_dashboard(request):
     """
     Endpoint SIMPLIFICADO para produção - apenas dados essenciais
+    As secções são lidas em paralelo, cada uma com o seu prazo; as que falham
+    ou passam do prazo ficam com o valor vazio e o estado em 'sections'.
     """
-    try:
-        # Apenas dados críticos para o dashboard
-        total_ranking_users = count_ranking_users()
-        total_users = count_users()
-        
+    sections = _run_dashboard_sections({
+        'total_ranking_users': count_ranking_users,
+        'total_users': count_users,
         # Ranking apenas top 10 para performance
-        current_ranking = get_current_ranking(limit=10)
-        
+        'current_ranking': lambda: get_current_ranking(limit=10),
         # Vencedores anteriores (limitado)
-        previous_winners = get_previous_month_winners()[:5]  # Apenas top 5
-        
-        return Response({
-            'total_ranking_users': total_ranking_users,
-            'total_users': total_users,
-            'current_ranking': current_ranking,
-            'previous_winners': previous_winners,
-            'ranking_percentage': round((total_ranking_users / total_users * 100), 2) if total_users > 0 else 0,
-            'status': 'success',
-            'performance_optimized': True
-        })
-        
-    except Exception as e:
-        # Fallback básico se houver erro
-        return Response({
-            'total_ranking_users': 0,
-            'total_users': 0,
-            'current_ranking': [],
-            'previous_winners': [],
-            'ranking_percentage': 0,
-            'status': 'fallback',
-            'error': str(e)
-        }, status=200)  # Sempre retorna 200 mesmo com erro
+        'previous_winners': lambda: get_previous_month_winners()[:5],  # Apenas top 5
+    })
+    
+    data = {name: section.pop('value') for name, section in sections.items()}
+    total_ranking_users = data['total_ranking_users']
+    total_users = data['total_users']
+    completo = all(section['status'] == 'ok' for section in sections.values())
+    
+    # Sempre retorna 200, mesmo com secções em falta
+    return Response({
+        **data,
+        'ranking_percentage': round((total_ranking_users / total_users * 100), 2) if total_users > 0 else 0,
+        'status': 'success' if completo else 'partial',
+        'sections': sections,
+        'performance_optimized': True
+    })
+
+
+# Valor de cada secção do dashboard quando falha ou passa do prazo
+DASHBOARD_DEFAULTS = {
+    'total_ranking_users': 0,
+    'total_users': 0,
+    'current_ranking': [],
+    'previous_winners': [],
+}
+
+# Prazo (segundos) de cada secção, contado a partir do início do pedido
+DASHBOARD_DEADLINES = getattr(settings, 'RANKING_DASHBOARD_DEADLINES', {
+    'total_ranking_users': 2,
+    'total_users': 2,
+    'current_ranking': 4,
+    'previous_winners': 4,
+})
+
+# Pool partilhado pelos pedidos: limita as leituras simultâneas ao Firestore.
+# Uma secção que passa do prazo continua a ocupar o seu worker até terminar.
+_dashboard_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'RANKING_DASHBOARD_WORKERS', 8),
+    thread_name_prefix='ranking-dashboard'
+)
+
+
+def _timed_section(function):
+    inicio = monotonic()
+    try:
+        return function(), monotonic() - inicio
+    finally:
+        # Como no fim de um pedido: liberta a ligação à base de dados desta thread
+        close_old_connections()
+
+
+def _run_dashboard_sections(functions):
+    """
+    Executa as secções em paralelo e devolve {nome: {'value', 'status', 'elapsed_ms'}}.
+    status: 'ok', 'timeout' ou 'error' (com a mensagem em 'error').
+    """
+    inicio = monotonic()
+    # copy_context: as métricas do pedido (reports.metrics) seguem para as threads
+    futures = {
+        name: _dashboard_executor.submit(copy_context().run, _timed_section, function)
+        for name, function in functions.items()
+    }
+    
+    sections = {}
+    for name, future in futures.items():
+        prazo = DASHBOARD_DEADLINES.get(name, 5)
+        restante = max(0, prazo - (monotonic() - inicio))
+        try:
+            value, elapsed = future.result(timeout=restante)
+            sections[name] = {'value': value, 'status': 'ok', 'elapsed_ms': round(elapsed * 1000, 1)}
+        except FuturesTimeoutError:
+            future.cancel()
+            sections[name] = {'value': DASHBOARD_DEFAULTS.get(name), 'status': 'timeout', 'elapsed_ms': prazo * 1000}
+        except Exception as e:
+            logger.warning("Secção %s do dashboard falhou: %s", name, e)
+            sections[name] = {
+                'value': DASHBOARD_DEFAULTS.get(name),
+                'status': 'error',
+                'error': str(e),
+                'elapsed_ms': round((monotonic() - inicio) * 1000, 1)
+            }
+    
+    return sections
         
         
+def _ranking_month(request):
+    # As respostas do ranking mensal não passam para o mês seguinte
+    return datetime.now().strftime('%Y-%m')
+
+
 @api_view(['GET'])
+@current_ranking_etag
+@cached_response('current_ranking', tags=('ranking',), vary=_ranking_month)
 def current_ranking(request):
     """
     Endpoint que retorna apenas o ranking atual
     """
     try:
         limit = request.GET.get('limit', 50)
-        ranking = get_current_ranking(limit=int(limit))
+        offset = request.GET.get('offset', 0)
+        ranking = get_current_ranking(limit=int(limit), offset=int(offset))
         return Response(ranking)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
 @api_view(['GET'])
+@cached_response('previous_winners', tags=('ranking',), vary=_ranking_month)
 def previous_winners(request):
     """
     Endpoint que retorna os vencedores do mês anterior
@@ -279,6 +545,7 @@ def update_user_ranking_view(request, user_id):
         premiado = request.data.get('premiado')
         
         updated_user = update_user_ranking(user_id, pontos, nivel, premiado)
+        invalidate_tags('ranking')
         return Response(updated_user)
         
     except Exception as e:
@@ -296,6 +563,19 @@ def add_ranking_points(request, user_id):
         if points <= 0:
             return Response({'error': 'Pontos devem ser maiores que zero'}, status=400)
         
+        if ranking_queue.write_behind_enabled():
+            # Aceita já; o worker flush_ranking_queue grava no Firestore
+            idempotency_key = request.headers.get('Idempotency-Key') or request.data.get('idempotency_key')
+            delta, created = ranking_queue.enqueue_points(user_id, points, exam_data, idempotency_key)
+            invalidate_tags('ranking')
+            return Response({
+                'message': 'Pontos registados para gravação' if created else 'Pedido já registado',
+                'points_added': delta.points,
+                'queued': True,
+                'idempotency_key': delta.idempotency_key
+            }, status=202)
+        
+        # update_user_ranking_points já incrementa a versão da tag 'ranking'
         updated_user = update_user_ranking_points(user_id, points, exam_data)
         
         if updated_user is None:
@@ -316,38 +596,30 @@ def add_ranking_points(request, user_id):
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
+def _distribution_rebuilt(response):
+    # Contadores ainda por reconstruir não ficam em cache
+    return not response.data.get('distribution_stale')
+
+
 @api_view(['GET'])
+@cached_response('ranking_stats', tags=('ranking', 'users'), vary=_ranking_month, cacheable=_distribution_rebuilt)
 def ranking_stats(request):
     """
     Endpoint que retorna estatísticas do ranking - CORRIGIDA
+    Enquanto os contadores do mês não forem reconstruídos a distribuição vem
+    com distribution_stale=true e a reconstrução fica agendada em segundo plano.
     """
     try:
+        current_month = datetime.now().strftime('%Y-%m')
         total_ranking_users = count_ranking_users()
         total_users = count_users()
         
-        # Obter distribuição por nível e província dos usuários do ranking
-        ranking_users = get_current_ranking(limit=1000)  # Busca todos para estatísticas
-        
-        niveis = {}
-        provincias = {}
-        
-        for user_data in ranking_users:
-            # Distribuição por nível (baseado em pontos)
-            pontos = user_data.get('points', user_data.get('ranking_points', 0))
-            if pontos >= 100:
-                nivel = "Expert"
-            elif pontos >= 50:
-                nivel = "Avançado"
-            elif pontos >= 20:
-                nivel = "Intermediário"
-            else:
-                nivel = "Iniciante"
-            
-            niveis[nivel] = niveis.get(nivel, 0) + 1
-            
-            # Distribuição por província
-            provincia = user_data.get('provincia', 'Não informada')
-            provincias[provincia] = provincias.get(provincia, 0) + 1
+        # Distribuição por nível e província mantida em ranking_stats/<mês>
+        distribution = get_ranking_distribution(current_month)
+        if not distribution['rebuilt']:
+            start_ranking_stats_job(current_month)
+        niveis = distribution.get('levels', {})
+        provincias = distribution.get('provinces', {})
         
         return Response({
             'total_ranking_users': total_ranking_users,
@@ -355,7 +627,8 @@ def ranking_stats(request):
             'ranking_percentage': round((total_ranking_users / total_users * 100), 2) if total_users > 0 else 0,
             'distribution_by_level': niveis,
             'distribution_by_province': provincias,
-            'current_month': datetime.now().strftime('%Y-%m')
+            'distribution_stale': not distribution['rebuilt'],
+            'current_month': current_month
         })
         
     except Exception as e:
@@ -364,16 +637,29 @@ def ranking_stats(request):
 def create_ranking_snapshot(request):
     """
     Endpoint para criar um snapshot do ranking (usar no final do mês)
+    O snapshot corre em segundo plano; acompanhe em ranking/snapshot/<mês>/.
+    ?force=true repete um snapshot já concluído.
     """
     try:
-        snapshot = save_monthly_ranking_snapshot()
+        force = request.query_params.get('force', '').lower() in ('1', 'true', 'yes')
+        job, started = start_snapshot_job(force=force)
         return Response({
-            'message': 'Snapshot do ranking criado com sucesso',
-            'snapshot': snapshot
-        })
+            'message': 'Snapshot do ranking agendado' if started else 'Snapshot do mês já existe',
+            'job': job_status(job)
+        }, status=202 if started else 200)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
+@api_view(['GET'])
+def ranking_snapshot_status(request, month):
+    """
+    Estado do snapshot do ranking de um mês (YYYY-MM)
+    """
+    job = RankingSnapshotJob.objects.filter(kind=RankingSnapshotJob.KIND_SNAPSHOT, month=month).first()
+    if job is None:
+        return Response({'error': 'Nenhum snapshot para este mês'}, status=404)
+    return Response(job_status(job))
+
 @api_view(['GET'])
 def ranking_users_list(request):
     """
@@ -432,7 +718,7 @@ def create_video(request):
         if serializer.is_valid():
             # Se este vídeo for marcado como ativo, desativa os outros
             if serializer.validated_data.get('active', False):
-                Video.objects.filter(active=True).update(active=False)
+                Video.objects.filter(active=True).update(active=False, updated_at=timezone.now())
             
             serializer.save()
             return Response(serializer.data, status=201)
@@ -462,7 +748,7 @@ def set_active_video(request, video_id):
     """
     try:
         # Desativa todos os vídeos primeiro
-        Video.objects.filter(active=True).update(active=False)
+        Video.objects.filter(active=True).update(active=False, updated_at=timezone.now())
         
         # Ativa o vídeo específico
         video = Video.objects.get(id=video_id)
@@ -477,6 +763,7 @@ def set_active_video(request, video_id):
         return Response({'error': str(e)}, status=500)
 
 @api_view(['GET'])
+@videos_etag
 def list_videos(request):
     """
     Endpoint que retorna todos os vídeos
@@ -0,0 +1,172 @@
+# users/activities.py
+import atexit
+import logging
+from datetime import timedelta
+from threading import Lock, Timer
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import UserActivity, UserActivityArchive
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_RETENTION_DAYS = getattr(settings, 'USER_ACTIVITY_RETENTION_DAYS', 180)
+ACTIVITY_ARCHIVE_CHUNK_SIZE = 1000
+
+# Buffer de log_activity: grava quando junta BUFFER_SIZE eventos ou, no
+# máximo, FLUSH_INTERVAL segundos depois do primeiro evento pendente
+ACTIVITY_BUFFER_SIZE = getattr(settings, 'USER_ACTIVITY_BUFFER_SIZE', 100)
+ACTIVITY_FLUSH_INTERVAL = getattr(settings, 'USER_ACTIVITY_FLUSH_INTERVAL', 2)
+
+_TITLE_MAX_LENGTH = UserActivity._meta.get_field('title').max_length
+_ICON_MAX_LENGTH = UserActivity._meta.get_field('icon').max_length
+
+
+def activity_log_async_enabled():
+    """
+    False grava cada atividade logo em log_activity (útil nos testes).
+    """
+    return getattr(settings, 'USER_ACTIVITY_LOG_ASYNC', True)
+
+
+class ActivityBuffer:
+    """
+    Fila de atividades por processo, gravada com bulk_create. Um pedido só
+    acrescenta à fila; a gravação acontece quando a fila enche (na thread de
+    quem a encheu) ou num Timer em segundo plano. Eventos ainda na fila
+    perdem-se se o processo morrer sem passar pelo atexit.
+    """
+
+    def __init__(self, size=ACTIVITY_BUFFER_SIZE, interval=ACTIVITY_FLUSH_INTERVAL):
+        self.size = size
+        self.interval = interval
+        self._lock = Lock()
+        self._pending = []
+        self._timer = None
+
+    def add(self, activity):
+        with self._lock:
+            self._pending.append(activity)
+            full = len(self._pending) >= self.size
+            if not full and self._timer is None:
+                self._timer = Timer(self.interval, self._flush_in_background)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """
+        Grava as atividades pendentes num único bulk_create. Devolve quantas gravou.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+
+        try:
+            UserActivity.objects.bulk_create(pending, batch_size=self.size)
+        except Exception:
+            logger.exception("Falha ao gravar %s atividades de usuários", len(pending))
+            return 0
+        return len(pending)
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            # Liberta a ligação à base de dados aberta nesta thread
+            connections.close_all()
+
+
+activity_buffer = ActivityBuffer()
+atexit.register(activity_buffer.flush)
+
+
+def log_activity(user, title, description='', icon='', date=None):
+    """
+    Regista uma atividade (auditoria) de um usuário sem um INSERT por evento.
+    'user' pode ser o objeto ou o ID. Dentro de uma transação, o evento só
+    entra na fila depois do commit (num rollback não é registado).
+    """
+    activity = UserActivity(
+        user_id=getattr(user, 'pk', user),
+        title=title[:_TITLE_MAX_LENGTH],
+        description=description,
+        icon=icon[:_ICON_MAX_LENGTH],
+        date=date or timezone.now(),
+    )
+
+    if not activity_log_async_enabled():
+        activity.save()
+        return activity
+
+    transaction.on_commit(lambda: activity_buffer.add(activity))
+    return activity
+
+
+def archive_cutoff(days=None):
+    """
+    Data a partir da qual as atividades ficam na tabela principal.
+    """
+    return timezone.now() - timedelta(days=ACTIVITY_RETENTION_DAYS if days is None else days)
+
+
+def _month_of(value):
+    return timezone.localtime(value).date().replace(day=1)
+
+
+def archive_chunk(older_than, chunk_size=ACTIVITY_ARCHIVE_CHUNK_SIZE):
+    """
+    Move um bloco de atividades anteriores a 'older_than' para o arquivo mensal,
+    numa única transação (arquiva e apaga, ou nada). Devolve quantas moveu.
+    """
+    with transaction.atomic():
+        rows = list(
+            UserActivity.objects.filter(date__lt=older_than)
+            .order_by('id')
+            .values('id', 'user_id', 'date', 'title', 'description', 'icon')[:chunk_size]
+        )
+        if not rows:
+            return 0
+
+        groups = {}
+        for row in sorted(rows, key=lambda row: (row['date'], row['id'])):
+            key = (row['user_id'], _month_of(row['date']))
+            groups.setdefault(key, []).append(
+                [timezone.localtime(row['date']).isoformat(), row['title'], row['description'], row['icon']]
+            )
+
+        user_ids = {user_id for user_id, _ in groups}
+        months = {month for _, month in groups}
+        existing = {
+            (archive.user_id, archive.month): archive
+            for archive in UserActivityArchive.objects.select_for_update().filter(user_id__in=user_ids, month__in=months)
+        }
+
+        to_create = []
+        to_update = []
+        for (user_id, month), entries in groups.items():
+            archive = existing.get((user_id, month))
+            if archive is None:
+                to_create.append(UserActivityArchive(user_id=user_id, month=month, total=len(entries), entries=entries))
+            else:
+                archive.entries = sorted(archive.entries + entries)
+                archive.total = len(archive.entries)
+                archive.archived_at = timezone.now()
+                to_update.append(archive)
+
+        UserActivityArchive.objects.bulk_create(to_create)
+        UserActivityArchive.objects.bulk_update(to_update, ['entries', 'total', 'archived_at'])
+        UserActivity.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        return len(rows)
+
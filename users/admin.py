@@ -1,7 +1,7 @@
 # users/admin.py
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, Role, Permission, UserActivity
+from .models import CustomUser, Role, Permission, UserActivity, UserActivityArchive
 
 class CustomUserAdmin(UserAdmin):
     model = CustomUser
@@ -25,4 +25,5 @@ class CustomUserAdmin(UserAdmin):
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(Role)
 admin.site.register(Permission)
-admin.site.register(UserActivity)
\ No newline at end of file
+admin.site.register(UserActivity)
+admin.site.register(UserActivityArchive)
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from users import activities
+from users.models import UserActivity
+
+
+class Command(BaseCommand):
+    help = (
+        "Move as atividades de usuários mais antigas do que a retenção para o "
+        "arquivo mensal compacto (user_activity_archive), em blocos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=activities.ACTIVITY_RETENTION_DAYS,
+            help="Mantém na tabela principal apenas os últimos N dias (padrão: %(default)s)."
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=activities.ACTIVITY_ARCHIVE_CHUNK_SIZE,
+            help="Atividades movidas por transação (padrão: %(default)s)."
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Apenas conta as atividades que seriam arquivadas."
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 1 or options['chunk_size'] < 1:
+            raise CommandError("--days e --chunk-size devem ser maiores que zero.")
+
+        cutoff = activities.archive_cutoff(options['days'])
+
+        if options['dry_run']:
+            total = UserActivity.objects.filter(date__lt=cutoff).count()
+            self.stdout.write(f"{total} atividades anteriores a {cutoff:%Y-%m-%d} seriam arquivadas.")
+            return
+
+        total = 0
+        while True:
+            moved = activities.archive_chunk(cutoff, options['chunk_size'])
+            total += moved
+            if moved:
+                self.stdout.write(f"  {total} atividades arquivadas...")
+            if moved < options['chunk_size']:
+                break
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Arquivo atualizado: {total} atividades anteriores a {cutoff:%Y-%m-%d} movidas."
+        ))
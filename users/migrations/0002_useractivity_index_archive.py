@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserActivityArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('entries', models.JSONField(default=list)),
+                ('archived_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'user_activity_archive',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['user', 'date'], name='user_activity_user_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='useractivityarchive',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_archives', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='useractivityarchive',
+            constraint=models.UniqueConstraint(fields=('user', 'month'), name='user_activity_archive_user_month'),
+        ),
+    ]
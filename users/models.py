@@ -43,5 +43,32 @@ class UserActivity(models.Model):
     date = models.DateTimeField(default=timezone.now)
     icon = models.CharField(max_length=50, blank=True)
 
+    class Meta:
+        indexes = [
+            # Feed de atividades do usuário (filtro por user_id, ordem por date)
+            models.Index(fields=['user', 'date'], name='user_activity_user_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.title} - {self.user.username}"
+
+class UserActivityArchive(models.Model):
+    """
+    Atividades antigas de um usuário num mês, compactadas numa só linha
+    (ver 'manage.py archive_user_activities'). 'entries' guarda uma lista de
+    [date, title, description, icon], da mais antiga para a mais recente.
+    """
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='activity_archives')
+    month = models.DateField()  # primeiro dia do mês
+    total = models.PositiveIntegerField(default=0)
+    entries = models.JSONField(default=list)
+    archived_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'user_activity_archive'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month'], name='user_activity_archive_user_month'),
+        ]
+
     def __str__(self):
-        return f"{self.title} - {self.user.username}"
\ No newline at end of file
+        return f"{self.user_id} - {self.month:%Y-%m} ({self.total})"
@@ -0,0 +1,32 @@
+# users/pagination.py
+from rest_framework.pagination import CursorPagination
+
+
+class UserCursorPagination(CursorPagination):
+    """
+    Paginação por cursor da listagem de usuários: custo constante por página,
+    sem COUNT(*) nem OFFSET. A ordem vem do parâmetro 'ordering' (OrderingFilter)
+    ou, por padrão, dos mais recentes para os mais antigos; termina sempre em
+    '-id' para que empates (ex: ordering=status) tenham uma ordem estável entre páginas.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('-created_at', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        ordering = tuple(super().get_ordering(request, queryset, view))
+        if 'id' not in ordering and '-id' not in ordering:
+            ordering += ('-id',)
+        return ordering
+
+
+class ActivityCursorPagination(CursorPagination):
+    """
+    Feed de atividades de um usuário por (date, id), das mais recentes para
+    as mais antigas; usa o índice (user_id, date) de UserActivity.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-date', '-id')
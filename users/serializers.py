@@ -65,4 +65,21 @@ class CustomUserSerializer(serializers.ModelSerializer):
             instance.roles.set(roles)
         if permissions is not None:
             instance.permissions.set(permissions)
-        return instance
\ No newline at end of file
+        return instance
+
+class CustomUserListSerializer(serializers.ModelSerializer):
+    """
+    Versão compacta para a listagem: sem a lista de atividades, apenas a
+    contagem (activity_count, anotada na query do viewset).
+    """
+    roles = serializers.SlugRelatedField(many=True, slug_field='name', read_only=True)
+    permissions = serializers.SlugRelatedField(many=True, slug_field='name', read_only=True)
+    activity_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = CustomUser
+        fields = [
+            'id', 'username', 'name', 'email', 'phone', 'cpf', 'birth_date', 'address',
+            'status', 'avatar', 'roles', 'permissions', 'created_at', 'activity_count'
+        ]
+        read_only_fields = fields
@@ -1,3 +1,186 @@
-from django.test import TestCase
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import activities
+from .models import CustomUser, Permission, Role, UserActivity, UserActivityArchive
+
+
+class CustomUserListQueriesTests(TestCase):
+
+    def setUp(self):
+        self.admin = CustomUser.objects.create(username='admin', email='admin@example.com', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.roles = [Role.objects.create(name='gestor'), Role.objects.create(name='suporte')]
+        self.permission = Permission.objects.create(name='ver_relatorios')
+
+    def create_users(self, total, activities=2):
+        start = CustomUser.objects.count()
+        for i in range(start, start + total):
+            user = CustomUser.objects.create(username=f'user{i}', email=f'user{i}@example.com')
+            user.roles.set(self.roles)
+            user.permissions.add(self.permission)
+            UserActivity.objects.bulk_create(
+                UserActivity(user=user, title=f'Atividade {n}', description='') for n in range(activities)
+            )
+
+    def test_list_query_count_does_not_grow_with_users(self):
+        self.create_users(3)
+        # usuários + papéis + permissões
+        with self.assertNumQueries(3):
+            small = self.client.get('/api/users/')
+
+        self.create_users(20, activities=5)
+        with self.assertNumQueries(3):
+            large = self.client.get('/api/users/')
+
+        self.assertEqual(len(small.json()['results']), 4)
+        self.assertEqual(len(large.json()['results']), 24)
+
+    def test_list_is_compact_with_activity_count(self):
+        self.create_users(1, activities=3)
+
+        response = self.client.get('/api/users/', {'roles': ['gestor', 'suporte']})
+
+        [user] = response.json()['results']
+        self.assertNotIn('activities', user)
+        self.assertEqual(user['activity_count'], 3)
+        self.assertEqual(sorted(user['roles']), ['gestor', 'suporte'])
+        self.assertEqual(user['permissions'], ['ver_relatorios'])
+
+    def test_list_is_cursor_paginated(self):
+        self.create_users(5, activities=0)
+
+        first = self.client.get('/api/users/', {'page_size': 4}).json()
+        second = self.client.get(first['next']).json()
+
+        ids = [user['id'] for user in first['results'] + second['results']]
+        self.assertEqual(len(ids), 6)
+        self.assertEqual(len(set(ids)), 6)
+        self.assertIsNone(second['next'])
+
+    def test_ordering_by_non_unique_field_pages_without_gaps(self):
+        self.create_users(5, activities=0)
+
+        first = self.client.get('/api/users/', {'ordering': 'status', 'page_size': 2}).json()
+        pages = [first]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).json())
+
+        ids = [user['id'] for page in pages for user in page['results']]
+        expected = list(CustomUser.objects.order_by('status', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_detail_keeps_activities_with_constant_queries(self):
+        self.create_users(1, activities=4)
+        user = CustomUser.objects.exclude(pk=self.admin.pk).get()
+
+        # usuário + papéis + permissões + atividades
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/users/{user.id}/')
+
+        self.assertEqual(len(response.json()['activities']), 4)
+
+
+class UserActivityFeedTests(TestCase):
+
+    def setUp(self):
+        self.admin = CustomUser.objects.create(username='admin', email='admin@example.com', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.user = CustomUser.objects.create(username='ana', email='ana@example.com')
+
+    def add_activity(self, date, title='Perfil atualizado'):
+        return UserActivity.objects.create(user=self.user, title=title, description='', date=date)
+
+    def test_feed_pages_by_date_and_id_without_gaps(self):
+        same_time = timezone.now()
+        created = [self.add_activity(same_time, f'A{i}') for i in range(5)]
+
+        first = self.client.get(f'/api/activities/{self.user.id}/', {'page_size': 3}).json()
+        second = self.client.get(first['next']).json()
+
+        ids = [row['id'] for row in first['results'] + second['results']]
+        self.assertEqual(ids, [activity.id for activity in reversed(created)])
+        self.assertIsNone(second['next'])
+
+    def test_archive_moves_old_rows_into_monthly_rows_in_chunks(self):
+        old = timezone.make_aware(datetime(2024, 3, 10, 12))
+        for day in range(3):
+            self.add_activity(old + timedelta(days=day))
+        self.add_activity(old + timedelta(days=40))
+        recent = self.add_activity(timezone.now())
+        UserActivityArchive.objects.create(
+            user=self.user, month=old.date().replace(day=1), total=1,
+            entries=[['2024-03-01T08:00:00+02:00', 'Usuário criado', '', 'person_add']],
+        )
+
+        call_command('archive_user_activities', days=30, chunk_size=2, stdout=StringIO())
+
+        self.assertEqual(list(UserActivity.objects.values_list('id', flat=True)), [recent.id])
+        march, april = UserActivityArchive.objects.order_by('month')
+        self.assertEqual((march.total, april.total), (4, 1))
+        self.assertEqual(march.entries[0][1], 'Usuário criado')
+        self.assertEqual(len(march.entries), 4)
+
+
+class ActivityLoggingTests(TestCase):
+
+    def setUp(self):
+        self.admin = CustomUser.objects.create(username='admin', email='admin@example.com', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.user = CustomUser.objects.create(username='ana', email='ana@example.com')
+        self.buffer = activities.ActivityBuffer(size=3, interval=60)
+        patcher = mock.patch.object(activities, 'activity_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.buffer.flush)
+
+    def toggle(self):
+        return self.client.patch(f'/api/users/{self.user.id}/toggle_status/')
+
+    def test_events_are_queued_after_commit_and_written_in_one_insert(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.toggle()
+            self.toggle()
+
+        self.assertEqual(self.buffer.pending(), 2)
+        self.assertFalse(UserActivity.objects.exists())
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(
+            list(UserActivity.objects.order_by('id').values_list('title', flat=True)),
+            ['Status desativado', 'Status ativado'],
+        )
+
+    def test_full_buffer_flushes_by_itself(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(3):
+                activities.log_activity(self.user.id, 'Pontos do ranking', icon='star')
+
+        self.assertEqual(self.buffer.pending(), 0)
+        self.assertEqual(UserActivity.objects.filter(user=self.user).count(), 3)
+
+    def test_rolled_back_write_logs_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                activities.log_activity(self.user, 'Perfil atualizado')
+                raise RuntimeError
+
+        self.assertEqual(self.buffer.pending(), 0)
+
+    @override_settings(USER_ACTIVITY_LOG_ASYNC=False)
+    def test_sync_mode_writes_inside_the_request(self):
+        self.toggle()
+
+        self.assertEqual(self.buffer.pending(), 0)
+        self.assertEqual(UserActivity.objects.get(user=self.user).icon, 'toggle_inactive')
@@ -2,26 +2,51 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
+from .activities import log_activity
 from .models import CustomUser, Role, UserActivity
 from rest_framework.permissions import IsAuthenticated
-from .serializers import CustomUserSerializer, RoleSerializer, UserActivitySerializer
+from .pagination import ActivityCursorPagination, UserCursorPagination
+from .serializers import CustomUserListSerializer, CustomUserSerializer, RoleSerializer, UserActivitySerializer
 
 class CustomUserViewSet(viewsets.ModelViewSet):
     queryset = CustomUser.objects.all()
     serializer_class = CustomUserSerializer
+    pagination_class = UserCursorPagination
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['status']
     search_fields = ['phone', 'name', 'email']
     ordering_fields = ['name', 'email', 'phone', 'status', 'created_at']
+    ordering = UserCursorPagination.ordering
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().prefetch_related('roles', 'permissions')
         roles = self.request.query_params.getlist('roles')
         if roles:
-            queryset = queryset.filter(roles__name__in=roles)
+            # distinct: um usuário com vários dos papéis pedidos aparece uma vez
+            queryset = queryset.filter(roles__name__in=roles).distinct()
+
+        if self.action == 'list':
+            # Contagem numa subquery: não multiplica as linhas com o filtro por papéis
+            activity_count = UserActivity.objects.filter(user=OuterRef('pk')).order_by().values('user').annotate(
+                total=Count('id')
+            ).values('total')
+            queryset = queryset.annotate(
+                activity_count=Coalesce(Subquery(activity_count, output_field=IntegerField()), 0)
+            )
+        else:
+            queryset = queryset.prefetch_related(
+                Prefetch('activities', queryset=UserActivity.objects.order_by('-date'))
+            )
         return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return CustomUserListSerializer
+        return super().get_serializer_class()
     
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def me(self, request):
@@ -35,8 +60,8 @@ class CustomUserViewSet(viewsets.ModelViewSet):
         user.save()
         
         # Registrar atividade
-        UserActivity.objects.create(
-            user=user,
+        log_activity(
+            user,
             title=f"Status {'ativado' if user.status == 'active' else 'desativado'}",
             description=f"O status do usuário foi alterado para {user.status}.",
             icon='toggle_' + user.status
@@ -46,8 +71,8 @@ class CustomUserViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         user = serializer.save()
-        UserActivity.objects.create(
-            user=user,
+        log_activity(
+            user,
             title="Usuário criado",
             description=f"Usuário {user.name} foi criado.",
             icon="person_add"
@@ -55,8 +80,8 @@ class CustomUserViewSet(viewsets.ModelViewSet):
 
     def perform_update(self, serializer):
         user = serializer.save()
-        UserActivity.objects.create(
-            user=user,
+        log_activity(
+            user,
             title="Perfil atualizado",
             description=f"Os dados do usuário {user.name} foram atualizados.",
             icon="edit"
@@ -67,8 +92,11 @@ class RoleViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = RoleSerializer
 
 class UserActivityViewSet(viewsets.ReadOnlyModelViewSet):
+    # Só a tabela principal (atividades recentes); as antigas ficam em
+    # UserActivityArchive, movidas por 'manage.py archive_user_activities'
     serializer_class = UserActivitySerializer
+    pagination_class = ActivityCursorPagination
 
     def get_queryset(self):
         user_id = self.kwargs.get('user_id')
-        return UserActivity.objects.filter(user_id=user_id).order_by('-date')
\ No newline at end of file
+        return UserActivity.objects.filter(user_id=user_id).order_by('-date', '-id')
\ No newline at end of file